@@ -10,7 +10,7 @@ import os
 import logging
 
 # Import flask and template operators
-from flask import Flask, flash, send_file, send_from_directory, request, abort, render_template, url_for
+from flask import Flask, flash, send_file, send_from_directory, request, abort, render_template, url_for, appcontext_pushed
 from flask_migrate import Migrate
 from flask_admin import Admin, AdminIndexView
 from flask_mail import Mail
@@ -53,31 +53,53 @@ Path(path.join(DEFAULT_PATH,'userdata')).mkdir(parents=True, exist_ok=True)
 ########################
 # Load pretrained models
 ########################
-from app.readers import read_vocab, read_cosines
+import threading
+from app.readers import load_vocab, load_cosines, vocab_size
 from app.multilinguality import read_language_codes, read_stopwords
-from sklearn.feature_extraction.text import CountVectorizer
 
 LANGUAGE_CODES = read_language_codes()
-models = dict()
-for LANG in app.config['LANGS']:
-    models[LANG] = {}
-    spm_vocab_path = join(DEFAULT_PATH, f'api/models/{LANG}/{LANG}wiki.16k.vocab')
-    ft_path = join(DEFAULT_PATH, f'api/models/{LANG}/{LANG}wiki.16k.cos')
-    vocab, inverted_vocab, logprobs = read_vocab(spm_vocab_path)
+
+def load_models(lang):
+    """ Load the models of a language: vocabulary, vectorizer,
+    query expansion neighbours and stopwords.
+    """
+    from sklearn.feature_extraction.text import CountVectorizer
+    logging.info(f">> Loading models for {lang}")
+    spm_vocab_path = join(DEFAULT_PATH, f'api/models/{lang}/{lang}wiki.16k.vocab')
+    ft_path = join(DEFAULT_PATH, f'api/models/{lang}/{lang}wiki.16k.cos')
+    vocab, inverted_vocab, logprobs = load_vocab(spm_vocab_path)
     vectorizer = CountVectorizer(vocabulary=vocab, lowercase=True, token_pattern='[^ ]+')
-    ftcos = read_cosines(ft_path)
-    models[LANG]['vocab'] = vocab
-    models[LANG]['inverted_vocab'] = inverted_vocab
-    models[LANG]['logprobs'] = logprobs
-    models[LANG]['vectorizer'] = vectorizer
-    models[LANG]['nns'] = ftcos
-    if LANG in LANGUAGE_CODES:
-        models[LANG]['stopwords'] = read_stopwords(LANGUAGE_CODES[LANG].lower())
+    ftcos = load_cosines(ft_path, vocab, spm_vocab_path)
+    lang_models = {}
+    lang_models['vocab'] = vocab
+    lang_models['inverted_vocab'] = inverted_vocab
+    lang_models['logprobs'] = logprobs
+    lang_models['vectorizer'] = vectorizer
+    lang_models['nns'] = ftcos
+    if lang in LANGUAGE_CODES:
+        lang_models['stopwords'] = read_stopwords(LANGUAGE_CODES[lang].lower())
     else:
-        models[LANG]['stopwords'] = []
+        lang_models['stopwords'] = []
+    return lang_models
+
+class Models(dict):
+    """ The models of each language, loaded on first use,
+    so that a process only loads the languages it needs.
+    """
+    lock = threading.Lock()
+
+    def __missing__(self, lang):
+        if lang not in app.config['LANGS']:
+            raise KeyError(lang)
+        with self.lock:
+            if lang not in self:
+                self[lang] = load_models(lang)
+        return dict.__getitem__(self, lang)
+
+models = Models()
 
 # All vocabs have the same vector size
-VEC_SIZE = len(models[first_lang]['vocab'])
+VEC_SIZE = vocab_size(join(DEFAULT_PATH, f'api/models/{first_lang}/{first_lang}wiki.16k.vocab'))
 
 ########################
 # Jinja global variables
@@ -139,10 +161,34 @@ app.register_blueprint(auth_module)
 # ..
 
 # Build the database:
-# This will create the database file using SQLAlchemy
+# This will create the database file using SQLAlchemy, the first
+# time an app context is pushed (by a request, a CLI command or
+# warm_up) rather than when the app is imported.
 # db.drop_all()
-with app.app_context():
-    db.create_all()
+_db_created = False
+_db_lock = threading.Lock()
+@appcontext_pushed.connect_via(app)
+def create_db(sender, **kwargs):
+    global _db_created
+    if _db_created:
+        return
+    with _db_lock:
+        if not _db_created:
+            _db_created = True
+            db.create_all()
+
+# Work that does not need to happen when the app is imported,
+# e.g. by CLI commands, is done when a worker serves its first
+# request (or in warm_up).
+_worker_started = False
+@app.before_request
+def start_worker():
+    global _worker_started
+    if not _worker_started:
+        _worker_started = True
+        # Remote instances are discovered in the background, so that
+        # workers do not wait for peers to answer before serving.
+        start_refresher()
 
 @app.before_request
 def check_under_maintenance():
@@ -167,28 +213,32 @@ def reroute_for_maintenance(path):
 dir_path = dirname(realpath(__file__))
 pod_dir = getenv("PODS_DIR", join(dir_path, 'pods'))
 
-if not app.config['LIVE_MATRIX']:
-    from app.search.score_pages import mk_vec_matrix
-    for LANG in app.config['LANGS']:
-        npzs = glob(join(pod_dir,'*',LANG,'*.u.*npz'))
-        if len(npzs) == 0:
-            continue
-        m, bins, podnames, urls = mk_vec_matrix(LANG)
-        models[LANG]['m'] = m
-        models[LANG]['mbins'] = bins
-        models[LANG]['podnames'] = podnames
-        models[LANG]['urls'] = urls
+def warm_up(langs=None):
+    """ Optional warm-up hook for web workers (see
+    deployment/gunicorn.conf.py): load the models of the given
+    languages (by default all of them) and, unless LIVE_MATRIX
+    is set, their search matrices, so that the first search is
+    fast. Otherwise, all of this happens on first use.
+    """
+    global _worker_started
+    from app.search.score_pages import load_vec_matrix
+    if langs is None:
+        langs = app.config['LANGS']
+    _worker_started = True
+    start_refresher()
+    for lang in langs:
+        models[lang]
+        if not app.config['LIVE_MATRIX']:
+            load_vec_matrix(lang)
 
 
 #######################
 # Decentralized search
 #######################
 
-from app.search.cross_instance_search import filter_instances_by_language
+from app.search.cross_instance_search import start_refresher
 from flask import url_for
 
-instances, M, _  = filter_instances_by_language()
-
 _sitename_check_completed = False
 @app.before_request
 def check_sitename_and_hostname():
@@ -206,7 +256,7 @@ def check_sitename_and_hostname():
 from flask_admin.contrib.sqla import ModelView
 from app.api.models import Pods, Urls, User, Personalization, Suggestions
 from app.utils_db import delete_url_representations, delete_pod_representations, \
-        rm_from_npz, add_to_npz, create_pod_in_db, create_pod_npz_pos, rm_doc_from_pos, update_db_idvs_after_npz_delete
+        get_npz_vector, rm_from_npz, add_to_npz, create_pod_in_db, create_pod_npz_pos, mv_doc_in_pos
 
 from flask_admin import expose
 from flask_admin.contrib.sqla.view import ModelView
@@ -319,11 +369,10 @@ class UrlsModelView(ModelView):
                 try:
                     pod_path = create_pod_npz_pos(contributor, new_theme, lang)
                     create_pod_in_db(contributor, new_theme, lang)
-                    idv, v = rm_from_npz(model.vector, old_pod)
-                    update_db_idvs_after_npz_delete(idv, old_pod)
-                    add_to_npz(v, pod_path+'.npz')
-                    #Removing from pos but not re-adding since current version does not make use of positional index. To fix.
-                    rm_doc_from_pos(model.id, old_pod)
+                    v = get_npz_vector(model.vector, old_pod)
+                    rm_from_npz(model.vector, old_pod)
+                    model.vector = add_to_npz(v, pod_path+'.npz')
+                    mv_doc_in_pos(model.id, old_pod, new_pod)
                     self.session.commit()
                     #If pod empty, delete
                     if len(db.session.query(Urls).filter_by(pod=old_pod).all()) == 0:
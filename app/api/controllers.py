@@ -7,16 +7,14 @@ import json
 import numpy as np
 from os import remove, getenv
 from os.path import dirname, join, realpath, isfile
-from flask import Blueprint, jsonify, request, render_template, url_for
+from flask import Blueprint, jsonify, request, render_template, url_for, make_response
 from scipy.sparse import vstack, save_npz, load_npz
 from app.forms import SearchForm
 from app.api.models import Urls, Pods
 from app.auth.decorators import check_permissions, check_is_confirmed
 from app import app, db, models
-from app.indexer.posix import load_posix, dump_posix
-from app.indexer.vectorizer import scale
 from app.search.controllers import get_local_search_results, prepare_gui_results
-from app.search.score_pages import mk_podsum_matrix
+from app.indexer.signature import load_signature
 from app.utils_db import delete_pod_representations, create_suggestion_in_db
 
 # Define the blueprint:
@@ -42,12 +40,21 @@ def return_identity_info():
 @api.route('/signature/<lang>/', methods=["GET", "POST"])
 def return_instance_signature(lang):
     """Returns the signature of this instance for a language.
-    For use by other PeARS instances."""
-    _, podsum = mk_podsum_matrix(lang)
-    podsum = np.array(podsum)
-    podsum = scale(podsum) #L2 normalization
-    signature = np.sum(podsum, axis=0)
-    return json.dumps(signature.tolist())
+    For use by other PeARS instances.
+    With format=sparse, the signature is returned as the
+    indices and values of its non-zero dimensions. The ETag
+    changes whenever the signature does, so peers can send
+    conditional requests.
+    """
+    etag, signature = load_signature(lang)
+    if request.args.get('format') == 'sparse':
+        indices = np.nonzero(signature)[0]
+        response = jsonify(version=etag, size=len(signature), \
+                indices=indices.tolist(), values=signature[indices].tolist())
+    else:
+        response = make_response(json.dumps(signature.tolist()))
+    response.set_etag(etag)
+    return response.make_conditional(request)
 
 @api.route('/search', methods=["GET"])
 def return_query_results():
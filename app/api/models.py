@@ -77,7 +77,7 @@ class Urls(Base):
     snippet = db.Column(db.String(1000))
     frame_annotations = db.Column(db.String(1000))
     doctype = db.Column(db.String(1000))
-    vector = db.Column(db.Integer)
+    vector = db.Column(db.Integer) # Stable id of the document's row in its pod
     pod = db.Column(db.String(1000))
     notes = db.Column(db.String(1000))
     img = db.Column(db.String(1000))
@@ -21,12 +21,13 @@ import click
 from werkzeug.security import generate_password_hash
 from scipy.sparse import load_npz, csr_matrix, vstack
 from app.framing import femicide_suggestor
-from app.indexer.controllers import run_indexer_url, index_doc_from_cli
-from app.indexer.access import request_url
+from app.indexer.controllers import run_indexer_url, run_indexer_urls, index_doc_from_cli
+from app.indexer.access import request_url, robotcheck
 from app.indexer.posix import load_posix
+from app.indexer.pod_segments import load_pod_matrix
 from app.indexer.htmlparser import extract_links
 from app.orchard.mk_urls_file import get_reindexable_pod_for_admin
-from app import db, User, Urls, Pods, VEC_SIZE
+from app import app, db, User, Urls, Pods, VEC_SIZE
 
 pears = Blueprint('pears', __name__)
 
@@ -108,6 +109,15 @@ def install_language(lang):
         except Exception:
             print("Request failed when trying to access", path, "...")
 
+    # Compile the vocabulary and the neighbour file
+    from app.readers import read_vocab, compile_vocab, compile_cosines
+    try:
+        compile_vocab(join(local_dir, lang+'wiki.16k.vocab'))
+        vocab, _, _ = read_vocab(join(local_dir, lang+'wiki.16k.vocab'))
+        compile_cosines(join(local_dir, lang+'wiki.16k.cos'), vocab, join(local_dir, lang+'wiki.16k.vocab'))
+    except Exception:
+        print("Could not compile the model files for", lang, "...")
+
 
 
 ###########################
@@ -164,6 +174,18 @@ def backup(backupdir):
     copytree(pod_dir, join(dirpath,'pods'))
 
 
+@pears.cli.command('compact')
+def compact():
+    '''Merge the segments of all pods into their npz files
+    and recompute the instance signatures'''
+    from app.indexer.pod_segments import compact_pod
+    from app.indexer.signature import rebuild_signature
+    for npz_path in glob(join(pod_dir,'*','*','*.u.*npz')):
+        compact_pod(npz_path)
+    for lang in app.config['LANGS']:
+        rebuild_signature(lang)
+
+
 #########################
 # ADMIN INDEXING TOOLS
 #########################
@@ -171,7 +193,9 @@ def backup(backupdir):
 @pears.cli.command('index')
 @click.argument('host_url')
 @click.argument('filepath')
-def index(host_url, filepath):
+@click.option('--batch-size', default=100, help='Number of URLs indexed per batch.')
+@click.option('--workers', default=8, help='Number of pages fetched concurrently.')
+def index(host_url, filepath, batch_size, workers):
     '''
     Index from a manual created URL file.
     The file should have the following information,
@@ -179,6 +203,7 @@ def index(host_url, filepath):
     url; theme; lang; note; contributor
     with one url per line.
     Use from CLI with flask pears index <your site's domain> <path>
+    URLs are fetched concurrently and indexed in batches.
     '''
     # make sure the host_url starts with https:// so that it can be parsed correctly by urllib.parse.urlparse 
     if not host_url.startswith("https://"):
@@ -187,6 +212,7 @@ def index(host_url, filepath):
     users = User.query.all()
     for user in users:
         Path(join(pod_dir,user.username)).mkdir(parents=True, exist_ok=True)
+    entries = []
     with open(filepath, encoding="utf-8") as f:
         for line in f:
             m = re.match(r"^(.+?);(.+?);;(.+?)$", line)
@@ -194,7 +220,8 @@ def index(host_url, filepath):
             url = m.group(1)
             pod = m.group(2)
             user = m.group(3)
-            run_indexer_url(url, pod, None, user, host_url)
+            entries.append((url, pod, user))
+    run_indexer_urls(entries, host_url, batch_size, workers)
 
 
 @pears.cli.command('randomcrawl')
@@ -215,12 +242,18 @@ def random_crawl(n, username):
         parse = urlparse(url)
         domain = parse.scheme+'://'+parse.netloc
         print(url, pod)
+        links = []
         access, _, _ = request_url(url)
         if access:
             links = extract_links(url)
         for link in links:
-            if domain in link:
-                print(link+';'+pod+';;'+username)
+            if domain not in link:
+                continue
+            try:
+                if robotcheck(link):
+                    print(link+';'+pod+';;'+username)
+            except requests.RequestException as e:
+                click.echo(f"Could not get robots.txt for {link}, skipping it: {e}", err=True)
 
 
 @pears.cli.command('getlinks')
@@ -231,7 +264,11 @@ def get_links(url):
     if access:
         links = extract_links(url)
         for link in links:
-            print(link)
+            try:
+                if robotcheck(link):
+                    print(link)
+            except requests.RequestException as e:
+                click.echo(f"Could not get robots.txt for {link}, skipping it: {e}", err=True)
     else:
         print("Access denied.")
 
@@ -418,7 +455,7 @@ def check_npz_to_idx_vs_idx_to_url(pod, username, language):
 def check_npz_vs_npz_to_idx(pod, username, language):
     print("\t>> CHECKING NPZ_TO_IDX VS IDX_TO_URL")
     pod_path = join(pod_dir, username, language, pod+'.npz')
-    pod_m = load_npz(pod_path)
+    pod_m = load_pod_matrix(pod_path)
     pod_path = join(pod_dir, username, language, pod+'.npz.idx')
     npz_to_idx = joblib.load(pod_path)
     if pod_m.shape[0] != len(npz_to_idx[0]):
@@ -430,11 +467,7 @@ def check_pos_vs_npz_to_idx(pod, username, language):
     pod_path = join(pod_dir, username, language, pod+'.npz.idx')
     npz_to_idx = joblib.load(pod_path)
     posindex = load_posix(username, language, pod.split(".")[0])
-    idx = []
-    for token_id in posindex:
-        for doc_id, _ in token_id.items():
-            idx.append(doc_id)
-    idx1 = list(set(idx))
+    idx1 = posindex.doc_ids().tolist()
     idx2 = npz_to_idx[1][1:] #Ignore first value, which is -1
     if set(idx2) != set(idx1):
         print("\t\t> ERROR: idx in npz_to_idx do not match doc list in positional index")
@@ -450,7 +483,10 @@ def check_pos_vs_npz_to_idx(pod, username, language):
 @click.argument('basedir')
 def rebuild_from_db(basedir):
     from app.cli.rebuild import rebuild_pods_and_urls, rebuild_users, rebuild_personalization
+    from app.indexer.signature import rebuild_signature
     rebuild_pods_and_urls(pod_dir, basedir)
+    for lang in app.config['LANGS']:
+        rebuild_signature(lang)
     rebuild_users(basedir)
     rebuild_personalization(basedir)
 
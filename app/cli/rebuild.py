@@ -1,12 +1,10 @@
 # Scripts to rebuild a database and pods from backups
 from os.path import join
-import joblib
-from pathlib import Path
 import numpy as np
 import pandas as pd
-from scipy.sparse import vstack, load_npz, save_npz, csr_matrix
 from sqlalchemy import create_engine
-from app import db, VEC_SIZE
+from app import db
+from app.indexer.pod_segments import load_live_rows, id_rows, write_pod
 from app.api.models import User, Personalization
 from app.utils_db import create_or_replace_url_in_db, create_pod_in_db, create_pod_npz_pos
 
@@ -44,59 +42,46 @@ def rebuild_users(basedir):
         db.session.commit()
 
 def rebuild_pods_and_urls(pod_dir, basedir):
+    """ Rebuild the pods and urls of a backup. Each url keeps
+    the stable id of its row, and rows that were deleted in the
+    backup, or that no url points to, are left out.
+    """
     source_db = 'sqlite:///' + join(basedir, 'app.db')
     source_pod_dir = join(basedir, 'pods')
     cnx = create_engine(source_db).connect()
     df = pd.read_sql_table('pods', cnx)
+    dfu = pd.read_sql_table('urls', cnx)
     for _, p in df.iterrows():
         print(f"\n\n POD {p['name']}")
-        dfu = pd.read_sql_table('urls', cnx)
         urls = dfu.loc[dfu['pod'] == p['name']]
         theme = p['name'].split('.u.')[0]
         username = p['name'].split('.u.')[1]
         lang = p['language']
-        try:
-            idx_path = join(source_pod_dir, username, username+'.idx')
-            idx_to_url = joblib.load(idx_path)
-            print(">> Shape idx to url:", len(idx_to_url))
-        except:
-            continue
-        
-        try:
-            npz_idx_path = join(source_pod_dir, username, lang, p['name']+'.npz.idx')
-            npz_to_idx = joblib.load(npz_idx_path)
-            print(">> Shape npz to idx:", len(idx_to_url))
-        except:
-            continue
 
         try:
             npz_path = join(source_pod_dir, username, lang, p['name']+'.npz')
-            npz = load_npz(npz_path).toarray()
+            npz, ids, next_id = load_live_rows(npz_path)
             print(">> Shape npz:", npz.shape)
         except:
             continue
 
-        user_dir = join(pod_dir, username, lang)
-        Path(user_dir).mkdir(parents=True, exist_ok=True)
         create_pod_in_db(username, theme, lang)
-        new_npz_path = join(pod_dir, username, lang, p['name']+'.npz')
-        m = np.zeros((1,VEC_SIZE))
-        m = csr_matrix(m)
-        
+        new_npz_path = create_pod_npz_pos(username, theme, lang)+'.npz'
+        vids = []
         for _, url in urls.iterrows():
             try:
-                k = idx_to_url[1].index(url['url'])
-                idx = idx_to_url[0][k]
-                k = npz_to_idx[1].index(idx)
-                row = npz_to_idx[0][k]
-                v = npz[row]
-                m = vstack((m,v))
-                vector = m.shape[0]-1
+                vid = int(url['vector'])
+                _, found = id_rows(ids, [vid])
+                if not found[0]:
+                    raise IndexError(f"No row with id {vid}")
+                vids.append(vid)
                 notes = ''
                 if url['notes']:
                     notes = url['notes']
-                create_or_replace_url_in_db(url['url'], url['title'], vector, url['snippet'], theme, lang, notes, url['share'], url['contributor'], url['doctype'])
+                frame_annotations = url.get('frame_annotations') or ''
+                create_or_replace_url_in_db(url['url'], url['title'], vid, url['snippet'], frame_annotations, theme, lang, notes, url['share'], url['contributor'], url['doctype'])
             except:
                     print(">> CLI:REBUILD DB: Problem with url",url['url'])
-        save_npz(new_npz_path, m)
-
+        if vids:
+            rows, _ = id_rows(ids, np.unique(vids))
+            write_pod(new_npz_path, npz[rows], ids[rows], next_id)
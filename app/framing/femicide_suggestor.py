@@ -1,11 +1,9 @@
 import glob
 import time
 
-import requests
-
 import pandas as pd
 
-from app import app, db
+from app import app, db, utils_http
 from app.api.models import Suggestions
 from app.utils_db import create_suggestion_in_db
 
@@ -20,7 +18,7 @@ def suggest_femicides():
         records_df = pd.read_json(records_file, orient="records", lines=True)
         known_urls = list(records_df["link"])
 
-    r = requests.post(
+    r = utils_http.post(
         url="https://responsibility-framing-femicide-detector.hf.space/crawl",
         headers={"Content-Type": "application/json", "Authorization": f"Bearer {app.config['HF_TOKEN']}"},
         json={"known_urls": known_urls}
@@ -31,7 +29,7 @@ def suggest_femicides():
     crawl_complete = False
     while not crawl_complete:
         time.sleep(10)
-        r = requests.get(
+        r = utils_http.get(
             url=f"https://responsibility-framing-femicide-detector.hf.space/progress/{thread_id}",
             headers={"Content-Type": "application/json", "Authorization": f"Bearer {app.config['HF_TOKEN']}"}            
         )
@@ -42,7 +40,7 @@ def suggest_femicides():
         else:
             print(f"Crawling in progress (thread_id={thread_id}), found {status['progress']} new articles so far")
 
-    r = requests.get(
+    r = utils_http.get(
         url=f"https://responsibility-framing-femicide-detector.hf.space/get_data/{thread_id}",
         headers={"Content-Type": "application/json", "Authorization": f"Bearer {app.config['HF_TOKEN']}"}            
     )
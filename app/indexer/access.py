@@ -1,39 +1,77 @@
 import logging
+import threading
+from collections import OrderedDict
+from time import time
 from urllib.parse import urlparse
 from os.path import join
 import re
-import requests
-from app import app
+from app import utils_http
 
-def robotcheck(url):
-    scheme = urlparse(url).scheme
-    domain = scheme + '://' + urlparse(url).netloc
-    robot_url = join(domain,"robots.txt")
+# Parsed robots.txt rules are cached per domain for
+# ROBOTS_TTL seconds. The least recently used domains
+# are evicted beyond ROBOTS_CACHE_SIZE entries.
+ROBOTS_TTL = 3600
+ROBOTS_CACHE_SIZE = 1024
 
+robots_cache = OrderedDict()
+robots_lock = threading.Lock()
+
+
+def parse_robots(domain, content):
+    """ Compile the Disallow rules of the User-agent: *
+    section of a robots.txt file into regexes over
+    full URLs.
+    """
     disallowed = []
-    r = requests.head(robot_url, timeout=30)
+    parse = False
+    for l in content.splitlines():
+        if 'User-agent: *' in l:
+            parse = True
+        elif 'User-agent' in l and parse is True:
+            parse = False
+        elif l == 'Disallow: /' and parse is True:
+            disallowed.append(domain)
+        elif 'Disallow:' in l and parse is True:
+            m = re.search(r'Disallow:\s*(.+)',l)
+            if m:
+                u = m.group(1)
+                if u[0] == '/':
+                    u = u[1:]
+                disallowed.append(join(domain,u))
+    return [(u, re.compile(u.replace('*','.*'))) for u in disallowed]
+
+
+def get_robot_rules(domain):
+    """ Return the compiled robots.txt rules for a domain,
+    from the cache if they are fresh enough. A missing
+    robots.txt means no rules.
+    """
+    now = time()
+    with robots_lock:
+        if domain in robots_cache:
+            rules, fetched = robots_cache[domain]
+            if now - fetched < ROBOTS_TTL:
+                robots_cache.move_to_end(domain)
+                return rules
+    rules = []
+    r = utils_http.get(join(domain,"robots.txt"))
     if r.status_code < 400:
-        parse = False
-        content = requests.get(robot_url).text.splitlines()
-        for l in content:
-            if 'User-agent: *' in l:
-                parse = True
-            elif 'User-agent' in l and parse is True:
-                parse = False
-            elif l == 'Disallow: /' and parse is True:
-                disallowed.append(domain)
-            elif 'Disallow:' in l and parse is True:
-                m = re.search('Disallow:\s*(.+)',l)
-                if m:
-                    u = m.group(1)
-                    if u[0] == '/':
-                        u = u[1:]
-                    disallowed.append(join(domain,u))
+        rules = parse_robots(domain, r.text)
+    with robots_lock:
+        robots_cache[domain] = (rules, now)
+        robots_cache.move_to_end(domain)
+        while len(robots_cache) > ROBOTS_CACHE_SIZE:
+            robots_cache.popitem(last=False)
+    return rules
+
+
+def robotcheck(url):
+    scheme = urlparse(url).scheme
+    domain = scheme + '://' + urlparse(url).netloc
 
     getpage = True
-    for u in disallowed:
-        m = re.search(u.replace('*','.*'),url)
-        if m:
+    for u, regex in get_robot_rules(domain):
+        if regex.search(url):
             error = "ERROR: robotcheck: "+url+" is disallowed because of "+u
             logging.error(error)
             getpage = False
@@ -44,9 +82,8 @@ def request_url(url):
     access = None
     req = None
     errs = []
-    headers = {'User-Agent': app.config['USER-AGENT']}
     try:
-        req = requests.head(url, timeout=30, headers=headers)
+        req = utils_http.head(url)
     except:
         error = "ERROR: request_url: request timed out."
         logging.error(error)
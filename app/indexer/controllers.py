@@ -5,7 +5,8 @@
 import logging
 from os import getenv
 from os.path import dirname, join, realpath
-from time import sleep
+from time import sleep, time
+from concurrent.futures import ThreadPoolExecutor
 import hashlib
 from flask import session, Blueprint, request, render_template, url_for, flash, redirect
 from flask_login import login_required, current_user
@@ -19,7 +20,9 @@ from app.indexer import mk_page_vector
 from app.utils import read_urls, parse_query
 from app.utils_db import create_pod_in_db, create_pod_npz_pos, create_or_replace_url_in_db, delete_url_representations, create_suggestion_in_db
 from app.indexer.access import request_url
-from app.indexer.posix import posix_doc
+from app.indexer.posix import posix_doc, posix_docs
+from app.indexer.pod_segments import append_to_pod
+from app.search.matrix_store import add_to_matrix
 from app.forms import IndexerForm, ManualEntryForm, SuggestionForm
 
 app_dir_path = dirname(dirname(realpath(__file__)))
@@ -228,14 +231,15 @@ def run_indexer_url(url, theme, note, contributor, host_url):
         except:
             messages.append(gettext('ERROR: Content type could not be retrieved from header.'))
             return indexed, messages, share_url
-        success, text, lang, title, snippet, frame_annotations, idv, mgs = \
+        success, text, lang, title, snippet, frame_annotations, idv, vec, mgs = \
                 mk_page_vector.compute_vector(url, theme, contributor, url_type)
         if success:
             create_pod_in_db(contributor, theme, lang)
-            #posix_doc(text, idx, contributor, lang, theme)
             share_url = join(host_url,'api', 'get?url='+url)
-            create_or_replace_url_in_db(\
+            doc_id = create_or_replace_url_in_db(\
                     url, title, idv, snippet, frame_annotations, theme, lang, note, share_url, contributor, 'url')
+            posix_doc(text, doc_id, contributor, lang, theme)
+            add_to_matrix(lang, url, vec)
             indexed = True
         else:
             messages.extend(mgs)
@@ -244,6 +248,111 @@ def run_indexer_url(url, theme, note, contributor, host_url):
     return indexed, messages, share_url
 
 
+def fetch_url(url, contributor):
+    """ Check that a URL can be indexed, retrieve it and extract
+    its content. Run by the worker pool of run_indexer_urls,
+    so it does not touch the database or the pods.
+
+    Returns: the extracted page (see mk_page_vector.extract_page)
+    and a list of error messages.
+    """
+    try:
+        access, req, request_errors = request_url(url)
+        if not access:
+            return None, request_errors
+        if 'Content-Type' not in req.headers:
+            return None, ["ERROR: Content type could not be retrieved from header."]
+        title, snippet, lang, frame_annotations, text, error = \
+                mk_page_vector.extract_page(url, contributor, req.headers['Content-Type'])
+    except Exception as e:
+        return None, [f"ERROR: fetch_url: {e}"]
+    if error is not None:
+        return None, [error]
+    return (title, snippet, lang, frame_annotations, text), []
+
+
+def index_batch(batch, host_url, workers):
+    """ Index a batch of (url, theme, contributor) entries.
+    Pages are fetched concurrently, then vectorised together
+    per language. The vectors of each pod are appended to it
+    as one segment and the database is committed once.
+
+    Returns: the number of URLs indexed.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pages = list(executor.map(lambda e: fetch_url(e[0], e[2]), batch))
+
+    docs = {}
+    for (url, theme, contributor), (page, errors) in zip(batch, pages):
+        if page is None:
+            for error in errors:
+                print(f">> INDEXER: index_batch: {url}: {error}")
+            continue
+        title, snippet, lang, frame_annotations, text = page
+        docs.setdefault(lang, []).append((url, theme, contributor, title, snippet, frame_annotations, text))
+
+    indexed = []
+    positional = []
+    for lang, lang_docs in docs.items():
+        tokenized_texts = [mk_page_vector.tokenize_text(d[-1], lang) for d in lang_docs]
+        X = mk_page_vector.compute_vectors(lang, tokenized_texts)
+        pods = {}
+        for i, d in enumerate(lang_docs):
+            if X[i].nnz == 0:
+                print(f">> INDEXER: index_batch: {d[0]}: empty document vector")
+                continue
+            pods.setdefault((d[2], d[1]), []).append(i)
+        for (contributor, theme), rows in pods.items():
+            pod_path = create_pod_npz_pos(contributor, theme, lang)
+            create_pod_in_db(contributor, theme, lang)
+            first = append_to_pod(pod_path+'.npz', X[rows])
+            for k, i in enumerate(rows):
+                url, _, _, title, snippet, frame_annotations, _ = lang_docs[i]
+                share_url = join(host_url,'api', 'get?url='+url)
+                create_or_replace_url_in_db(url, title, first+k, snippet, frame_annotations, \
+                        theme, lang, '', share_url, contributor, 'url', commit=False)
+                indexed.append((lang, url, X[i]))
+            positional.append((contributor, theme, lang, [lang_docs[i][0] for i in rows], \
+                    [tokenized_texts[i] for i in rows]))
+    db.session.commit()
+    for contributor, theme, lang, urls, texts in positional:
+        doc_ids = dict(db.session.query(Urls.url, Urls.id).filter(Urls.url.in_(urls)).all())
+        posix_docs(texts, [doc_ids[url] for url in urls], contributor, lang, theme)
+    for lang, url, vec in indexed:
+        add_to_matrix(lang, url, vec)
+    return len(indexed)
+
+
+def run_indexer_urls(entries, host_url, batch_size=100, workers=8):
+    """ Run the indexer over many (url, theme, contributor)
+    entries, e.g. from a URL file, in batches of batch_size
+    URLs fetched by a pool of workers. Prints throughput
+    after each batch.
+    """
+    start = time()
+    seen = set()
+    batch = []
+    n_urls = 0
+    n_indexed = 0
+    for entry in entries:
+        if entry[0] in seen:
+            continue
+        seen.add(entry[0])
+        batch.append(entry)
+        if len(batch) == batch_size:
+            n_indexed += index_batch(batch, host_url, workers)
+            n_urls += len(batch)
+            batch = []
+            elapsed = time() - start
+            print(f">> INDEXER: {n_indexed}/{n_urls} URLs indexed in {elapsed:.1f}s ({n_urls / elapsed:.2f} URLs/s)")
+    if batch:
+        n_indexed += index_batch(batch, host_url, workers)
+        n_urls += len(batch)
+    elapsed = time() - start
+    print(f">> INDEXER: {n_indexed}/{n_urls} URLs indexed in {elapsed:.1f}s ({n_urls / max(elapsed, 1e-6):.2f} URLs/s)")
+    return n_indexed
+
+
 def run_indexer_manual(url, title, doc, theme, lang, note, contributor, host_url):
     """ Run the indexer over manually contributed information.
     
@@ -255,13 +364,14 @@ def run_indexer_manual(url, title, doc, theme, lang, note, contributor, host_url
     messages = []
     indexed = False
     create_pod_npz_pos(contributor, theme, lang)
-    success, text, snippet, frame_annotations, idv = mk_page_vector.compute_vector_local_docs(\
+    success, text, snippet, frame_annotations, idv, vec = mk_page_vector.compute_vector_local_docs(\
             title, doc, theme, lang, contributor)
     share_url = join(host_url,'api', 'get?url='+url)
     if success:
         create_pod_in_db(contributor, theme, lang)
-        #posix_doc(text, idx, contributor, lang, theme)
-        create_or_replace_url_in_db(url, title, idv, snippet, frame_annotations, theme, lang, note, share_url, contributor, 'doc')
+        doc_id = create_or_replace_url_in_db(url, title, idv, snippet, frame_annotations, theme, lang, note, share_url, contributor, 'doc')
+        posix_doc(text, doc_id, contributor, lang, theme)
+        add_to_matrix(lang, url, vec)
         indexed = True
     else:
         messages.append(gettext("There was a problem indexing your entry. Please check the submitted data."))
@@ -276,13 +386,15 @@ def index_doc_from_cli(title, doc, theme, lang, contributor, url, note, host_url
     if u:
         return False #URL exists already
     create_pod_npz_pos(contributor, theme, lang)
-    success, text, snippet, frame_annotations, idv = \
+    success, text, snippet, frame_annotations, idv, vec = \
             mk_page_vector.compute_vector_local_docs(title, doc, theme, lang, contributor)
     if success:
         create_pod_in_db(contributor, theme, lang)
         share_url = join(host_url,'api', 'get?url='+url)
-        create_or_replace_url_in_db(\
-                url, title, idv, snippet, theme, lang, note, share_url, contributor, 'url')
+        doc_id = create_or_replace_url_in_db(\
+                url, title, idv, snippet, frame_annotations, theme, lang, note, share_url, contributor, 'url')
+        posix_doc(text, doc_id, contributor, lang, theme)
+        add_to_matrix(lang, url, vec)
         return True
     else:
         return False
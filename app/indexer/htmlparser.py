@@ -4,14 +4,13 @@
 
 import re
 import logging
-import requests
 from urllib.parse import urljoin
 from bs4 import BeautifulSoup
 import justext
 from langdetect import detect
-from app.indexer.access import request_url
+from app.indexer.access import request_url, robotcheck
 from app.indexer import detect_open
-from app import app, LANGUAGE_CODES
+from app import app, utils_http, LANGUAGE_CODES
 from app.utils import remove_emails
 
 def remove_boilerplates(response, lang):
@@ -33,9 +32,8 @@ def remove_boilerplates(response, lang):
 def BS_parse(url):
     bs_obj = None
     req = None
-    headers = {'User-Agent': app.config['USER-AGENT']}
     try:
-        req = requests.head(url, timeout=30, headers=headers)
+        req = utils_http.head(url)
     except Exception:
         logging.eror(f"\t>> ERROR: BS_parse: request.head failed trying to access {url}...")
         pass
@@ -43,7 +41,7 @@ def BS_parse(url):
         logging.error(f"\t>> ERROR: BS_parse: Not a HTML document...")
         return bs_obj, req
     try:
-        req = requests.get(url, allow_redirects=True, timeout=30, headers=headers)
+        req = utils_http.get(url, allow_redirects=True)
         req.encoding = 'utf-8'
     except Exception:
         logging.error(f"\t>> ERROR: BS_parse: request failed trying to access {url}...")
@@ -54,9 +52,10 @@ def BS_parse(url):
 
 def extract_links(url):
     links = []
-    headers = {'User-Agent': app.config['USER-AGENT']}
     try:
-        req = requests.head(url, timeout=30, headers=headers)
+        if not robotcheck(url):
+            return links
+        req = utils_http.head(url)
         if req.status_code >= 400:
             logging.error(f"\t>> ERROR: extract_links: status code is {req.status_code}")
             return links
@@ -64,7 +63,7 @@ def extract_links(url):
             logging.error(f"\t>> ERROR: Not a HTML document...")
             return links
     except Exception:
-        logging.error(f"\t>> ERROR: extract_links: request.head failed trying to access {url}...")
+        logging.error(f"\t>> ERROR: extract_links: could not access {url}...")
         return links
     bs_obj, req = BS_parse(url)
     if not bs_obj:
@@ -0,0 +1,56 @@
+# SPDX-FileCopyrightText: 2025 PeARS Project, <community@pearsproject.org>,
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import logging
+from os.path import isfile
+import joblib
+import numpy as np
+from scipy.sparse import csc_matrix, load_npz
+
+
+def invix_path(npz_path):
+    """ The inverted index of a pod lives next to its
+    npz matrix, with the .inv extension."""
+    return npz_path[:-len('.npz')]+'.inv'
+
+
+def mk_invix(pod_m):
+    """ Make the inverted index for a pod matrix. This is
+    a boolean CSC matrix: column i is the posting list of
+    subword i, i.e. the rows of the pod matrix with a
+    non-zero weight for that subword.
+    """
+    invix = csc_matrix(pod_m, dtype=bool)
+    invix.eliminate_zeros()
+    return invix
+
+
+def load_invix(npz_path):
+    """ Load the inverted index of a pod. It covers the
+    rows of the pod's npz file, not those of its segments.
+    Pods indexed before inverted indices existed get one
+    built from their npz matrix on first load.
+    """
+    path = invix_path(npz_path)
+    if not isfile(path):
+        logging.debug(f">> INDEXER: load_invix: building inverted index for {npz_path}")
+        invix = mk_invix(load_npz(npz_path))
+        dump_invix(invix, npz_path)
+        return invix
+    return joblib.load(path)
+
+
+def dump_invix(invix, npz_path):
+    joblib.dump(invix, invix_path(npz_path))
+
+
+def candidate_rows(invix, dims):
+    """ Return the sorted union of the posting lists
+    for the given subword ids. Only these rows can have
+    a non-zero cosine with a query over those dimensions.
+    """
+    postings = [invix.indices[invix.indptr[d]:invix.indptr[d+1]] for d in dims]
+    if len(postings) == 0:
+        return np.array([], dtype=np.int32)
+    return np.unique(np.concatenate(postings))
@@ -3,33 +3,52 @@
 # SPDX-License-Identifier: AGPL-3.0-only
 
 import logging
+import threading
+from functools import lru_cache
 from os.path import dirname, join, realpath
 from os import getenv
 import numpy as np
-import requests
 import json
-from scipy.sparse import csr_matrix, vstack, save_npz, load_npz
-from app import models, VEC_SIZE, DEFAULT_PATH
-from app.api.models import sp
+import sentencepiece as spm
+from app import models, utils_http, VEC_SIZE, DEFAULT_PATH
 from app.indexer.htmlparser import extract_html
 from app.indexer.pdfparser import extract_txt
-from app.indexer.vectorizer import vectorize_scale
+from app.indexer.vectorizer import vectorize_batch, vectorize_ids
+from app.indexer.pod_segments import append_to_pod
 from app.utils import timer
 from app.utils_db import create_pod_npz_pos
 
 dir_path = dirname(dirname(realpath(__file__)))
 pod_dir = getenv("PODS_DIR", join(dir_path, 'pods'))
 
+# Number of query words whose tokens and vectors are cached
+WORD_CACHE_SIZE = 10000
+
+sp_lock = threading.Lock()
+
+
+def get_sp(lang):
+    """ Return the SentencePiece processor for a language,
+    loading the model included in the install only once.
+    """
+    if 'sp' not in models[lang]:
+        with sp_lock:
+            if 'sp' not in models[lang]:
+                processor = spm.SentencePieceProcessor()
+                processor.load(join(DEFAULT_PATH, f'api/models/{lang}/{lang}wiki.16k.model'))
+                models[lang]['sp'] = processor
+    return models[lang]['sp']
+
+
 def tokenize_text(text, lang, stringify = True):
-    """ Load the SentencePiece model included in the install
-    and tokenize the given text.
+    """ Tokenize the given text with the SentencePiece
+    model of its language.
 
     Arguments: the text to be tokenized.
     """
-    sp.load(join(DEFAULT_PATH, f'api/models/{lang}/{lang}wiki.16k.model'))
-    tokens = [wp for wp in sp.encode_as_pieces(text.lower())]
+    tokens = get_sp(lang).encode_as_pieces(text.lower())
     if stringify:
-        text = ' '.join([wp for wp in sp.encode_as_pieces(text.lower())])
+        text = ' '.join(tokens)
         #print("TOKENIZED",text)
         #print([(t, logprobs[vocab[t]]) for t in text.split()])
         return text
@@ -37,7 +56,7 @@ def tokenize_text(text, lang, stringify = True):
 
 
 def get_frame_annotations(text, lang):
-    r = requests.get("https://responsibility-framing-sociofillmore-public.hf.space/sociofillmore", params={"text": text[:250], "language": lang})
+    r = utils_http.get("https://responsibility-framing-sociofillmore-public.hf.space/sociofillmore", params={"text": text[:250], "language": lang})
     if r.status_code != 200:
         print(f"WARNING: sociofillmore error when processing text:\t{text}")
         print(f"\n\tStatus code {r.status_code}\n\tError message: {r.text}")
@@ -51,17 +70,51 @@ def get_frame_annotations(text, lang):
             frames.append(frame)
     return ", ".join(frames)
 
-def compute_and_stack_new_vec(lang, tokenized_text, pod_m):
+def compute_and_stack_new_vec(lang, tokenized_text, npz_path):
     """ Given the tokenized text, compute a new vector
-    and stack it onto the existing matrix for that pod.
+    and append it to the matrix for that pod, as a new
+    segment.
+
+    Returns: the id of the new row, the vector itself
+    and whether it was added.
     """
-    v = vectorize_scale(lang, tokenized_text, 5, VEC_SIZE) #log prob power 5
-    if np.sum(v) != 0:
-        logging.debug(f"compute_and_stack_new_vec 1 {pod_m.shape[0]}")
-        pod_m = vstack((pod_m,csr_matrix(v)))
-        logging.debug(f"compute_and_stack_new_vec 2 {pod_m.shape[0]}")
-        return pod_m, True
-    return pod_m, False
+    v = vectorize_batch(lang, [tokenized_text], 5, VEC_SIZE) #log prob power 5
+    if v.nnz != 0:
+        idv = append_to_pod(npz_path, v)
+        logging.debug(f"compute_and_stack_new_vec: new row {idv}")
+        return idv, v, True
+    return None, None, False
+
+
+def extract_page(url, contributor, url_type):
+    """ Retrieve the page at the target URL, extract its
+    title, text and snippet, and annotate it with frames.
+    This only involves network calls and parsing, so it
+    can run concurrently for many URLs.
+
+    Returns: title, snippet, language, frame annotations,
+    the text to be vectorised and an error (None on success).
+    """
+    if 'text/html' in url_type:
+        title, body_str, lang, snippet, cc, error = extract_html(url)
+    elif 'application/pdf' in url_type:
+        title, body_str, lang, snippet, cc, error = extract_txt(url, contributor)
+    else:
+        error = ">> INDEXER: MK_PAGE_VECTORS: ERROR: compute_vectors: No supported content type."
+    if error is not None:
+        return None, None, None, None, None, error
+    logging.info(f"TITLE {title} SNIPPET {snippet} CC {cc} ERROR {error}")
+    frame_annotations = get_frame_annotations(title + " " + body_str, lang)
+    text = title + " " + body_str + "\n" + frame_annotations
+    return title, snippet, lang, frame_annotations, text, None
+
+
+def compute_vectors(lang, tokenized_texts):
+    """ Vectorise a batch of tokenized documents in one
+    call. Gives the same vectors as compute_and_stack_new_vec,
+    one row per document, as a CSR matrix.
+    """
+    return vectorize_batch(lang, tokenized_texts, 5, VEC_SIZE) #log prob power 5
 
 
 def compute_vector(url, theme, contributor, url_type):
@@ -72,28 +125,17 @@ def compute_vector(url, theme, contributor, url_type):
     print("Computing vector for", url, "(",theme,")")
     messages = []
     print("CONTENT TYPE",url_type)
-    if 'text/html' in url_type:
-        title, body_str, lang, snippet, cc, error = extract_html(url)
-    elif 'application/pdf' in url_type:
-        title, body_str, lang, snippet, cc, error = extract_txt(url, contributor)
-    else:
-        error = ">> INDEXER: MK_PAGE_VECTORS: ERROR: compute_vectors: No supported content type."
+    title, snippet, lang, frame_annotations, text, error = extract_page(url, contributor, url_type)
     if error is None:
-        logging.info(f"TITLE {title} SNIPPET {snippet} CC {cc} ERROR {error}")
         create_pod_npz_pos(contributor, theme, lang)
         user_dir = join(pod_dir, contributor, lang)
         npz_path = join(user_dir,theme+'.u.'+contributor+'.npz')
-        pod_m = load_npz(npz_path)
-        frame_annotations = get_frame_annotations(title + " " + body_str, lang)
-        text = title + " " + body_str + "\n" + frame_annotations
         tokenized_text = tokenize_text(text, lang)
-        pod_m, success = compute_and_stack_new_vec(lang, tokenized_text, pod_m)
+        idv, v, success = compute_and_stack_new_vec(lang, tokenized_text, npz_path)
         if success:
-            save_npz(npz_path,pod_m)
-            idv = pod_m.shape[0]-1
-            return True, tokenized_text, lang, title, snippet, frame_annotations, idv, messages
+            return True, tokenized_text, lang, title, snippet, frame_annotations, idv, v, messages
     messages.append(">> INDEXER ERROR: compute_vectors: error during parsing")
-    return False, None, None, None, None, None, None, messages
+    return False, None, None, None, None, None, None, None, messages
 
 
 def compute_vector_local_docs(title, doc, theme, lang, contributor):
@@ -102,22 +144,50 @@ def compute_vector_local_docs(title, doc, theme, lang, contributor):
     """
     user_dir = join(pod_dir, contributor, lang)
     npz_path = join(user_dir,theme+'.u.'+contributor+'.npz')
-    pod_m = load_npz(npz_path)
     #print("Computing vectors for", target_url, "(",theme,")",lang)
     frame_annotations = get_frame_annotations(title + ". " + theme + ". " + doc, lang)
     text = title + ". " + theme + ". " + doc + "\n" + frame_annotations
     orig_text = text
     text = tokenize_text(text, lang)
-    pod_m, success = compute_and_stack_new_vec(lang, text, pod_m)
+    vid, v, success = compute_and_stack_new_vec(lang, text, npz_path)
     if doc != "":
         snippet = doc[:500]+'...'
     else:
         snippet = title
     if success:
-        save_npz(npz_path,pod_m)
-        vid = pod_m.shape[0]-1
-        return True, text, snippet, frame_annotations, vid
-    return False, text, snippet, None, None
+        return True, text, snippet, frame_annotations, vid, v
+    return False, text, snippet, None, None, None
+
+@lru_cache(maxsize=WORD_CACHE_SIZE)
+def compute_word_vectors(word, lang, expansion_length=None):
+    """ Tokenize and vectorize a single query word, with and
+    without query expansion. Results are cached, since the
+    same words come back in many queries. Vectors are kept
+    sparse in the cache.
+    """
+    nn_ids, nn_lens = models[lang]['nns']
+    vocab = models[lang]['vocab']
+    w = tokenize_text(word, lang, stringify=False)
+
+    # Add similar tokens
+    sims = [vocab[i] for i in w if len(i) > 1 and i in vocab]
+    for wtoken in w:
+        if len(wtoken.replace('▁','')) > 3:
+            if wtoken not in vocab:
+                continue
+            row = vocab[wtoken]
+            n = nn_lens[row]
+            if expansion_length:
+                n = min(n, expansion_length)
+            neighbours = nn_ids[row, :n]
+            sims.extend(neighbours[neighbours >= 0])
+    sims = sorted(set(int(i) for i in sims))
+
+    v = vectorize_batch(lang, [' '.join(w)], 5, len(w)) #log prob power 5
+    v_expanded = vectorize_ids(lang, sims, 5)
+    sims = [str(models[lang]['inverted_vocab'][i]) for i in sims]
+    return tuple(w), tuple(sims), v, v_expanded
+
 
 def compute_query_vectors(query, lang, expansion_length=None):
     """ Make query vectors: the vector for the original
@@ -127,39 +197,20 @@ def compute_query_vectors(query, lang, expansion_length=None):
     model and vectorizing.
     """
     print("QUERY LANG",lang)
-    nns = models[lang]['nns']
     words = query.split()
     print("QUERY SPLIT:",words)
 
-    # Individual words tokenized
     words_tokenized = []
-    for w in words:
-        words_tokenized.append(tokenize_text(w, lang, stringify=False))
-    print("WORDS TOKENIZED:",words_tokenized)
-
-    # Add similar tokens
     words_tokenized_expanded = []
-    for w in words_tokenized:
-        sims = [i for i in w if len(i) > 1]
-        for wtoken in w:
-            if len(wtoken.replace('▁','')) > 3:
-                if wtoken not in nns:
-                    continue
-                if expansion_length:
-                    neighbours = [n for n in nns[wtoken] if len(n) > 2][:expansion_length]
-                else:
-                    neighbours = [n for n in nns[wtoken] if len(n) > 2]
-                sims.extend(neighbours)
-        sims = list(set(sims))
-        words_tokenized_expanded.append(sims)
-    print("WORDS TOKENIZED EXPANDED:",words_tokenized_expanded)
-    logging.debug(f"WORDS TOKENIZED EXPANDED {words_tokenized_expanded}")
-
     v_query = []
-    for w in words_tokenized:
-        v_query.append(vectorize_scale(lang, ' '.join(w), 5, len(w))) #log prob power 5
     v_query_expanded = [] # A list of neighbourhood vectors, one for each word in the query
-    for nns in words_tokenized_expanded:
-        v_query_expanded.append(vectorize_scale(lang, ' '.join(nns), 5, len(nns)))
-    #print(csr_matrix(v))
+    for word in words:
+        w, sims, v, v_expanded = compute_word_vectors(word, lang, expansion_length)
+        words_tokenized.append(list(w))
+        words_tokenized_expanded.append(list(sims))
+        v_query.append(v.toarray())
+        v_query_expanded.append(v_expanded.toarray())
+    print("WORDS TOKENIZED:",words_tokenized)
+    print("WORDS TOKENIZED EXPANDED:",words_tokenized_expanded)
+    logging.debug(f"WORDS TOKENIZED EXPANDED {words_tokenized_expanded}")
     return words_tokenized, words_tokenized_expanded, v_query, v_query_expanded
@@ -7,13 +7,12 @@ import subprocess
 from shutil import which
 from os import getenv, remove
 from os.path import join, dirname, realpath
-import requests
 from urllib.parse import urljoin
 from bs4 import BeautifulSoup
 from pdfminer.high_level import extract_pages
 from pdfminer import pdfparser, pdfdocument
 from langdetect import detect
-from app import app
+from app import app, utils_http
 from app.indexer import detect_open
 from app.api.models import installed_languages
 from app.utils import remove_emails
@@ -62,7 +61,7 @@ def extract_txt(url, contributor):
     snippet_length = app.config['SNIPPET_LENGTH']
     local_pdf_path = join(app_dir_path, 'userdata', contributor+'.'+url.split('/')[-1])
     try:
-        req = requests.get(url, allow_redirects=True, timeout=30)
+        req = utils_http.get(url, allow_redirects=True)
         req.encoding = 'utf-8'
         with open(local_pdf_path,'wb') as f_out:
             f_out.write(req.content)
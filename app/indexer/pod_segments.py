@@ -0,0 +1,307 @@
+# SPDX-FileCopyrightText: 2025 PeARS Project, <community@pearsproject.org>,
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import fcntl
+import logging
+import threading
+from contextlib import contextmanager, nullcontext
+from os import listdir, remove, rename
+from os.path import isdir, isfile, join
+from pathlib import Path
+import numpy as np
+from scipy.sparse import csr_matrix, load_npz, vstack
+from app.indexer.inverted_index import mk_invix, dump_invix
+from app.indexer.signature import signature_add, signature_rm
+
+# A pod is compacted in the background once it has
+# accumulated this many segments, or this many deleted rows.
+MAX_SEGMENTS = 32
+MAX_TOMBSTONES = 64
+
+
+def segments_dir(npz_path):
+    """ The segments of a pod are stored in a directory
+    next to its npz file, as 0.npz, 1.npz, etc. in the order
+    in which they were appended. The rows of a pod are the
+    rows of its npz file followed by the rows of each segment.
+
+    Each row has a stable id, which is what the database
+    records (Urls.vector). Ids are allocated in increasing order
+    and never reused, and each file stores the ids of its rows,
+    so that compaction can drop deleted rows without touching
+    the database. Files written before ids existed number their
+    rows consecutively.
+    """
+    return npz_path[:-len('.npz')]+'.segs'
+
+
+@contextmanager
+def pod_lock(npz_path, exclusive=True):
+    """ Lock a pod against concurrent appends and compaction.
+    Readers take a shared lock.
+    """
+    seg_dir = segments_dir(npz_path)
+    Path(seg_dir).mkdir(parents=True, exist_ok=True)
+    with open(join(seg_dir, 'lock'), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _files(npz_path):
+    """ Return the path and row ids of the npz file of a pod
+    and of each of its segments, and the next free id.
+    """
+    with np.load(npz_path) as f:
+        n = int(f['shape'][0])
+        ids = f['ids'] if 'ids' in f.files else np.arange(n)
+        next_id = int(f['next_id']) if 'next_id' in f.files else n
+    files = [(npz_path, ids)]
+    for _, s in list_segments(npz_path):
+        with np.load(s) as f:
+            ids = f['ids'] if 'ids' in f.files else next_id + np.arange(int(f['shape'][0]))
+        files.append((s, ids))
+        if len(ids) > 0:
+            next_id = max(next_id, int(ids[-1]) + 1)
+    return files, next_id
+
+
+def _ids(npz_path):
+    files, _ = _files(npz_path)
+    return np.concatenate([ids for _, ids in files]).astype(np.int64)
+
+
+def id_rows(ids, vids):
+    """ Map row ids to row numbers, given the ids of all the
+    rows of a pod (which are sorted).
+
+    Returns: the row numbers, and whether each id was found.
+    """
+    vids = np.asarray(vids, dtype=np.int64)
+    rows = np.minimum(np.searchsorted(ids, vids), max(len(ids) - 1, 0))
+    found = ids[rows] == vids if len(ids) > 0 else np.zeros(len(vids), dtype=bool)
+    return rows, found
+
+
+def _save(f, m, **kwargs):
+    np.savez_compressed(f, indices=m.indices, indptr=m.indptr, format=m.format.encode('ascii'), \
+            shape=m.shape, data=m.data, **kwargs)
+
+
+def _watermark(npz_path):
+    """ Segments numbered below the watermark have already
+    been merged into the npz file of the pod. It is stored
+    in the npz file itself, so that compaction is atomic.
+    """
+    with np.load(npz_path) as f:
+        if 'compacted' in f.files:
+            return int(f['compacted'])
+    return 0
+
+
+def list_segments(npz_path):
+    """ Return the (number, path) of each segment of a pod
+    that has not been merged into its npz file yet.
+    """
+    seg_dir = segments_dir(npz_path)
+    if not isdir(seg_dir):
+        return []
+    watermark = _watermark(npz_path)
+    segs = sorted(int(f[:-len('.npz')]) for f in listdir(seg_dir) if f.endswith('.npz'))
+    return [(n, join(seg_dir, str(n)+'.npz')) for n in segs if n >= watermark]
+
+
+def tombstones_path(npz_path):
+    """ Deleted rows are not removed from a pod straight away:
+    their ids are appended to a tombstone file, and they are
+    dropped when the pod is next compacted.
+    """
+    return join(segments_dir(npz_path), 'deleted')
+
+
+def _tombstones(npz_path):
+    if not isfile(tombstones_path(npz_path)):
+        return np.zeros(0, dtype=np.int64)
+    return np.fromfile(tombstones_path(npz_path), dtype=np.int64)
+
+
+def _dead_rows(npz_path):
+    """ The rows of a pod whose ids are in its tombstones."""
+    rows, found = id_rows(_ids(npz_path), _tombstones(npz_path))
+    return np.unique(rows[found])
+
+
+def zero_rows(m, rows):
+    """ Zero some rows of a CSR matrix, in place."""
+    dead = np.zeros(m.shape[0], dtype=bool)
+    dead[rows] = True
+    m.data[np.repeat(dead, np.diff(m.indptr))] = 0
+    m.eliminate_zeros()
+    return m
+
+
+def _load(npz_path):
+    ms = [load_npz(npz_path)] + [load_npz(s) for _, s in list_segments(npz_path)]
+    if len(ms) == 1:
+        return ms[0].tocsr()
+    return csr_matrix(vstack(ms))
+
+
+def load_pod(npz_path, live=True):
+    """ Load the full matrix of a pod and the ids of its rows.
+    Pods without segments, including those made before segments
+    existed, are just their npz file. Deleted rows are zero,
+    unless live is False, in which case they are kept until
+    compaction.
+    """
+    if not isdir(segments_dir(npz_path)):
+        return load_npz(npz_path), _ids(npz_path)
+    with pod_lock(npz_path, exclusive=False):
+        m = _load(npz_path)
+        ids = _ids(npz_path)
+        dead = _dead_rows(npz_path)
+    if live and len(dead) > 0:
+        m = zero_rows(m, dead)
+    return m, ids
+
+
+def load_pod_matrix(npz_path, live=True):
+    return load_pod(npz_path, live)[0]
+
+
+def _live_rows(npz_path):
+    m = _load(npz_path)
+    ids = _ids(npz_path)
+    _, next_id = _files(npz_path)
+    keep = np.ones(m.shape[0], dtype=bool)
+    keep[_dead_rows(npz_path)] = False
+    return m[keep], ids[keep], next_id
+
+
+def load_live_rows(npz_path):
+    """ Load the rows of a pod that are not deleted, their
+    ids and the next free id of the pod, e.g. to restore it
+    from a backup. Pods without segments are not locked, so
+    that reading them leaves their directory untouched.
+    """
+    exists = isdir(segments_dir(npz_path))
+    with pod_lock(npz_path, exclusive=False) if exists else nullcontext():
+        return _live_rows(npz_path)
+
+
+def _find_row(npz_path, vid):
+    """ The row of a pod with id vid, or None if there is none.
+    Must be called with the pod lock held.
+    """
+    files, _ = _files(npz_path)
+    for path, ids in files:
+        rows, found = id_rows(ids, [vid])
+        if found[0]:
+            return load_npz(path).tocsr()[rows[0]]
+    return None
+
+
+def load_pod_row(npz_path, vid):
+    """ Return the row of a pod with id vid, reading only the
+    file that contains it.
+    """
+    with pod_lock(npz_path, exclusive=False):
+        row = _find_row(npz_path, vid)
+    if row is None:
+        raise IndexError(f"No row with id {vid} in {npz_path}")
+    return row
+
+
+def append_to_pod(npz_path, rows):
+    """ Append rows to a pod as a new immutable segment,
+    without rewriting the rest of the pod.
+
+    Returns: the id of the first appended row. The others
+    follow consecutively.
+    """
+    rows = csr_matrix(rows)
+    with pod_lock(npz_path):
+        segs = list_segments(npz_path)
+        _, first = _files(npz_path)
+        if segs:
+            n = segs[-1][0] + 1
+        else:
+            n = _watermark(npz_path)
+        seg_path = join(segments_dir(npz_path), str(n)+'.npz')
+        with open(seg_path+'.tmp', 'wb') as f:
+            _save(f, rows, ids=first + np.arange(rows.shape[0]))
+        rename(seg_path+'.tmp', seg_path)
+    signature_add(npz_path, rows)
+    if len(segs) + 1 >= MAX_SEGMENTS:
+        threading.Thread(target=compact_pod, args=(npz_path,), daemon=True).start()
+    return first
+
+
+def _write_pod_matrix(npz_path, m, ids, next_id):
+    """ Replace the npz file of a pod with m, which holds all
+    its rows, and drop the segments. The npz file is replaced
+    atomically and records the segments it includes, so a crash
+    never leaves rows counted twice. Must be called with the
+    pod lock held.
+    """
+    m = csr_matrix(m)
+    segs = list_segments(npz_path)
+    watermark = segs[-1][0] + 1 if segs else _watermark(npz_path)
+    with open(npz_path+'.tmp', 'wb') as f:
+        _save(f, m, compacted=watermark, ids=ids, next_id=next_id)
+    rename(npz_path+'.tmp', npz_path)
+    dump_invix(mk_invix(m), npz_path)
+    for _, s in segs:
+        remove(s)
+
+
+def write_pod(npz_path, m, ids, next_id):
+    """ Replace all the rows of a pod with m, whose rows have
+    the given (sorted) ids. Ids from next_id on are free.
+    """
+    with pod_lock(npz_path):
+        _write_pod_matrix(npz_path, m, np.asarray(ids, dtype=np.int64), next_id)
+        if isfile(tombstones_path(npz_path)):
+            remove(tombstones_path(npz_path))
+
+
+def compact_pod(npz_path):
+    """ Merge the segments of a pod into its npz file and
+    drop its deleted rows, which already left the signature
+    when they were deleted. The other rows keep their ids.
+    """
+    try:
+        with pod_lock(npz_path):
+            if not list_segments(npz_path) and len(_tombstones(npz_path)) == 0:
+                return
+            logging.info(f">> INDEXER: compact_pod: compacting {npz_path}")
+            m, ids, next_id = _live_rows(npz_path)
+            _write_pod_matrix(npz_path, m, ids, next_id)
+            if isfile(tombstones_path(npz_path)):
+                remove(tombstones_path(npz_path))
+    except Exception as e:
+        logging.error(f">> INDEXER: compact_pod: could not compact {npz_path}: {e}")
+
+
+def rm_from_pod(npz_path, vid):
+    """ Mark the row of a pod with id vid as deleted, and
+    remove it from the signature straight away, so that peers
+    stop routing queries to it. The row itself is dropped when
+    the pod is compacted, which happens in the background every
+    MAX_TOMBSTONES deletions.
+    """
+    with pod_lock(npz_path):
+        tombstones = _tombstones(npz_path)
+        if vid in tombstones:
+            return
+        row = _find_row(npz_path, vid)
+        with open(tombstones_path(npz_path), 'ab') as f:
+            f.write(np.array([vid], dtype=np.int64).tobytes())
+        n = len(tombstones) + 1
+    if row is not None:
+        signature_rm(npz_path, row)
+    if n >= MAX_TOMBSTONES:
+        threading.Thread(target=compact_pod, args=(npz_path,), daemon=True).start()
@@ -1,45 +1,511 @@
+import fcntl
 import joblib
+import logging
+import threading
 from glob import glob
-from os import getenv
-from os.path import join, dirname, realpath
+from uuid import uuid4
+from contextlib import contextmanager
+from os import getenv, listdir, remove, rename, stat
+from os.path import join, dirname, realpath, isdir, isfile
+from pathlib import Path
+import numpy as np
 from app import models
-    
+from app.readers import save_array
+from app.indexer.pod_segments import pod_lock
+
 dir_path = dirname(dirname(realpath(__file__)))
 pod_dir = getenv("PODS_DIR", join(dir_path, 'pods'))
 
+# A positional index is compacted in the background once
+# it has accumulated this many segments, or this many
+# deleted documents.
+MAX_SEGMENTS = 32
+MAX_TOMBSTONES = 64
+
+COLUMNS = ['tokens', 'token_ptr', 'docs', 'pos_ptr', 'deltas', 'fwd_docs', 'fwd_ptr', 'fwd_postings']
+
+# Positional indices read by this process, by path:
+# (file stats, PosIndex)
+loaded = {}
+
+
+def posix_path(contributor, lang, theme):
+    """ The positional index of a pod is a directory next to
+    its npz file (<pod>.pos). Postings are stored column-wise:
+    the token ids that occur in the pod (tokens), for each token
+    the offset of its postings (token_ptr), the doc id of each
+    posting (docs), for each posting the offset of its positions
+    (pos_ptr), and the positions themselves, delta-encoded within
+    each posting (deltas). A forward index lists the postings of
+    each document (fwd_docs, fwd_ptr, fwd_postings). The compacted
+    part of the index is a set of .npy files that are memory-mapped;
+    documents added since are kept as small segments (seg.0.npz,
+    seg.1.npz, ...), and the ids of deleted documents are appended
+    to a tombstone file (deleted) until the next compaction.
+    """
+    return join(pod_dir, contributor, lang, theme+'.u.'+contributor+'.pos')
+
+
+@contextmanager
+def posix_lock(path, exclusive=True):
+    Path(path).mkdir(parents=True, exist_ok=True)
+    with open(join(path, 'lock'), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def smallest(a):
+    """ Store non-negative integers in the smallest type that
+    holds them.
+    """
+    return a.astype(np.min_scalar_type(a.max() if len(a) > 0 else 0))
+
+
+def mk_columns(token_ids, doc_ids, positions):
+    """ Build the columns of a positional index from parallel
+    arrays with one entry per token occurrence.
+    """
+    token_ids = np.asarray(token_ids, dtype=np.int32)
+    doc_ids = np.asarray(doc_ids, dtype=np.int32)
+    positions = np.asarray(positions, dtype=np.int64)
+    order = np.lexsort((positions, doc_ids, token_ids))
+    token_ids, doc_ids, positions = token_ids[order], doc_ids[order], positions[order]
+    new_posting = np.ones(len(token_ids), dtype=bool)
+    new_posting[1:] = (token_ids[1:] != token_ids[:-1]) | (doc_ids[1:] != doc_ids[:-1])
+    posting_starts = np.flatnonzero(new_posting)
+    posting_tokens = token_ids[posting_starts]
+    new_token = np.ones(len(posting_tokens), dtype=bool)
+    new_token[1:] = posting_tokens[1:] != posting_tokens[:-1]
+    token_starts = np.flatnonzero(new_token)
+    deltas = np.diff(positions, prepend=0)
+    deltas[posting_starts] = positions[posting_starts]
+    columns = {'tokens': smallest(posting_tokens[token_starts]),
+            'token_ptr': smallest(np.append(token_starts, len(posting_tokens))),
+            'docs': smallest(doc_ids[posting_starts]),
+            'pos_ptr': smallest(np.append(posting_starts, len(token_ids))),
+            'deltas': smallest(deltas)}
+    columns.update(mk_forward_index(columns['docs']))
+    return columns
+
+
+def mk_forward_index(docs):
+    """ Index the postings of each document, given the doc
+    id of each posting.
+    """
+    order = np.argsort(docs, kind='stable')
+    fwd_docs, starts = np.unique(docs[order], return_index=True)
+    return {'fwd_docs': fwd_docs,
+            'fwd_ptr': smallest(np.append(starts, len(docs))),
+            'fwd_postings': smallest(order)}
+
+
+def ranges(starts, counts):
+    """ Concatenate the ranges [starts[i], starts[i]+counts[i])."""
+    starts = np.asarray(starts, dtype=np.int64)
+    counts = np.asarray(counts, dtype=np.int64)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return np.repeat(starts, counts) + offsets
+
+
+def decode_positions(deltas, pos_ptr):
+    """ Undo the delta encoding of consecutive postings."""
+    positions = np.cumsum(deltas, dtype=np.int64)
+    if len(pos_ptr) > 1:
+        starts = pos_ptr[:-1]
+        offsets = positions[starts] - deltas[starts].astype(np.int64)
+        positions -= np.repeat(offsets, np.diff(pos_ptr))
+    return positions
+
+
+def occurrences(part, postings=None):
+    """ Return the token ids, doc ids and positions of the
+    token occurrences recorded in some columns, for all their
+    postings or only some of them.
+    """
+    posting_tokens = np.repeat(part['tokens'], np.diff(part['token_ptr']))
+    if postings is None:
+        pos_ptr, deltas = part['pos_ptr'], part['deltas']
+        doc_ids = part['docs']
+    else:
+        counts = part['pos_ptr'][postings+1] - part['pos_ptr'][postings]
+        pos_ptr = np.append(0, np.cumsum(counts, dtype=np.int64))
+        deltas = part['deltas'][ranges(part['pos_ptr'][postings], counts)]
+        posting_tokens, doc_ids = posting_tokens[postings], part['docs'][postings]
+    posting_counts = np.diff(pos_ptr)
+    token_ids = np.repeat(posting_tokens, posting_counts)
+    doc_ids = np.repeat(doc_ids, posting_counts)
+    return token_ids, doc_ids, decode_positions(deltas, pos_ptr)
+
+
+def doc_postings(part, doc_ids):
+    """ Return the postings of some documents in some columns,
+    using their forward index.
+    """
+    doc_ids = np.asarray(doc_ids, dtype=np.int64)
+    fwd_docs, fwd_ptr = part['fwd_docs'], part['fwd_ptr']
+    if len(fwd_docs) == 0 or len(doc_ids) == 0:
+        return np.zeros(0, dtype=np.int64)
+    i = np.minimum(np.searchsorted(fwd_docs, doc_ids), len(fwd_docs) - 1)
+    i = i[fwd_docs[i] == doc_ids]
+    return np.asarray(part['fwd_postings'][ranges(fwd_ptr[i], fwd_ptr[i+1] - fwd_ptr[i])], dtype=np.int64)
+
+
+class PosIndex:
+    """ Read access to the positional index of a pod, made of
+    its compacted columns and its segments. The postings of
+    deleted documents are masked.
+    """
+
+    def __init__(self, parts, deleted=None):
+        self.parts = parts
+        self.deleted = np.zeros(0, dtype=np.int64) if deleted is None else np.unique(deleted)
+        self.alive = []
+        for part in parts:
+            dead = doc_postings(part, self.deleted)
+            if len(dead) == 0:
+                self.alive.append(None)
+            else:
+                alive = np.ones(len(part['docs']), dtype=bool)
+                alive[dead] = False
+                self.alive.append(alive)
+
+    def _live(self, k, start, end):
+        """ The live postings of part k between start and end."""
+        if self.alive[k] is None:
+            return np.arange(start, end)
+        return start + np.flatnonzero(self.alive[k][start:end])
+
+    def _postings(self, part, token_id):
+        i = np.searchsorted(part['tokens'], token_id)
+        if i == len(part['tokens']) or part['tokens'][i] != token_id:
+            return 0, 0
+        return part['token_ptr'][i], part['token_ptr'][i+1]
+
+    def docs(self, token_id):
+        """ The sorted ids of the documents containing a token."""
+        docs = []
+        for k, part in enumerate(self.parts):
+            start, end = self._postings(part, token_id)
+            if self.alive[k] is None:
+                docs.append(part['docs'][start:end])
+            else:
+                docs.append(part['docs'][self._live(k, start, end)])
+        if len(docs) == 1:
+            return np.asarray(docs[0])
+        return np.sort(np.concatenate(docs))
+
+    def postings(self, token_id):
+        """ Return the postings of a token: the sorted ids of
+        the documents containing it, and their positions, so that
+        the positions in docs[i] are positions[ptr[i]:ptr[i+1]].
+        """
+        docs, lengths, positions = [], [], []
+        for k, part in enumerate(self.parts):
+            start, end = self._postings(part, token_id)
+            if self.alive[k] is None:
+                pos_ptr = part['pos_ptr'][start:end+1]
+                docs.append(part['docs'][start:end])
+                lengths.append(np.diff(pos_ptr))
+                if end > start:
+                    positions.append(decode_positions(part['deltas'][pos_ptr[0]:pos_ptr[-1]], pos_ptr - pos_ptr[0]))
+            else:
+                _, posting_docs, posting_positions = occurrences(part, self._live(k, start, end))
+                token_docs, counts = np.unique(posting_docs, return_counts=True)
+                docs.append(token_docs)
+                lengths.append(counts)
+                positions.append(posting_positions)
+        docs = np.concatenate(docs)
+        lengths = np.concatenate(lengths)
+        positions = np.concatenate(positions) if positions else np.zeros(0, dtype=np.int64)
+        ptr = np.append(0, np.cumsum(lengths, dtype=np.int64))
+        if len(self.parts) > 1 and np.any(docs[1:] < docs[:-1]):
+            order = np.argsort(docs, kind='stable')
+            positions = np.concatenate([positions[ptr[i]:ptr[i+1]] for i in order])
+            docs, lengths = docs[order], lengths[order]
+            ptr = np.append(0, np.cumsum(lengths, dtype=np.int64))
+        return docs, ptr, positions
+
+    def positions(self, token_id, doc_id):
+        """ The positions of a token in a document."""
+        if doc_id in self.deleted:
+            return np.zeros(0, dtype=np.int64)
+        for part in self.parts:
+            start, end = self._postings(part, token_id)
+            j = start + np.searchsorted(part['docs'][start:end], doc_id)
+            if j < end and part['docs'][j] == doc_id:
+                p0, p1 = part['pos_ptr'][j], part['pos_ptr'][j+1]
+                return decode_positions(part['deltas'][p0:p1], np.array([0, p1-p0]))
+        return np.zeros(0, dtype=np.int64)
+
+    def doc_ids(self):
+        """ The ids of all the documents in the index."""
+        docs = np.unique(np.concatenate([part['fwd_docs'] for part in self.parts]))
+        return np.setdiff1d(docs, self.deleted, assume_unique=True)
+
+    def occurrences(self, doc_ids=None):
+        """ Return the token ids, doc ids and positions of the
+        token occurrences of all live documents, or of some.
+        """
+        occs = []
+        for k, part in enumerate(self.parts):
+            if doc_ids is not None:
+                occs.append(occurrences(part, np.sort(doc_postings(part, np.setdiff1d(doc_ids, self.deleted)))))
+            elif self.alive[k] is None:
+                occs.append(occurrences(part))
+            else:
+                occs.append(occurrences(part, np.flatnonzero(self.alive[k])))
+        token_ids, docs, positions = zip(*occs)
+        return np.concatenate(token_ids), np.concatenate(docs), np.concatenate(positions)
+
+
+def _empty_columns():
+    return mk_columns([], [], [])
+
+
+def _head(path):
+    """ The head of an index records the id of its compacted
+    columns and the number of the first segment that has not
+    been merged into them yet. Replacing it is what makes a
+    compaction visible, atomically.
+    """
+    head_path = join(path, 'head.npy')
+    if not isfile(head_path):
+        return None, 0
+    head = np.load(head_path)
+    return str(head[0]), int(head[1])
+
+
+def _list_segments(path, watermark):
+    segs = sorted(int(f[len('seg.'):-len('.npz')]) for f in listdir(path) \
+            if f.startswith('seg.') and f.endswith('.npz'))
+    return [(n, join(path, 'seg.'+str(n)+'.npz')) for n in segs if n >= watermark]
+
+
+def _load_parts(path):
+    base_id, watermark = _head(path)
+    parts = []
+    if base_id is not None:
+        parts.append({c: np.load(join(path, base_id+'.'+c+'.npy'), mmap_mode='r') \
+                for c in COLUMNS if isfile(join(path, base_id+'.'+c+'.npy'))})
+    for _, seg in _list_segments(path, watermark):
+        with np.load(seg) as f:
+            parts.append({c: f[c] for c in f.files})
+    for part in parts:
+        if 'fwd_docs' not in part:
+            # Made before indices had a forward index
+            part.update(mk_forward_index(np.asarray(part['docs'])))
+    if not parts:
+        parts.append(_empty_columns())
+    return parts
+
+
+def tombstones_path(path):
+    return join(path, 'deleted')
+
+
+def _tombstones(path):
+    if not isfile(tombstones_path(path)):
+        return np.zeros(0, dtype=np.int64)
+    return np.fromfile(tombstones_path(path), dtype=np.int64)
+
+
+def _load(path):
+    return PosIndex(_load_parts(path), _tombstones(path))
+
+
+def _write_columns(path, columns, watermark):
+    """ Replace the compacted columns of an index and drop
+    the segments they include. Must be called with the lock
+    of the index held.
+    """
+    old_id, _ = _head(path)
+    base_id = uuid4().hex
+    for c in COLUMNS:
+        np.save(join(path, base_id+'.'+c+'.npy'), columns[c])
+    save_array(join(path, 'head.npy'), np.array([base_id, str(watermark)]))
+    if old_id is not None:
+        for c in COLUMNS:
+            if isfile(join(path, old_id+'.'+c+'.npy')):
+                remove(join(path, old_id+'.'+c+'.npy'))
+    for n, seg in _list_segments(path, 0):
+        if n < watermark:
+            remove(seg)
+    if isfile(tombstones_path(path)):
+        remove(tombstones_path(path))
+
+
+def _convert_legacy(path):
+    """ Convert a positional index in the old format (a joblib
+    pickle with one dict per vocabulary entry, mapping doc ids to
+    positions joined with '|') to the columnar format.
+    """
+    logging.info(f">> INDEXER: converting positional index {path}")
+    posindex = joblib.load(path)
+    token_ids, doc_ids, positions = [], [], []
+    for token_id, postings in enumerate(posindex):
+        for doc_id, posidx in postings.items():
+            ps = [int(p) for p in posidx.split('|')]
+            token_ids.extend([token_id]*len(ps))
+            doc_ids.extend([doc_id]*len(ps))
+            positions.extend(ps)
+    tmp_path = path+'.'+uuid4().hex+'.tmp'
+    Path(tmp_path).mkdir(parents=True)
+    _write_columns(tmp_path, mk_columns(token_ids, doc_ids, positions), 0)
+    remove(path)
+    rename(tmp_path, path)
+
+
+def convert_legacy(path):
+    """ Convert the positional index at path if it is in the
+    old format. Workers that load it at the same time would
+    race on replacing it, so the conversion is done under the
+    exclusive lock of the pod by whichever comes first.
+    """
+    if not isfile(path):
+        return
+    with pod_lock(path[:-len('.pos')]+'.npz'):
+        if isfile(path):
+            _convert_legacy(path)
+
+
+def create_posix(contributor, lang, theme):
+    """ Create an empty positional index for a new pod."""
+    path = posix_path(contributor, lang, theme)
+    convert_legacy(path)
+    with posix_lock(path):
+        if _head(path)[0] is None:
+            _write_columns(path, _empty_columns(), 0)
+
+
 def load_posix(contributor, lang, theme):
-    posix_path = join(pod_dir, contributor, lang)
-    pod_name = theme+'.u.'+contributor
-    posix = joblib.load(join(posix_path,pod_name+'.pos'))
-    return posix
+    """ Return the positional index of a pod as a PosIndex.
+    It is re-read only when it has changed.
+    """
+    path = posix_path(contributor, lang, theme)
+    convert_legacy(path)
+    if not isdir(path):
+        return PosIndex([_empty_columns()])
+    with posix_lock(path, exclusive=False):
+        head_path = join(path, 'head.npy')
+        key = (stat(head_path).st_mtime_ns if isfile(head_path) else None, tuple(sorted(listdir(path))), \
+                stat(tombstones_path(path)).st_size if isfile(tombstones_path(path)) else 0)
+        if path not in loaded or loaded[path][0] != key:
+            loaded[path] = (key, _load(path))
+    return loaded[path][1]
 
-def dump_posix(posindex, contributor, lang, theme):
-    posix_path = join(pod_dir, contributor, lang)
-    pod_name = theme+'.u.'+contributor
-    joblib.dump(posindex, join(posix_path,pod_name+'.pos'))
 
-def posix_doc(text, doc_id, contributor, lang, theme):
-    pod_name = theme+'.u.'+contributor
-    posindex = load_posix(contributor, lang, theme)
+def mk_doc_columns(texts, doc_ids, lang):
+    """ Build the columns of a positional index for some
+    tokenized documents.
+    """
     vocab = models[lang]['vocab']
-    for pos, token in enumerate(text.split()):
-        if token not in vocab:
-            # tqdm.write(f"WARNING: token \"{token}\" not found in vocab")
-            continue
-        token_id = vocab[token]
-        if doc_id in posindex[token_id]:
-            posindex[token_id][doc_id] += f"|{pos}"
-        else:
-            posindex[token_id][doc_id] = f"{pos}"
-    dump_posix(posindex, contributor, lang, theme)
+    token_ids, docs, positions = [], [], []
+    for text, doc_id in zip(texts, doc_ids):
+        for pos, token in enumerate(text.split()):
+            token_id = vocab.get(token)
+            if token_id is None:
+                continue
+            token_ids.append(token_id)
+            docs.append(doc_id)
+            positions.append(pos)
+    return mk_columns(token_ids, docs, positions)
+
+
+def _rewrite(path, doc_ids=()):
+    """ Rewrite an index without its deleted documents and
+    some others, merging its segments. Must be called with the
+    lock of the index held.
+    """
+    _, watermark = _head(path)
+    segs = _list_segments(path, watermark)
+    token_ids, docs, positions = _load(path).occurrences()
+    keep = ~np.isin(docs, doc_ids)
+    watermark = segs[-1][0] + 1 if segs else watermark
+    _write_columns(path, mk_columns(token_ids[keep], docs[keep], positions[keep]), watermark)
+
+
+def posix_columns(columns, contributor, lang, theme):
+    """ Add the postings of some documents to the positional
+    index of a pod, as a new segment, without rewriting the rest
+    of the index. Documents that are already in the index are
+    replaced, which does rewrite it.
+    """
+    path = posix_path(contributor, lang, theme)
+    convert_legacy(path)
+    if len(columns['docs']) == 0:
+        return
+    with posix_lock(path):
+        index = _load(path)
+        if np.any(np.isin(columns['fwd_docs'], np.concatenate([index.doc_ids(), index.deleted]))):
+            # Postings of deleted documents must be gone before they come back
+            _rewrite(path, columns['fwd_docs'])
+        _, watermark = _head(path)
+        segs = _list_segments(path, watermark)
+        n = segs[-1][0] + 1 if segs else watermark
+        seg_path = join(path, 'seg.'+str(n)+'.npz')
+        with open(seg_path+'.tmp', 'wb') as f:
+            np.savez(f, **columns)
+        rename(seg_path+'.tmp', seg_path)
+    if len(segs) + 1 >= MAX_SEGMENTS:
+        threading.Thread(target=compact_posix, args=(path,), daemon=True).start()
+
+
+def posix_docs(texts, doc_ids, contributor, lang, theme):
+    """ Add tokenized documents to the positional index of a
+    pod, with their ids in the database.
+    """
+    posix_columns(mk_doc_columns(texts, doc_ids, lang), contributor, lang, theme)
+
+
+def posix_doc(text, doc_id, contributor, lang, theme):
+    posix_docs([text], [doc_id], contributor, lang, theme)
+
+
+def compact_posix(path):
+    """ Merge the segments of a positional index into its
+    compacted columns, dropping the postings of deleted
+    documents.
+    """
+    try:
+        with posix_lock(path):
+            _, watermark = _head(path)
+            if not _list_segments(path, watermark) and len(_tombstones(path)) == 0:
+                return
+            logging.info(f">> INDEXER: compact_posix: compacting {path}")
+            _rewrite(path)
+    except Exception as e:
+        logging.error(f">> INDEXER: compact_posix: could not compact {path}: {e}")
+
+
+def rm_doc_from_posix(doc_id, contributor, lang, theme):
+    """ Remove a document from the positional index of a pod.
+    Its id is appended to the tombstones of the index, which
+    is compacted in the background every MAX_TOMBSTONES
+    deletions.
+
+    Returns: the columns of the removed document.
+    """
+    path = posix_path(contributor, lang, theme)
+    convert_legacy(path)
+    with posix_lock(path):
+        columns = mk_columns(*_load(path).occurrences([doc_id]))
+        with open(tombstones_path(path), 'ab') as f:
+            f.write(np.array([doc_id], dtype=np.int64).tobytes())
+        n = len(_tombstones(path))
+    if n >= MAX_TOMBSTONES:
+        threading.Thread(target=compact_posix, args=(path,), daemon=True).start()
+    return columns
+
 
 def get_pod_sizes(pod_paths, lang):
     pod_sizes = {}
     for path in pod_paths:
         filename = path.split('/')[-1]
         theme, contributor = filename.replace('.pos','').split('.u.')
-        _, idx = joblib.load(join(pod_dir, contributor, lang, theme+'.u.'+contributor+'.npz.idx'))
-        pod_sizes[filename] = len(idx)
+        pod_sizes[filename] = len(load_posix(contributor, lang, theme).doc_ids())
     pod_sizes = dict(sorted(pod_sizes.items(), key=lambda item: item[1], reverse=True))
     return pod_sizes
 
@@ -0,0 +1,165 @@
+# SPDX-FileCopyrightText: 2025 PeARS Project, <community@pearsproject.org>,
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import fcntl
+import logging
+from glob import glob
+from uuid import uuid4
+from contextlib import contextmanager
+from os import getenv, remove, rename, stat
+from os.path import dirname, realpath, join, isfile
+from pathlib import Path
+import numpy as np
+from app import VEC_SIZE
+
+dir_path = dirname(dirname(realpath(__file__)))
+pod_dir = getenv("PODS_DIR", join(dir_path, 'pods'))
+
+# Signatures read by this process, by language:
+# (file stat, etag, signature)
+loaded = {}
+
+
+def signature_path(lang):
+    """ The signature of an instance for a language is
+    the sum of the L2-normalised sums of its pods. It is
+    kept up to date as documents are added and removed,
+    together with the sum of each pod (<pod>.sum.npy).
+    """
+    return join(pod_dir, '.'+lang+'.signature.npz')
+
+
+def podsum_path(npz_path):
+    return npz_path[:-len('.npz')]+'.sum.npy'
+
+
+def parse_npz_path(npz_path):
+    """ Return the language of a pod from the path of its
+    npz file (pod_dir/contributor/lang/pod.npz).
+    """
+    return npz_path.split('/')[-2]
+
+
+@contextmanager
+def signature_lock(lang):
+    Path(pod_dir).mkdir(parents=True, exist_ok=True)
+    with open(join(pod_dir, '.'+lang+'.signature.lock'), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def contribution(podsum):
+    """ The contribution of a pod to the signature: its
+    L2-normalised sum, or nothing if the pod is empty.
+    Document vectors are non-negative with unit norm, so
+    each document adds at least 1 to the sum; a smaller
+    sum is rounding left after removing documents.
+    """
+    if np.sum(podsum) > 0.5:
+        return podsum / np.linalg.norm(podsum)
+    return np.zeros(VEC_SIZE)
+
+
+def _write_signature(lang, signature, token, version):
+    path = signature_path(lang)
+    with open(path+'.tmp', 'wb') as f:
+        np.savez(f, signature=signature, token=token, version=version)
+    rename(path+'.tmp', path)
+
+
+def _save_podsum(npz_path, podsum):
+    with open(podsum_path(npz_path)+'.tmp', 'wb') as f:
+        np.save(f, podsum)
+    rename(podsum_path(npz_path)+'.tmp', podsum_path(npz_path))
+
+
+def _build_signature(lang):
+    """ Compute the signature of a language from scratch,
+    saving the sum of every pod. Must be called with the
+    signature lock held.
+    """
+    from app.indexer.pod_segments import load_pod_matrix
+    logging.info(f">> INDEXER: building signature for {lang}")
+    signature = np.zeros(VEC_SIZE)
+    for npz_path in glob(join(pod_dir,'*',lang,'*.u.*npz')):
+        podsum = np.asarray(load_pod_matrix(npz_path).sum(axis=0)).ravel()
+        _save_podsum(npz_path, podsum)
+        signature += contribution(podsum)
+    _write_signature(lang, signature, uuid4().hex, 0)
+
+
+def rebuild_signature(lang):
+    """ Recompute the signature of a language from the pods,
+    e.g. after pods were written by other means.
+    """
+    with signature_lock(lang):
+        _build_signature(lang)
+
+
+def _update_pod(npz_path, delta):
+    """ Add delta to the sum of a pod (None to drop the pod)
+    and adjust the signature of its language accordingly.
+    Updates are deltas, so they can be applied in any order.
+    """
+    lang = parse_npz_path(npz_path)
+    with signature_lock(lang):
+        if not isfile(signature_path(lang)):
+            _build_signature(lang)
+            return
+        with np.load(signature_path(lang)) as f:
+            signature, token, version = f['signature'], str(f['token']), int(f['version'])
+        if isfile(podsum_path(npz_path)):
+            old = np.load(podsum_path(npz_path))
+        else:
+            old = np.zeros(VEC_SIZE)
+        signature = signature - contribution(old)
+        if delta is None:
+            if isfile(podsum_path(npz_path)):
+                remove(podsum_path(npz_path))
+        else:
+            new = old + delta
+            signature = signature + contribution(new)
+            _save_podsum(npz_path, new)
+        _write_signature(lang, signature, token, version + 1)
+
+
+def signature_add(npz_path, rows):
+    """ Add rows appended to a pod to the signature."""
+    _update_pod(npz_path, np.asarray(rows.sum(axis=0)).ravel())
+
+
+def signature_rm(npz_path, rows):
+    """ Remove rows deleted from a pod from the signature."""
+    _update_pod(npz_path, -np.asarray(rows.sum(axis=0)).ravel())
+
+
+def signature_rm_pod(npz_path):
+    """ Remove a deleted pod from the signature."""
+    _update_pod(npz_path, None)
+
+
+def signature_mv_pod(src_npz_path, target_npz_path):
+    if isfile(podsum_path(src_npz_path)):
+        rename(podsum_path(src_npz_path), podsum_path(target_npz_path))
+
+
+def load_signature(lang):
+    """ Return the signature of a language and its ETag.
+    The signature is re-read only when it has changed.
+    """
+    path = signature_path(lang)
+    if not isfile(path):
+        with signature_lock(lang):
+            if not isfile(path):
+                _build_signature(lang)
+    st = stat(path)
+    key = (st.st_ino, st.st_mtime_ns, st.st_size)
+    if lang not in loaded or loaded[lang][0] != key:
+        with np.load(path) as f:
+            etag = str(f['token'])+'-'+str(int(f['version']))
+            loaded[lang] = (key, etag, f['signature'])
+    return loaded[lang][1], loaded[lang][2]
@@ -4,7 +4,6 @@
 
 import numpy as np
 from scipy.sparse import csr_matrix
-from sklearn import preprocessing
 from app import models
 
 
@@ -27,9 +26,79 @@ def wta_vectorized(feature_mat, k, percent=True):
 def encode_docs(doc_list, vectorizer, logprobs, power, top_words):
     logprobs = np.array([logprob ** power for logprob in logprobs])
     X = vectorizer.fit_transform(doc_list)
-    X = X.multiply(logprobs)
-    X = wta_vectorized(X.toarray(),top_words,False)
-    X = csr_matrix(X)
+    X = csr_matrix(X.multiply(logprobs))
+    X = wta_sparse(X,top_words)
+    return X
+
+def logprob_weights(lang, power):
+    """ The weight of each subword of the vocabulary,
+    cached per language and power.
+    """
+    key = 'weights.'+str(power)
+    if key not in models[lang]:
+        models[lang][key] = np.array([logprob ** power for logprob in models[lang]['logprobs']])
+    return models[lang][key]
+
+def wta_sparse(X, k):
+    """ Winner-takes-all on the rows of a CSR matrix: in
+    each row, keep the values at least as large as the k-th
+    largest, as wta_vectorized does on dense rows, looking
+    only at the non-zero entries. Rows with k non-zero
+    entries or fewer are kept as they are. All rows are
+    processed at once, by sorting the non-zero entries, in
+    O(nnz log nnz) time.
+    """
+    counts = np.diff(X.indptr)
+    long_rows = counts > k
+    if k < 1 or not long_rows.any():
+        return X
+    rows = np.repeat(np.arange(X.shape[0]), counts)
+    # sort the entries of each row by decreasing value
+    order = np.lexsort((-X.data, rows))
+    kth_vals = np.full(X.shape[0], -np.inf)
+    kth_vals[long_rows] = X.data[order[X.indptr[:-1][long_rows] + k - 1]]
+    X.data[X.data < kth_vals[rows]] = 0
+    X.eliminate_zeros()
+    return X
+
+def encode_docs_batch(doc_list, vectorizer, weights, top_words):
+    """ Encode many documents at once, without densifying:
+    weight the subword counts, apply winner-takes-all and
+    L2-normalise each row.
+
+    Returns: a CSR matrix with one row per document.
+    """
+    X = csr_matrix(vectorizer.fit_transform(doc_list), dtype=np.float64)
+    X.sort_indices()
+    X.data *= weights[X.indices]
+    X = wta_sparse(X, top_words)
+    rows = np.repeat(np.arange(X.shape[0]), np.diff(X.indptr))
+    norms = np.sqrt(np.bincount(rows, weights=X.data ** 2, minlength=X.shape[0]))
+    # Documents with no weighted subword left keep an empty row
+    nonzero = norms[rows] > 0
+    X.data[nonzero] /= norms[rows][nonzero]
+    X.data[~nonzero] = 0
+    X.eliminate_zeros()
+    return X
+
+def vectorize_batch(lang, texts, logprob_power, top_words):
+    '''Takes a list of tokenized texts and returns their
+    vectorized / scaled representations as a CSR matrix'''
+    vectorizer = models[lang]['vectorizer']
+    weights = logprob_weights(lang, logprob_power)
+    return encode_docs_batch(texts, vectorizer, weights, top_words)
+
+def vectorize_ids(lang, ids, logprob_power):
+    '''Takes a set of subwords given by vocabulary id and returns
+    their vectorized / scaled representation, as vectorize_batch
+    would for a text holding each of them once'''
+    ids = np.unique(np.asarray(ids, dtype=np.int32))
+    data = logprob_weights(lang, logprob_power)[ids]
+    norm = np.linalg.norm(data)
+    if norm > 0:
+        data = data / norm
+    X = csr_matrix((data, ids, [0, len(ids)]), shape=(1, len(models[lang]['vocab'])))
+    X.eliminate_zeros()
     return X
 
 def read_n_encode_dataset(doc=None, vectorizer=None, logprobs=None, power=None, top_words=None, verbose=False):
@@ -54,6 +123,7 @@ def vectorize(lang, text, logprob_power, top_words):
       return np.asarray(dataset)
 
 def scale(dataset):
+    from sklearn import preprocessing
     #scaler = preprocessing.MinMaxScaler().fit(dataset)
     scaler = preprocessing.Normalizer(norm='l2').fit(dataset)
     return scaler.transform(dataset)
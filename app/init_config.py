@@ -52,6 +52,17 @@ def run_config(app):
     # Optimization
     app.config['LIVE_MATRIX'] = True if getenv("LIVE_MATRIX", "false").lower() == 'true' else False
     app.config['EXTEND_QUERY'] = True if getenv("EXTEND_QUERY", "false").lower() == 'true' else False
+    app.config['QUERY_CACHE_SIZE'] = int(getenv("QUERY_CACHE_SIZE", "10000"))
+    app.config['RERANK_CANDIDATES'] = int(getenv("RERANK_CANDIDATES", "50"))
+    app.config['HYBRID_SEARCH'] = True if getenv("HYBRID_SEARCH", "false").lower() == 'true' else False
+    app.config['PHRASE_TIME_BUDGET'] = int(getenv("PHRASE_TIME_BUDGET", "50"))
+
+    # Outbound HTTP requests
+    app.config['HTTP_TIMEOUT'] = float(getenv("HTTP_TIMEOUT", "30"))
+    app.config['HTTP_RETRIES'] = int(getenv("HTTP_RETRIES", "2"))
+    app.config['HTTP_BACKOFF'] = float(getenv("HTTP_BACKOFF", "0.5"))
+    app.config['HTTP_POOL_SIZE'] = int(getenv("HTTP_POOL_SIZE", "16"))
+    app.config['CROSS_INSTANCE_BUDGET'] = float(getenv("CROSS_INSTANCE_BUDGET", "5"))
 
     # Femicide scraper
     app.config['HF_TOKEN'] = getenv('HF_TOKEN')
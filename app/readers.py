@@ -1,3 +1,7 @@
+from os import getpid, rename, stat
+from os.path import isfile, getmtime
+import numpy as np
+
 
 def read_vocab(vocab_file):
     c = 0
@@ -22,6 +26,52 @@ def read_vocab(vocab_file):
             c+=1
     return vocab, reverse_vocab, logprobs
 
+def save_array(path, a):
+    """ Save an array atomically, so that workers starting
+    concurrently never map a partly written file.
+    """
+    tmp = path+'.'+str(getpid())+'.tmp'
+    with open(tmp, 'wb') as f:
+        np.save(f, a)
+    rename(tmp, path)
+
+def vocab_paths(vocab_file):
+    return vocab_file+'.words.npy', vocab_file+'.logprobs.npy'
+
+def compile_vocab(vocab_file):
+    """ Compile a vocabulary file into two arrays: the
+    subwords in vocabulary order and their log probabilities.
+    """
+    vocab, _, logprobs = read_vocab(vocab_file)
+    words = np.array(list(vocab.keys()))
+    logprobs = np.array(logprobs, dtype=np.float64)
+    for path, a in zip(vocab_paths(vocab_file), (words, logprobs)):
+        save_array(path, a)
+
+def _compiled_vocab(vocab_file):
+    words_path, logprobs_path = vocab_paths(vocab_file)
+    if not isfile(words_path) or not isfile(logprobs_path) or getmtime(words_path) < getmtime(vocab_file):
+        compile_vocab(vocab_file)
+    return words_path, logprobs_path
+
+def vocab_size(vocab_file):
+    """ The size of a vocabulary, without loading it."""
+    words_path, _ = _compiled_vocab(vocab_file)
+    return np.load(words_path, mmap_mode='r').shape[0]
+
+def load_vocab(vocab_file):
+    """ Like read_vocab, from the compiled vocabulary arrays,
+    which are memory-mapped and shared by the workers. The
+    reverse vocabulary is the array of subwords itself.
+    They are compiled first if they are missing or older
+    than the vocabulary file.
+    """
+    words_path, logprobs_path = _compiled_vocab(vocab_file)
+    words = np.load(words_path, mmap_mode='r')
+    logprobs = np.load(logprobs_path, mmap_mode='r')
+    vocab = dict(zip(words.tolist(), range(len(words))))
+    return vocab, words, logprobs
+
 def read_cosines(cosine_file):
     cosines = {}
     with open(cosine_file) as f:
@@ -32,3 +82,53 @@ def read_cosines(cosine_file):
             cosines[wp] = fields[2:]
     return cosines
 
+
+# Bumped whenever the compiled neighbour arrays change meaning
+COSINES_FORMAT = 2
+
+def cosines_paths(cosine_file):
+    return cosine_file+'.nn_ids.npy', cosine_file+'.nn_lens.npy', cosine_file+'.nn_stamp.npy'
+
+def cosines_stamp(vocab_file):
+    """ What the compiled neighbour arrays depend on, besides
+    the neighbour file: their format, and the vocabulary file
+    their ids refer to.
+    """
+    return np.array([COSINES_FORMAT, stat(vocab_file).st_mtime_ns], dtype=np.int64)
+
+def compile_cosines(cosine_file, vocab, vocab_file, min_length=3):
+    """ Compile the neighbour file of a language into arrays
+    indexed by vocabulary id: the ids of the neighbours of
+    each subword (-1 for neighbours outside the vocabulary),
+    and how many neighbours each subword has. Neighbours are
+    lowercased, as the vectorizer lowercases its input, and
+    those shorter than min_length are left out, as query
+    expansion never uses them.
+    """
+    cosines = read_cosines(cosine_file)
+    width = max([len(nns) for nns in cosines.values()], default=0)
+    ids = np.full((len(vocab), width), -1, dtype=np.int32)
+    lens = np.zeros(len(vocab), dtype=np.int32)
+    for wp, nns in cosines.items():
+        if wp not in vocab:
+            continue
+        nns = [vocab.get(n.lower(), -1) for n in nns if len(n) >= min_length]
+        ids[vocab[wp], :len(nns)] = nns
+        lens[vocab[wp]] = len(nns)
+    # The stamp is written last, so that it is only there if
+    # the arrays are complete
+    for path, a in zip(cosines_paths(cosine_file), (ids, lens, cosines_stamp(vocab_file))):
+        save_array(path, a)
+
+def load_cosines(cosine_file, vocab, vocab_file):
+    """ Memory-map the compiled neighbour arrays, compiling
+    them first if they are missing, older than the neighbour
+    file, or stamped with another format or vocabulary file.
+    Workers share the mapped pages.
+    """
+    ids_path, lens_path, stamp_path = cosines_paths(cosine_file)
+    if not all(isfile(path) for path in (ids_path, lens_path, stamp_path)) or \
+            getmtime(ids_path) < getmtime(cosine_file) or \
+            not np.array_equal(np.load(stamp_path), cosines_stamp(vocab_file)):
+        compile_cosines(cosine_file, vocab, vocab_file)
+    return np.load(ids_path, mmap_mode='r'), np.load(lens_path, mmap_mode='r')
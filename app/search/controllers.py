@@ -18,7 +18,7 @@ from app.search import score_pages
 from app.utils import parse_query, beautify_title, beautify_snippet
 from app import app, models, db
 from app.api.models import Personalization
-from app.search.cross_instance_search import get_cross_instance_results
+from app.search.cross_instance_search import get_cross_instance_results, get_remote_instances
 
 # Define the blueprint:
 search = Blueprint('search', __name__, url_prefix='')
@@ -133,7 +133,7 @@ def get_local_search_results(query):
         print(">>>>>>>>>>>>>>>>>>>>>>")
 
         print("\n Getting results on this instance")
-        r, s = score_pages.run_search(clean_query, lang, extended=app.config['EXTEND_QUERY'])
+        r, s = score_pages.run_search(clean_query, lang, extended=app.config['EXTEND_QUERY'], phrase=query)
         for res in r.values():
             res["instance"] = app.config["SITENAME"]  # to distinguish local results from remote ones later on
         results.update(r)
@@ -148,7 +148,7 @@ def get_local_search_results(query):
 
 
 def get_search_results(query):
-    from app import instances
+    instances, M = get_remote_instances()
     clean_query = ""
     results = {}
     scores = []
@@ -165,7 +165,7 @@ def get_search_results(query):
 
         try:
             print("\n Getting results on this instance")
-            r, s = score_pages.run_search(clean_query, lang, extended=app.config['EXTEND_QUERY'])
+            r, s = score_pages.run_search(clean_query, lang, extended=app.config['EXTEND_QUERY'], phrase=query)
             for res in r.values():
                 res["instance"] = app.config["SITENAME"]  # to distinguish local results from remote ones later on
             results.update(r)
@@ -175,7 +175,7 @@ def get_search_results(query):
 
         try:
             print("\n Getting results cross-instances")
-            r = get_cross_instance_results(clean_query, instances)
+            r = get_cross_instance_results(clean_query, instances, M)
             for url, dic in r.items():
                 if url not in results:
                     results[url] = dic
@@ -1,15 +1,40 @@
+import logging
+import threading
 from time import time
+from concurrent.futures import ThreadPoolExecutor, wait
 from urllib.parse import urlparse
 import numpy as np
-import requests
 from requests.exceptions import ConnectionError
 from os.path import dirname, realpath, join, exists
-from scipy.spatial import distance
-from app import app, LANGUAGE_CODES
+from scipy.sparse import csr_matrix
+from app import app, utils_http, LANGUAGE_CODES, VEC_SIZE
 from app.search.score_pages import compute_query_vectors
+from app.search.sparse_scoring import normalise_rows, sparse_cosines
 
 base_dir_path = dirname(dirname(dirname(realpath(__file__))))
 
+# Remote searches run in this pool, so that a slow peer
+# does not hold up the others.
+executor = ThreadPoolExecutor(max_workers=8)
+
+# Latency statistics per instance URL: number of requests,
+# failures and late answers, and a moving average of latency.
+instance_stats = {}
+stats_lock = threading.Lock()
+
+# Weight of the latest request in the latency moving average
+LATENCY_DECAY = 0.2
+
+# Remote instances serving our language and their signature
+# matrix. Discovery runs in the background and swaps in a new
+# pair when it is done, so readers always see a consistent one.
+remotes = ([], csr_matrix((0, VEC_SIZE)))
+skipped_remotes = []
+refresher_lock = threading.Lock()
+
+# Signatures of remote instances, by URL: (ETag, signature)
+signature_cache = {}
+
 def get_known_instances():
     known_instances = []
     known_instances_file = join(base_dir_path, '.known_instances.txt')
@@ -19,77 +44,176 @@ def get_known_instances():
         known_instances = f.read().splitlines()
     return known_instances
 
+def get_signature(url):
+    ''' Get the signature of a remote instance, in sparse
+    format if it supports it. The signature is cached with
+    its ETag and only downloaded again when it has changed.
+    Instances that predate these features send the full
+    signature every time.
+
+    Returns: the signature, or None if the request failed.
+    '''
+    headers = {}
+    if url in signature_cache:
+        headers['If-None-Match'] = signature_cache[url][0]
+    resp = utils_http.get(url, params={'format': 'sparse'}, headers=headers)
+    if resp.status_code == 304:
+        return signature_cache[url][1]
+    if resp.status_code != 200:
+        return None
+    data = resp.json()
+    if isinstance(data, dict):
+        signature = np.zeros(data['size'])
+        signature[data['indices']] = data['values']
+    else:
+        signature = np.array(data)
+    if resp.headers.get('ETag'):
+        signature_cache[url] = (resp.headers['ETag'], signature)
+    return signature
+
+
+def discover_instance(i, this_instance_language):
+    ''' Check whether a known instance serves our language
+    and get its signature and identity.
+
+    Returns: the identity info and signature of the instance
+    (None if it is not usable), and the reason for skipping
+    it (None if it is usable or simply in another language).
+    '''
+    # make sure that we're not trying to index with ourselves
+    if i.rstrip("/") == app.config["SITENAME"].rstrip("/"):
+        print(f"WARNING: It seems like you're trying to federate with yourself. Consider removing the name of your local site from .known_hosts.txt if it's on it. For now, I'm skipping this instance ({i}).")
+        return None, None, {"instance": i, "reason": "it seems like you're trying to federate with yourself"}
+
+    resp = None
+    url = join(i, 'api', 'languages')
+    try:
+        resp = utils_http.get(url)
+    except Exception as e:
+        print(f"\t>> ERROR: filter_instances_by_language: request failed trying to access {url}; error message {e}")
+        return None, None, {"instance": i, "reason": "connection error for /api/languages"}
+    if resp.status_code != 200:
+        print(f"\t>> ERROR: filter_instances_by_language: got non-200 status code when trying to access {url}...")    
+        return None, None, {"instance": i, "reason": f"status code {resp.status_code} for /api/languages"}
+    languages = resp.json()['json_list']
+    if this_instance_language not in languages:
+        return None, None, None
+
+    # first get the signature of the instance
+    url = join(i, 'api', 'signature', this_instance_language)
+    try:
+        signature = get_signature(url)
+    except Exception as e:
+        print(f"\t>> ERROR: filter_instances_by_language: request failed trying to access {url}; error message: {e}")
+        return None, None, {"instance": i, "reason": "connection error for /api/signature"}
+    if signature is None:
+        print(f"\t>> ERROR: filter_instances_by_language: got an error code trying to access {url}...")
+        return None, None, {"instance": i, "reason": "error status code for /api/signature"}
+    
+    # retrieve instance metadata
+    identity_info_url = join(i, 'api', 'identity')
+    try:
+        identity_info = utils_http.get(identity_info_url).json()
+        identity_info["url"] = i
+        if identity_info["sitename"].startswith("http"):
+            identity_info["sitename"] = urlparse(identity_info["sitename"]).hostname
+    except Exception as e:
+        print(f"\t>> ERROR: filter_instances_by_language: request failed trying to access {identity_info_url}, error message: {e}")
+        identity_info = {
+            "url": i,
+            "sitename": urlparse(i).hostname,
+            "site_topic": None,
+            "organization": None
+        }
+    return identity_info, signature, None
+
+
 def filter_instances_by_language():
     ''' Return only instances that match the main language
-    of this instance.
+    of this instance. All known instances are contacted
+    concurrently.
     '''
     this_instance_language = list(LANGUAGE_CODES.keys())[0]
     instances = get_known_instances()
     filtered_instances = []
     filtered_matrix = []
     skipped_instances = []
-    headers = {'User-Agent': app.config['USER-AGENT']}
-    for i in instances:
+    if instances:
+        with ThreadPoolExecutor(max_workers=min(len(instances), 16)) as pool:
+            discovered = list(pool.map(lambda i: discover_instance(i, this_instance_language), instances))
+    else:
+        discovered = []
+    for identity_info, signature, skipped in discovered:
+        if skipped is not None:
+            skipped_instances.append(skipped)
+        if signature is not None:
+            filtered_instances.append(identity_info)
+            filtered_matrix.append(signature)
+    if filtered_matrix:
+        filtered_matrix = normalise_rows(csr_matrix(np.array(filtered_matrix)))
+    else:
+        filtered_matrix = csr_matrix((0, VEC_SIZE))
+    return filtered_instances, filtered_matrix, skipped_instances
 
-        # make sure that we're not trying to index with ourselves
-        if i.rstrip("/") == app.config["SITENAME"].rstrip("/"):
-            print(f"WARNING: It seems like you're trying to federate with yourself. Consider removing the name of your local site from .known_hosts.txt if it's on it. For now, I'm skipping this instance ({i}).")
-            skipped_instances.append({"instance": i, "reason": "it seems like you're trying to federate with yourself"})
-            continue
 
-        resp = None
-        url = join(i, 'api', 'languages')
-        try:
-            resp = requests.get(url, timeout=30, headers=headers)
-        except Exception as e:
-            print(f"\t>> ERROR: filter_instances_by_language: request failed trying to access {url}; error message {e}")
-            skipped_instances.append({"instance": i, "reason": "connection error for /api/languages"})
-            continue
-        if resp.status_code != 200:
-            print(f"\t>> ERROR: filter_instances_by_language: got non-200 status code when trying to access {url}...")    
-            skipped_instances.append({"instance": i, "reason": f"status code {resp.status_code} for /api/languages"})
-            continue        
-        languages = resp.json()['json_list']
-        if this_instance_language not in languages:
-            continue
-
-        #print(url, languages, this_instance_language)
-
-        # first get the signature of the instance
-        url = join(i, 'api', 'signature', this_instance_language)
-        try:
-            resp = requests.get(url, timeout=30, headers=headers)
-        except Exception as e:
-            print(f"\t>> ERROR: filter_instances_by_language: request failed trying to access {url}; error message: {e}")
-            skipped_instances.append({"instance": i, "reason": "connection error for /api/signature"})
-            continue
-        if resp.status_code != 200:
-            print(f"\t>> ERROR: filter_instances_by_language: got an error code trying to access {url}...")
-            skipped_instances.append({"instance": i, "reason": f"status code {resp.status_code} for /api/signature"})
-            continue
-
-        signature = np.array(resp.json())
-        
-        # retrieve instance metadata
-        identity_info_url = join(i, 'api', 'identity')
-        try:
-            identity_info = requests.get(identity_info_url, timeout=30, headers=headers).json()
-            identity_info["url"] = i
-            if identity_info["sitename"].startswith("http"):
-                identity_info["sitename"] = urlparse(identity_info["sitename"]).hostname
-        except Exception as e:
-            print(f"\t>> ERROR: filter_instances_by_language: request failed trying to access {identity_info_url}, error message: {e}")
-            identity_info = {
-                "url": i,
-                "sitename": urlparse(i).hostname,
-                "site_topic": None,
-                "organization": None
-            }
-
-        filtered_instances.append(identity_info)
-        filtered_matrix.append(signature)
-    filtered_matrix = np.array(filtered_matrix)
-    return filtered_instances, filtered_matrix, skipped_instances
+def get_remote_instances():
+    ''' Return the remote instances found by the last
+    discovery and their signature matrix, as one snapshot.
+    '''
+    return remotes
+
+
+def _refresh_remotes():
+    ''' Run instance discovery and swap in its results.
+    Called by start_refresher with the refresher lock held.
+    '''
+    global remotes, skipped_remotes
+    try:
+        instances, M, skipped_instances = filter_instances_by_language()
+        remotes = (instances, M)
+        skipped_remotes = skipped_instances
+    except Exception as e:
+        logging.error(f">> SEARCH: refresh of remote instances failed: {e}")
+    finally:
+        refresher_lock.release()
+
+
+def start_refresher():
+    ''' Refresh the remote instances in a background thread,
+    unless a refresh is already running.
+
+    Returns: False if a refresh was already running.
+    '''
+    if not refresher_lock.acquire(blocking=False):
+        return False
+    threading.Thread(target=_refresh_remotes, daemon=True).start()
+    return True
+
+
+def record_request(url, latency, failed=False, late=False):
+    """ Update the latency statistics of an instance."""
+    with stats_lock:
+        stats = instance_stats.setdefault(url, {'requests': 0, 'answered': 0, 'failures': 0, 'late': 0, 'latency': latency})
+        stats['requests'] += 1
+        stats['answered'] += int(not failed and not late)
+        stats['failures'] += int(failed)
+        stats['late'] += int(late)
+        stats['latency'] = (1 - LATENCY_DECAY) * stats['latency'] + LATENCY_DECAY * latency
+
+
+def instance_weight(url):
+    """ Weight of an instance when choosing which ones to
+    query: the share of its requests that succeeded in time,
+    discounted by its average latency relative to the
+    search budget. Unknown instances get a weight of 1.
+    """
+    budget = app.config['CROSS_INSTANCE_BUDGET']
+    with stats_lock:
+        stats = instance_stats.get(url)
+        if stats is None:
+            return 1.
+        reliability = (stats['answered'] + 1) / (stats['requests'] + 1)
+        return reliability * budget / (budget + stats['latency'])
 
 
 def get_best_instances(query, lang, instances, m, top_k=3):
@@ -97,9 +221,10 @@ def get_best_instances(query, lang, instances, m, top_k=3):
     query_vector = np.sum(q_vectors, axis=0)
     
     # Only compute cosines over the dimensions of interest
-    a = np.where(query_vector!=0)[1]
-    cos = 1 - distance.cdist(query_vector[:,a], m[:,a], 'cosine')[0]
-    cos[np.isnan(cos)] = 0
+    cos = sparse_cosines(query_vector, m)
+
+    # Prefer instances that have answered quickly and reliably
+    cos = cos * np.array([instance_weight(i["url"]) for i in instances[:len(cos)]])
 
     # Instance ids with non-zero values (match at least one subword)
     idx = np.where(cos!=0)[0]
@@ -115,20 +240,66 @@ def get_best_instances(query, lang, instances, m, top_k=3):
     return best_instances
 
 
-def get_cross_instance_results(query, instances):
-    from app import M
+def settle(settled, instance_url):
+    """ Claim the right to record the outcome of a search on an
+    instance, which is either its answer or, at the deadline,
+    its lateness, whichever comes first.
+    """
+    with stats_lock:
+        if instance_url in settled:
+            return False
+        settled.add(instance_url)
+        return True
+
+
+def search_instance(instance_url, url, deadline, settled):
+    """ Run a search on a remote instance, recording how
+    long it took and whether it answered before the deadline.
+    The request is not retried, so that it ends soon after
+    the deadline.
+    """
+    t_before = time()
+    try:
+        resp = utils_http.get(url, timeout=max(deadline - t_before, 0.1), retries=False)
+    except Exception:
+        if settle(settled, instance_url):
+            record_request(instance_url, time() - t_before, failed=True, late=time() > deadline)
+        raise
+    t_delta = time() - t_before
+    if settle(settled, instance_url):
+        record_request(instance_url, t_delta, failed=resp.status_code != 200, late=time() > deadline)
+    return resp, t_delta
+
+
+def get_cross_instance_results(query, instances, M):
+    """ Query the best instances for this query in parallel.
+    Instances that have not answered within the
+    CROSS_INSTANCE_BUDGET are dropped from the results and
+    recorded as late; their searches are cancelled if they
+    have not started yet.
+    """
     best_instances = get_best_instances(query, 'en', instances, M, top_k=2)
     results = {}
-    headers = {'User-Agent': app.config['USER-AGENT']}
+    budget = app.config['CROSS_INSTANCE_BUDGET']
+    deadline = time() + budget
+    futures = {}
+    settled = set()
     for instance in best_instances:
         url = join(instance["url"], 'api', 'search?q='+query)
+        futures[executor.submit(search_instance, instance["url"], url, deadline, settled)] = (instance, url)
+    done, not_done = wait(futures, timeout=budget)
+    for future in not_done:
+        instance, url = futures[future]
+        future.cancel()
+        if settle(settled, instance["url"]):
+            record_request(instance["url"], budget, late=True)
+        print(f"Remote instance (url={url}) did not answer within {budget}s, dropping it.")
+    for future in done:
+        instance, url = futures[future]
         req_success = False
         try:
-            t_before = time()
-            resp = requests.get(url, timeout=30, headers=headers)
+            resp, t_delta = future.result()
             req_success = True
-            t_after = time()
-            t_delta = t_after - t_before
             print(f"Request to remote instance (url={url}) took {t_delta:.3f}s")
         except Exception as e:
             print(f"Error when connecting to {url}, error message: {e}")
@@ -0,0 +1,468 @@
+# SPDX-FileCopyrightText: 2025 PeARS Project, <community@pearsproject.org>,
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import fcntl
+import hashlib
+import logging
+import pickle
+import threading
+from glob import glob
+from uuid import uuid4
+from contextlib import contextmanager
+from os import getenv, remove, rename, stat
+from os.path import dirname, join, realpath, isfile, getsize
+from pathlib import Path
+from urllib.parse import urlparse
+import numpy as np
+from scipy.sparse import csr_matrix, csc_matrix
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session, object_session
+from app import app, db, models, VEC_SIZE
+from app.api.models import Urls, Pods
+from app.indexer.inverted_index import mk_invix, candidate_rows
+
+dir_path = dirname(dirname(realpath(__file__)))
+pod_dir = getenv("PODS_DIR", join(dir_path, 'pods'))
+
+# The journal is rotated when it grows beyond this size.
+# Workers then rebuild their matrix once from the pods.
+JOURNAL_MAX_SIZE = 64 * 1024 * 1024
+
+# Rows appended since the inverted index was last built
+# are scored without pruning until there are this many of them
+# (or a tenth of the matrix).
+MAX_UNINDEXED_ROWS = 1000
+
+# The columns of Urls that search results are made of
+META_COLUMNS = ('id', 'url', 'title', 'snippet', 'share', 'notes', 'doctype', 'frame_annotations', 'pod')
+
+
+def _reserve(arr, size):
+    """ Grow a buffer geometrically so that it can hold
+    at least size elements. Appending is amortised O(1).
+    """
+    if len(arr) >= size:
+        return arr
+    grown = np.empty(max(size, 2 * len(arr)), dtype=arr.dtype)
+    grown[:len(arr)] = arr
+    return grown
+
+
+class DocMeta:
+    """ The metadata of the documents of a store, column-wise:
+    one list per column of META_COLUMNS, addressed by row, rather
+    than a dict per document. Rows are read and written as dicts.
+    """
+
+    def __init__(self, columns=None):
+        columns = columns or {}
+        self.columns = {c: list(columns.get(c, [])) for c in META_COLUMNS}
+
+    def __len__(self):
+        return len(self.columns['url'])
+
+    def __getitem__(self, row):
+        return {c: values[row] for c, values in self.columns.items()}
+
+    def __setitem__(self, row, meta):
+        for c, values in self.columns.items():
+            values[row] = meta[c]
+
+    def __iter__(self):
+        return (self[row] for row in range(len(self)))
+
+    def append(self, meta):
+        for c, values in self.columns.items():
+            values.append(meta[c])
+
+
+class MatrixStore:
+    """ The in-memory search matrix of a language.
+
+    It is built once from the pods and then maintained
+    incrementally: new document vectors are written into
+    over-allocated CSR buffers and deleted documents are
+    tombstoned, so an update costs O(1) instead of a full
+    rebuild. Updates are shared between workers (e.g.
+    gunicorn processes) through an append-only journal,
+    which every worker replays before searching.
+
+    bins and podnames describe the rows built from the pods.
+    meta holds the columns of META_COLUMNS for the document in
+    each row (see DocMeta), so that search does not need to query
+    the database.
+    rank_texts and locs hold what results are re-ranked on
+    (see rank_fields).
+    """
+
+    def __init__(self, lang, m, bins, podnames, urls, meta, invix, position):
+        m = csr_matrix(m)
+        self.lang = lang
+        self.bins = bins
+        self.podnames = podnames
+        self.urls = list(urls)
+        self.rows = {url: i for i, url in enumerate(self.urls)}
+        self.meta = DocMeta(meta)
+        self.rank_texts, self.locs = [], []
+        for u in self.meta:
+            text, loc = rank_fields(u)
+            self.rank_texts.append(text)
+            self.locs.append(loc)
+        self.n = m.shape[0]
+        self.nnz = m.nnz
+        # The buffers may be read-only memory maps of a snapshot,
+        # in which case they are copied on the first append.
+        self._data = np.asarray(m.data, dtype=np.float64)
+        self._indices = np.asarray(m.indices, dtype=np.int32)
+        self._indptr = np.asarray(m.indptr, dtype=np.int32)
+        self._alive = np.ones(self.n, dtype=bool)
+        self._m = None
+        self.invix = invix
+        self.token, self.offset = position
+        self.lock = threading.Lock()
+
+    @property
+    def m(self):
+        """ A CSR view over the buffers (no copy)."""
+        if self._m is None:
+            self._m = csr_matrix((self._data[:self.nnz], self._indices[:self.nnz], \
+                    self._indptr[:self.n+1]), shape=(self.n, VEC_SIZE), copy=False)
+        return self._m
+
+    def append(self, url, indices, data, meta):
+        """ Append a document vector, given as the indices
+        and values of its non-zero dimensions, with its metadata. The row is
+        L2-normalised like the rest of the matrix. A previous
+        row for the same URL is tombstoned.
+        """
+        self.tombstone(url)
+        k = len(indices)
+        norm = np.linalg.norm(data)
+        self._data = _reserve(self._data, self.nnz + k)
+        self._indices = _reserve(self._indices, self.nnz + k)
+        self._indptr = _reserve(self._indptr, self.n + 2)
+        self._alive = _reserve(self._alive, self.n + 1)
+        self._data[self.nnz:self.nnz+k] = data / norm if norm != 0 else data
+        self._indices[self.nnz:self.nnz+k] = indices
+        self._indptr[self.n+1] = self.nnz + k
+        self._alive[self.n] = True
+        self.rows[url] = self.n
+        self.urls.append(url)
+        self.meta.append(meta)
+        text, loc = rank_fields(meta)
+        self.rank_texts.append(text)
+        self.locs.append(loc)
+        self.n += 1
+        self.nnz += k
+        self._m = None
+
+    def tombstone(self, url):
+        """ Mark the row of a URL as deleted."""
+        row = self.rows.pop(url, None)
+        if row is not None:
+            self._alive[row] = False
+
+    def candidate_rows(self, dims):
+        """ Live rows that may match a query over the given
+        dimensions: the union of the posting lists in the
+        inverted index, plus all rows appended since it was
+        built. The index is rebuilt when too many rows have
+        been appended.
+        """
+        unindexed = self.n - self.invix.shape[0]
+        if unindexed > max(MAX_UNINDEXED_ROWS, self.n // 10):
+            self.invix = mk_invix(self.m)
+            unindexed = 0
+        rows = candidate_rows(self.invix, dims)
+        rows = np.concatenate([rows, np.arange(self.n - unindexed, self.n)]).astype(np.int64)
+        return rows[self._alive[rows]]
+
+    def apply(self, record):
+        if record[0] == 'add':
+            _, url, indices, data, meta = record
+            self.append(url, indices, data, meta)
+        elif record[0] == 'meta':
+            _, url, meta = record
+            if url in self.rows:
+                row = self.rows[url]
+                self.meta[row] = meta
+                self.rank_texts[row], self.locs[row] = rank_fields(meta)
+
+        elif record[0] == 'rm':
+            self.tombstone(record[1])
+
+    def sync(self):
+        """ Apply the journal records written since the last
+        sync, by this worker or another one.
+
+        Returns: False if the journal was rotated since the
+        store was built, in which case it must be rebuilt.
+        """
+        path = journal_path(self.lang)
+        if not isfile(path) or getsize(path) == self.offset:
+            return True
+        with self.lock, open(path, 'rb') as f:
+            fcntl.flock(f, fcntl.LOCK_SH)
+            try:
+                token, start = _read_header(f)
+                if self.token is None:
+                    # The journal was created after the store was built
+                    self.token, self.offset = token, start
+                elif token != self.token:
+                    logging.info(f">> SEARCH: MATRIX STORE: journal for {self.lang} was rotated.")
+                    return False
+                f.seek(self.offset)
+                while True:
+                    try:
+                        record = pickle.load(f)
+                    except EOFError:
+                        break
+                    self.apply(record)
+                    self.offset = f.tell()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        return True
+
+
+#########
+# Snapshots
+#########
+
+# Arrays of a snapshot, saved as .npy files
+SNAPSHOT_ARRAYS = ['data', 'indices', 'indptr', 'invix_data', 'invix_indices', 'invix_indptr']
+
+
+def snapshot_path(lang):
+    """ The matrix of a language, as built from the pods,
+    is saved once as a snapshot and memory-mapped by every
+    worker, so they share its memory through the page cache
+    instead of each building their own copy. This file
+    describes the current snapshot; its arrays are .npy files
+    next to it.
+    """
+    return join(pod_dir, '.'+lang+'.matrix')
+
+
+@contextmanager
+def snapshot_lock(lang, exclusive=True):
+    Path(pod_dir).mkdir(parents=True, exist_ok=True)
+    with open(snapshot_path(lang)+'.lock', 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def pods_fingerprint(lang):
+    """ Identify the state of the pod files of a language.
+    Changes that bypass the journal (e.g. rebuilding pods
+    from a backup, or rewriting a pod after a deletion)
+    change the fingerprint and invalidate the snapshot.
+    """
+    fingerprint = []
+    for npz_path in sorted(glob(join(pod_dir,'*',lang,'*.u.*npz'))):
+        st = stat(npz_path)
+        fingerprint.append((npz_path, st.st_size, st.st_mtime_ns))
+    return fingerprint
+
+
+def save_snapshot(lang, m, bins, podnames, urls, meta, invix, position, fingerprint):
+    """ Save a matrix built from the pods. Must be called
+    with the snapshot lock held.
+    """
+    m = csr_matrix(m)
+    invix = csc_matrix(invix)
+    snapshot_id = uuid4().hex
+    arrays = [m.data, m.indices, m.indptr, invix.data, invix.indices, invix.indptr]
+    for name, a in zip(SNAPSHOT_ARRAYS, arrays):
+        np.save(snapshot_path(lang)+'.'+snapshot_id+'.'+name+'.npy', a)
+    meta = {'id': snapshot_id, 'shape': m.shape, 'invix_shape': invix.shape, 'bins': bins, \
+            'podnames': podnames, 'urls': list(urls), 'meta_columns': {c: list(v) for c, v in meta.items()}, \
+            'position': position, 'fingerprint': fingerprint}
+    with open(snapshot_path(lang)+'.tmp', 'wb') as f:
+        pickle.dump(meta, f)
+    rename(snapshot_path(lang)+'.tmp', snapshot_path(lang))
+    for path in glob(snapshot_path(lang)+'.*.npy'):
+        if not path.startswith(snapshot_path(lang)+'.'+snapshot_id+'.'):
+            remove(path)
+
+
+def load_snapshot(lang, fingerprint):
+    """ Memory-map the snapshot of a language. It can only
+    be used if the pods have not changed behind the journal's
+    back and the journal has not been rotated since it was
+    taken, so that replaying the journal from the snapshot's
+    position brings it up to date. Must be called with the
+    snapshot lock held.
+
+    Returns: a MatrixStore, or None if there is no valid
+    snapshot.
+    """
+    path = snapshot_path(lang)
+    if not isfile(path):
+        return None
+    try:
+        with open(path, 'rb') as f:
+            meta = pickle.load(f)
+        if 'meta_columns' not in meta or meta['fingerprint'] != fingerprint or \
+                meta['position'][0] != journal_position(lang)[0]:
+            return None
+        a = {name: np.load(path+'.'+meta['id']+'.'+name+'.npy', mmap_mode='r') for name in SNAPSHOT_ARRAYS}
+    except Exception as e:
+        logging.error(f">> SEARCH: MATRIX STORE: could not load snapshot for {lang}: {e}")
+        return None
+    m = csr_matrix((a['data'], a['indices'], a['indptr']), shape=meta['shape'], copy=False)
+    invix = csc_matrix((a['invix_data'], a['invix_indices'], a['invix_indptr']), \
+            shape=meta['invix_shape'], copy=False)
+    return MatrixStore(lang, m, meta['bins'], meta['podnames'], meta['urls'], meta['meta_columns'], invix, meta['position'])
+
+
+########
+# Journal
+########
+
+def journal_path(lang):
+    return join(pod_dir, '.'+lang+'.journal')
+
+
+def _read_header(f):
+    f.seek(0)
+    _, token = pickle.load(f)
+    return token, f.tell()
+
+
+def journal_position(lang):
+    """ Return the current end of the journal, as a
+    (token, offset) pair. A store built from the pods
+    replays the journal from this position.
+    """
+    path = journal_path(lang)
+    if not isfile(path):
+        return None, 0
+    with open(path, 'rb') as f:
+        fcntl.flock(f, fcntl.LOCK_SH)
+        try:
+            token, _ = _read_header(f)
+            f.seek(0, 2)
+            return token, f.tell()
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def index_generation(lang):
+    """ A value that changes whenever documents are added
+    to or removed from the index of a language: the position
+    of the end of its journal, and the fingerprint of its pods
+    for changes that bypass the journal.
+    """
+    token, offset = journal_position(lang)
+    fingerprint = hashlib.sha1(repr(pods_fingerprint(lang)).encode()).hexdigest()
+    return str(token)+':'+str(offset)+':'+fingerprint
+
+
+def journal_write(lang, record):
+    """ Append a record to the journal of a language,
+    rotating the journal if it has grown too large.
+    """
+    Path(pod_dir).mkdir(parents=True, exist_ok=True)
+    with open(journal_path(lang), 'ab') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            f.seek(0, 2)
+            if f.tell() == 0 or f.tell() > JOURNAL_MAX_SIZE:
+                f.truncate(0)
+                pickle.dump(('journal', uuid4().hex), f)
+            pickle.dump(record, f)
+            f.flush()
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+##########
+# Updates
+##########
+
+def add_to_matrix(lang, url, v):
+    """ Make a newly indexed document searchable
+    in all workers. v is the document vector.
+    """
+    v = csr_matrix(v)
+    u = db.session.query(Urls).filter_by(url=url).first()
+    journal_write(lang, ('add', url, v.indices, v.data, url_meta(u)))
+    store = models[lang].get('store')
+    if store is not None:
+        store.sync()
+
+
+def rm_from_matrix(lang, url):
+    """ Remove a deleted document from search
+    in all workers.
+    """
+    journal_write(lang, ('rm', url))
+    store = models[lang].get('store')
+    if store is not None:
+        store.sync()
+
+
+###########
+# Metadata
+###########
+
+def url_meta(u):
+    """ The metadata of a document, as stored in the matrix
+    store: the value of each column of META_COLUMNS.
+    """
+    return {c: getattr(u, c) for c in META_COLUMNS}
+
+
+def rank_fields(meta):
+    """ What a document is re-ranked on: its lowercased
+    title and snippet (cut to SNIPPET_LENGTH words; empty
+    if it has no snippet) and the first label of its domain.
+    """
+    if meta['snippet'] is None:
+        text = ''
+    else:
+        snippet = ' '.join(meta['snippet'].split()[:app.config['SNIPPET_LENGTH']])
+        text = ((meta['title'] or '')+' '+snippet).lower()
+    return text, urlparse(meta['url']).netloc.split('.')[0]
+
+
+def meta_as_dict(meta):
+    """ Same as Urls.as_dict, restricted to META_COLUMNS,
+    from stored metadata."""
+    return {c: str(meta[c]) for c in META_COLUMNS}
+
+
+def journal_after_commit(lang, record, session=None):
+    """ Write a record to the journal once the current
+    database transaction is committed.
+    """
+    if session is None:
+        session = db.session
+    session.info.setdefault('journal', []).append((lang, record))
+
+
+@event.listens_for(Urls, 'after_update')
+def journal_url_update(mapper, connection, target):
+    """ Propagate changes to a document's metadata (title,
+    notes, etc.) to the matrix stores of all workers.
+    """
+    row = connection.execute(select(*[getattr(Urls, c) for c in META_COLUMNS]).where(Urls.id == target.id)).first()
+    lang = connection.execute(select(Pods.language).where(Pods.name == row.pod)).scalar()
+    if lang is None:
+        return
+    journal_after_commit(lang, ('meta', row.url, dict(row._mapping)), object_session(target))
+
+
+@event.listens_for(Session, 'after_commit')
+def write_journal(session):
+    for lang, record in session.info.pop('journal', []):
+        journal_write(lang, record)
+
+
+@event.listens_for(Session, 'after_rollback')
+def discard_journal(session):
+    session.info.pop('journal', None)
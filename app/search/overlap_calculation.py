@@ -7,6 +7,7 @@ import string
 import logging
 from app import models, VEC_SIZE
 from app.indexer.posix import load_posix
+from app.search.phrase_search import intersect_docs, match_sequence
 import numpy as np
 from scipy.spatial.distance import cdist
 
@@ -52,6 +53,25 @@ def snippet_overlap(q, s):
     return score
 
 
+def batch_snippet_scores(q, texts, urls, locs):
+    '''Scores of many documents at once, each given by its lowercased
+    title and snippet, its url and the first label of its domain:
+    snippet_overlap with the title and snippet, a big boost in case the
+    query is the domain and a little one for each query word in the url'''
+    texts = np.array(texts, dtype=str)
+    urls = np.array(urls, dtype=str)
+    scores = np.zeros(len(texts))
+    if len(texts) == 0:
+        return scores
+    q_norm = "".join(l if l not in string.punctuation else ' ' for l in q.lower())
+    for w in q_norm.split():
+        scores += np.char.find(texts, w) >= 0
+    scores += 0.5 * (np.array(locs, dtype=str) == q)
+    for w in q.split():
+        scores += 0.1 * (np.char.find(urls, w) >= 0)
+    return scores
+
+
 def dice_overlap(i1, i2):
     '''Dice coefficient between two strings'''
     i1 = "".join(l for l in i1 if l not in string.punctuation)
@@ -75,116 +95,82 @@ def completeness(v, m):
     completeness = 1 - cdist(v_nz, m_r, 'hamming')
     return completeness
 
-def posix_score_seq(posl, enforce_subwords=True):
-    # remove repeated words
-    posl = list(set(posl))
-
-    # only one subword word: perfect score
-    if len(posl) == 1 and len(posl[0]) == 1:
-        return 1.0
-    
-    scores = []
-
-    first_tok_pos = posl[0][0].split('|')  # first word -> first subword token -> split 'pos|pos|pos' to list 
-    prev_pos = [int(i) for i in first_tok_pos]
-
-    if enforce_subwords:
-        prev_subwords = prev_pos  # keep track of the positions of the previous subwords
-    else:
-        prev_subwords = None
-
-    for word_idx, word_posl in enumerate(posl): # loop over words
-        for p_idx, p_str in enumerate(word_posl):  # loop over subwords inside words
-            current_pos = [int(i) for i in p_str.split('|')]
-            if enforce_subwords:
-                if p_idx == 0:
-                    prev_subwords = current_pos  # first subword of a word: just get the positions, e.g. `_water` -> [19|55]
-                else:
-                    # non-initial subword, e.g. `melon` -> [53|56|99]
-                    conseq_subwords = []
-                    for p in current_pos:
-                        for prev_p in prev_subwords:  # compare distances: match 2nd `melon` instance (56-55 = 1), ignore the others 
-                            dist = p - prev_p
-                            if dist == 1:
-                                conseq_subwords.append(p)
-                                break
-                    if not conseq_subwords:  # none of the positions of current subword is consecutive
-                        scores.append(0.0)  # not the entire word is matched -> 0 score for this word
-                        break  # we can ignore the rest of the subwords
-                    prev_subwords = conseq_subwords
-
-                # if we made it to the last subword, it means the entire word was matched
-                if p_idx == len(word_posl) - 1:
-                    scores.append(1.0)  # assign a 1.0
-                    
-            else:
-                if word_idx == 0 and p_idx == 0:
-                    pass
-
-                pair_scores = _pair_score(prev_pos, current_pos)
-                #print("\nPAIR SCORES",scores)
-                if pair_scores:
-                    scores.extend(pair_scores)
-                else:
-                    scores.append(1.0)
-            prev_pos = current_pos
-
-    if enforce_subwords:
-        return np.mean(scores)  # meaning: the fraction of words that were completely matched (= all subwords consecutive)
-    else:
-        return np.max(scores)  # meaning: 1.0 if there is at least one pair of tokens that is consecutive both in the query and in the document. Otherwise a fraction of this. 
-
-def posix(q, posindex, lang):
+def query_token_ids(q, lang, warning):
     vocab = models[lang]['vocab']
-    inverted_vocab = models[lang]['inverted_vocab']
     query_vocab_ids = [vocab.get(wp) for wp in q.split()]
     if any([i is None for i in query_vocab_ids]):
-        print("WARNING: there were unknown tokens in the query")
-        print(q.split(), query_vocab_ids)
+        print(warning)
         query_vocab_ids = [i for i in query_vocab_ids if i is not None]
+    return query_vocab_ids
+
+
+def query_words(query_vocab_ids, lang):
+    """ Group the tokens of a query into words, each starting
+    with a token that begins with '▁'. Repeated words are
+    only kept once.
+    """
+    inverted_vocab = models[lang]['inverted_vocab']
+    words = []
+    for w in query_vocab_ids:
+        if str(inverted_vocab[w]).startswith("▁") or len(words) == 0:
+            words.append((w,))
+        else:
+            words[-1] += (w,)
+    return list(dict.fromkeys(words))
+
+
+def posix_arrays(q, posindex, lang):
+    """ Score the documents that contain all tokens of a query
+    by the fraction of its words whose subwords are consecutive
+    in the document.
+
+    Returns: the sorted ids of the documents and their scores.
+    """
+    query_vocab_ids = query_token_ids(q, lang, "WARNING: there were unknown tokens in the query")
+    if len(query_vocab_ids) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+    docs = intersect_docs([posindex.docs(w) for w in query_vocab_ids])
+    logging.debug(f"MATCHING DOCS: {len(docs)}")
+    words = query_words(query_vocab_ids, lang)
+    scores = np.zeros(len(docs))
+    for word in words:
+        if len(word) == 1:
+            scores += 1
+        else:
+            matched, _ = match_sequence(posindex, word, docs)
+            scores += np.isin(docs, matched, assume_unique=True)
+    return docs, scores / len(words)
+
 
-    idx = []
-    for w in query_vocab_ids:                      # for each token in query
-        #print(inverted_vocab[w])
-        idx.append(set(posindex[w].keys()))        # get docs containing token, resulting in list of sets (one set per token)
-        #if len(set(posindex[w].keys())) > 0:
-        #    print("FOUND",inverted_vocab[w], set(posindex[w].keys()))
-
-    matching_docs = list(set.intersection(*idx))   # intersect doc lists to only retain the docs that contain *all* tokens
-    #if len(matching_docs) > 0:
-    logging.debug(f"MATCHING DOCS: {matching_docs}")
-    doc_scores = {}
-    for doc in matching_docs:
-        positions = []
-        for w in query_vocab_ids:
-            token_str = inverted_vocab[w]
-            token_positions = posindex[w][doc]
-            logging.debug(f"DOC {doc} TOKEN STR {token_str}")
-            if token_str.startswith("▁") or len(positions) == 0:
-                positions.append((token_positions,))
-            else:
-                positions[-1] += (token_positions,)
-            #print("\tDOC",doc,"Q WORD", token_str, token_positions)
-
-        final_score = posix_score_seq(positions)
-        doc_scores[doc] = final_score
-        logging.debug(f"\tFINAL SCORE FOR DOC {doc}: {final_score}\n")
-    return doc_scores
+def posix(q, posindex, lang):
+    docs, scores = posix_arrays(q, posindex, lang)
+    return dict(zip(docs.tolist(), scores.tolist()))
+
+
+def posix_proximity(q, posindex, lang, window=1, docs=None):
+    """ Find the documents in which the tokens of a query occur
+    in order, each at most window positions after the previous
+    one. A window of 1 matches the exact phrase.
+
+    Arguments:
+    docs: if given, only these documents are searched.
+
+    Returns: a dictionary from doc ids to their number of matches.
+    """
+    query_vocab_ids = query_token_ids(q, lang, "WARNING: there were unknown tokens in the query")
+    if len(query_vocab_ids) == 0:
+        return {}
+    doc_lists = [posindex.docs(w) for w in query_vocab_ids]
+    if docs is not None:
+        doc_lists.append(np.unique(np.asarray(docs, dtype=np.int64)))
+    matched, counts = match_sequence(posindex, query_vocab_ids, intersect_docs(doc_lists), window)
+    return dict(zip(matched.tolist(), counts.tolist()))
 
 
 def posix_no_seq(q, posindex, lang):
-    vocab = models[lang]['vocab']
-    query_vocab_ids = [vocab.get(wp) for wp in q.split()]
-    if any([i is None for i in query_vocab_ids]):
-        print("WARNING: there were unknown tokens in the query. This can happen while computing the extended query because the FastText neighbours may not be in the vocabulary.")
-        #print(q.split(), query_vocab_ids)
-        query_vocab_ids = [i for i in query_vocab_ids if i is not None]
+    query_vocab_ids = query_token_ids(q, lang, "WARNING: there were unknown tokens in the query. This can happen while computing the extended query because the FastText neighbours may not be in the vocabulary.")
 
-    idx = []
-    for w in query_vocab_ids:                      # for each token in query
-        docs = list(posindex[w].keys())
-        if len(docs) > 0:
-            idx.extend(docs)        # get docs containing token, resulting in list of sets (one set per token)
-            #print(inverted_vocab.get(w),list(set(posindex[w].keys())))
-    idx = list(set(idx))
-    return idx
+    idx = [posindex.docs(w) for w in query_vocab_ids]   # get docs containing each token in query
+    if len(idx) == 0:
+        return []
+    return np.unique(np.concatenate(idx)).tolist()
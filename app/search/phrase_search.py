@@ -0,0 +1,75 @@
+# SPDX-FileCopyrightText: 2025 PeARS Project, <community@pearsproject.org>,
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import numpy as np
+
+# Occurrences of a token are handled as int64 keys
+# (doc id << POS_BITS) + position, which sort by document
+# and then by position.
+POS_BITS = 32
+
+
+def intersect_sorted(a, b):
+    """ Return the elements of sorted array a that are also
+    in sorted array b. All elements of a are looked up at once
+    with a vectorised binary search over the whole of b, so the
+    cost is O(len(a) log len(b)).
+    """
+    if len(a) == 0 or len(b) == 0:
+        return a[:0]
+    i = np.searchsorted(b, a)
+    i[i == len(b)] = len(b) - 1
+    return a[b[i] == a]
+
+
+def intersect_docs(doc_lists):
+    """ Intersect sorted lists of doc ids, starting from the
+    shortest one.
+    """
+    doc_lists = sorted(doc_lists, key=len)
+    docs = np.asarray(doc_lists[0], dtype=np.int64)
+    for other in doc_lists[1:]:
+        docs = intersect_sorted(docs, np.asarray(other, dtype=np.int64))
+    return docs
+
+
+def occurrence_keys(posindex, token_id, docs):
+    """ Return the sorted keys of the occurrences of a token
+    in some documents, which must all contain it.
+    """
+    token_docs, ptr, positions = posindex.postings(token_id)
+    idx = np.searchsorted(token_docs, docs)
+    starts, counts = ptr[idx], ptr[idx+1] - ptr[idx]
+    # Gather positions[starts[i]:starts[i]+counts[i]] for each i
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    take = np.repeat(starts, counts) + offsets
+    return (np.repeat(docs, counts) << POS_BITS) + positions[take]
+
+
+def match_sequence(posindex, token_ids, docs, window=1):
+    """ Find the occurrences of a sequence of tokens in some
+    documents, which must contain all of them. Each token must
+    follow the previous one by at most window positions, so a
+    window of 1 matches the exact phrase.
+
+    The occurrences of each token are merged with those of
+    the sequence so far: an occurrence extends the sequence if
+    the closest preceding end of the sequence is near enough.
+
+    Returns: the documents with at least one match and their
+    number of matches.
+    """
+    docs = np.asarray(docs, dtype=np.int64)
+    if len(token_ids) == 0 or len(docs) == 0:
+        return docs[:0], np.zeros(0, dtype=np.int64)
+    ends = occurrence_keys(posindex, token_ids[0], docs)
+    for token_id in token_ids[1:]:
+        if len(ends) == 0:
+            break
+        keys = occurrence_keys(posindex, token_id, docs)
+        prev = np.searchsorted(ends, keys) - 1
+        near = prev >= 0
+        near[near] = keys[near] - ends[prev[near]] <= window
+        ends = keys[near]
+    return np.unique(ends >> POS_BITS, return_counts=True)
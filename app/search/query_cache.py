@@ -0,0 +1,97 @@
+# SPDX-FileCopyrightText: 2025 PeARS Project, <community@pearsproject.org>,
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import logging
+import pickle
+import sqlite3
+import threading
+from time import time
+from os import getenv
+from os.path import dirname, join, realpath
+from pathlib import Path
+from app import app
+
+dir_path = dirname(dirname(realpath(__file__)))
+pod_dir = getenv("PODS_DIR", join(dir_path, 'pods'))
+
+# One SQLite connection per thread
+local = threading.local()
+
+
+def get_connection():
+    """ The cache is an SQLite database next to the pods,
+    so that all workers share it.
+    """
+    if getattr(local, 'connection', None) is None:
+        Path(pod_dir).mkdir(parents=True, exist_ok=True)
+        connection = sqlite3.connect(join(pod_dir, '.query_cache.sqlite'), timeout=5, isolation_level=None)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, lang TEXT, \
+                generation TEXT, used REAL, value BLOB)')
+        connection.execute('CREATE INDEX IF NOT EXISTS results_used ON results (used)')
+        local.connection = connection
+    return local.connection
+
+
+def cache_key(query, lang, extended, phrase=None):
+    """ Queries are normalised for case and whitespace. The
+    phrase matched by hybrid search, if it differs from the
+    query, is part of the key.
+    """
+    key = ' '.join(query.lower().split())+'|'+lang+'|'+str(extended)
+    if phrase is not None and phrase.split() != query.split():
+        key += '|'+' '.join(phrase.lower().split())
+    return key
+
+
+def cache_generation(generation):
+    """ Results depend on the generation of the index and
+    on the search settings, so entries computed under other
+    settings are treated as stale.
+    """
+    settings = [app.config[s] for s in ('RERANK_CANDIDATES', 'HYBRID_SEARCH', 'PHRASE_TIME_BUDGET')]
+    return '|'.join([str(generation)] + [str(s) for s in settings])
+
+
+def get_cached_results(query, lang, extended, generation, phrase=None):
+    """ Return the cached results of a query, or None if they
+    are missing or were computed on another generation of
+    the index or with other search settings.
+    """
+    if app.config['QUERY_CACHE_SIZE'] == 0:
+        return None
+    key = cache_key(query, lang, extended, phrase)
+    generation = cache_generation(generation)
+    try:
+        connection = get_connection()
+        row = connection.execute('SELECT value FROM results WHERE key = ? AND generation = ?', \
+                (key, generation)).fetchone()
+        if row is None:
+            return None
+        connection.execute('UPDATE results SET used = ? WHERE key = ?', (time(), key))
+        return pickle.loads(row[0])
+    except Exception as e:
+        logging.error(f">> SEARCH: QUERY CACHE: could not read cache: {e}")
+        return None
+
+
+def cache_results(query, lang, extended, generation, results, phrase=None):
+    """ Store the results of a query, evicting the least
+    recently used entries beyond QUERY_CACHE_SIZE and the
+    entries of older generations or settings.
+    """
+    size = app.config['QUERY_CACHE_SIZE']
+    if size == 0:
+        return
+    key = cache_key(query, lang, extended, phrase)
+    generation = cache_generation(generation)
+    try:
+        connection = get_connection()
+        connection.execute('DELETE FROM results WHERE lang = ? AND generation != ?', (lang, generation))
+        connection.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)', \
+                (key, lang, generation, time(), pickle.dumps(results)))
+        connection.execute('DELETE FROM results WHERE key IN (SELECT key FROM results \
+                ORDER BY used DESC LIMIT -1 OFFSET ?)', (size,))
+    except Exception as e:
+        logging.error(f">> SEARCH: QUERY CACHE: could not write cache: {e}")
@@ -14,16 +14,23 @@ from collections import Counter
 import joblib
 from joblib import Parallel, delayed
 from scipy.spatial import distance
-from scipy.sparse import load_npz, csr_matrix, vstack
+from scipy.sparse import csr_matrix, vstack
+from sqlalchemy import select
 import numpy as np
 from flask import url_for
-from app import app, db, models
-from app.api.models import Urls
-from app.search.overlap_calculation import (snippet_overlap,
-        score_url_overlap, posix, posix_no_seq)
+from app import app, db, models, VEC_SIZE
+from app.api.models import Urls, Pods
+from app.search.overlap_calculation import (batch_snippet_scores,
+        score_url_overlap, posix_arrays, posix_no_seq, posix_proximity)
+from app.search.sparse_scoring import normalise_rows, sparse_cosines
 from app.utils import parse_query, timer
-from app.indexer.mk_page_vector import compute_query_vectors
+from app.indexer.mk_page_vector import compute_query_vectors, tokenize_text
 from app.indexer.posix import load_posix
+from app.indexer.pod_segments import load_pod, load_pod_matrix, id_rows
+from app.indexer.inverted_index import mk_invix, load_invix, dump_invix
+from app.search.matrix_store import MatrixStore, journal_position, index_generation, snapshot_lock, \
+        pods_fingerprint, load_snapshot, save_snapshot, meta_as_dict, META_COLUMNS
+from app.search.query_cache import get_cached_results, cache_results
 
 dir_path = dirname(dirname(realpath(__file__)))
 pod_dir = getenv("PODS_DIR", join(dir_path, 'pods'))
@@ -37,7 +44,7 @@ def mk_podsum_matrix(lang):
     npzs = glob(join(pod_dir,'*',lang,'*.u.*npz'))
     for npz in npzs:
         podname = npz.split('/')[-1].replace('.npz','')
-        s = np.sum(load_npz(npz).toarray(), axis=0)
+        s = np.asarray(load_pod_matrix(npz).sum(axis=0)).ravel()
         #print(podname, np.sum(s), s)
         if np.sum(s) > 0:
             podsum.append(s)
@@ -51,93 +58,125 @@ def mk_podsum_matrix(lang):
 @timer
 def mk_vec_matrix(lang):
     """ Make a vector matrix by stacking all
-    pod matrices."""
-    c = 0
+    pod matrices. The rows are L2-normalised once
+    here and the matrix is kept in CSR format.
+    The inverted index of the language is stacked
+    from the pods' inverted indices in the same way.
+    The rows and metadata (META_COLUMNS) of the documents
+    of the language are fetched with a single query, and
+    kept column-wise in arrays.
+    """
     podnames = []
-    bins = [c]
+    counts = []
     m = []
-    urls = []
-
-    npzs = glob(join(pod_dir,'*',lang,'*.u.*npz'))
-    for npz in npzs:
-        podnames.append(npz.split('/')[-1].replace('.npz',''))
+    invs = []
+    selected = []
 
+    columns = ['vector'] + list(META_COLUMNS)
     with app.app_context():
-        for i in range(len(podnames)):
-            us = db.session.query(Urls).filter_by(pod=podnames[i]).all()
-            if len(us) == 0:
-                continue
-            upaths = [u.url for u in us if u.vector is not None]
-            idvs = [u.vector for u in us if u.vector is not None]
-            urls.extend(upaths)
-            npz = load_npz(npzs[i]).toarray()
-            npz = npz[idvs,:]
-            m.append(csr_matrix(npz))
-            c+=npz.shape[0]
-            bins.append(c)
-        m = vstack(m)
-        m = csr_matrix(m)
-    return m, bins, podnames, urls
+        pods = select(Pods.name).where(Pods.language == lang)
+        rows = db.session.execute(select(*[getattr(Urls, c) for c in columns]) \
+                .where(Urls.vector.isnot(None), Urls.pod.in_(pods)).order_by(Urls.id)).all()
+    values = {c: np.empty(len(rows), dtype=object) for c in columns}
+    for i, c in enumerate(columns):
+        values[c][:] = [row[i] for row in rows]
+    vectors = values['vector'].astype(np.int64)
+    # The documents of each pod, in order of id
+    order = np.argsort(values['pod'].astype(str), kind='stable')
+    pod_names, starts = np.unique(values['pod'][order].astype(str), return_index=True)
+    pod_rows = dict(zip(pod_names, np.split(order, starts[1:])))
+
+    npzs = glob(join(pod_dir,'*',lang,'*.u.*npz'))
+    for npz_path in npzs:
+        podname = npz_path.split('/')[-1].replace('.npz','')
+        if podname not in pod_rows:
+            continue
+        sel = pod_rows[podname]
+        npz, ids = load_pod(npz_path)
+        npz = npz.tocsr()
+        invix = load_invix(npz_path)
+        if invix.shape[0] > npz.shape[0]:
+            logging.error(f">> SEARCH: mk_vec_matrix: inverted index out of sync for {npz_path}, rebuilding it.")
+            invix = mk_invix(npz)
+            dump_invix(invix, npz_path)
+        elif invix.shape[0] < npz.shape[0]:
+            #The pod's inverted index only covers compacted rows
+            invix = vstack((invix, mk_invix(npz[invix.shape[0]:])), format='csc')
+        # Urls.vector holds the stable id of each row
+        idvs, found = id_rows(ids, vectors[sel])
+        if not np.all(found):
+            logging.error(f">> SEARCH: mk_vec_matrix: {np.sum(~found)} urls of {podname} have no vector.")
+            sel, idvs = sel[found], idvs[found]
+        podnames.append(podname)
+        selected.append(sel)
+        m.append(npz[idvs])
+        invs.append(invix[idvs,:])
+        counts.append(len(idvs))
+    bins = np.concatenate([[0], np.cumsum(counts, dtype=np.int64)])
+    selected = np.concatenate(selected) if selected else np.zeros(0, dtype=np.int64)
+    urls = values['url'][selected]
+    meta = {c: values[c][selected] for c in META_COLUMNS}
+    if len(m) == 0:
+        return csr_matrix((0, VEC_SIZE)), bins, podnames, urls, meta, mk_invix(csr_matrix((0, VEC_SIZE)))
+    m = vstack(m, format='csr')
+    m = normalise_rows(m)
+    invix = vstack(invs, format='csc')
+    return m, bins, podnames, urls, meta, invix
 
 
 def load_vec_matrix(lang):
-    if 'm' in models[lang]:
-        m = models[lang]['m']
-        bins = models[lang]['mbins']
-        podnames = models[lang]['podnames']
-        urls = models[lang]['urls']
-    else:
-        m, bins, podnames, urls = mk_vec_matrix(lang)
-    m = m.todense()
-    return m, bins, podnames, urls
+    """ Return the in-memory matrix store for a language.
+    It is built from the pods on first use (at startup,
+    unless LIVE_MATRIX is set) and then kept up to date
+    incrementally by the indexer. The first worker to build
+    it saves a snapshot, which the others map.
+    """
+    store = models[lang].get('store')
+    if store is None or not store.sync():
+        with snapshot_lock(lang):
+            fingerprint = pods_fingerprint(lang)
+            store = load_snapshot(lang, fingerprint)
+            if store is None:
+                position = journal_position(lang)
+                m, bins, podnames, urls, meta, invix = mk_vec_matrix(lang)
+                save_snapshot(lang, m, bins, podnames, urls, meta, invix, position, fingerprint)
+                store = load_snapshot(lang, fingerprint)
+                if store is None:
+                    # The journal was rotated while building
+                    store = MatrixStore(lang, m, bins, podnames, urls, meta, invix, position)
+        store.sync()
+        models[lang]['store'] = store
+    return store
 
 
 
 @timer
 def compute_scores(query, query_vectors, lang):
-    snippet_length = app.config['SNIPPET_LENGTH']
-    m, bins, podnames, urls = load_vec_matrix(lang)
+    store = load_vec_matrix(lang)
+    urls = store.urls
     query_vector = np.sum(query_vectors, axis=0)
-    
+
+    # Only score live documents in the posting lists of the query's subwords
+    rows = store.candidate_rows(np.nonzero(query_vector)[1])
+
     # Only compute cosines over the dimensions of interest
-    a = np.where(query_vector!=0)[1]
-    cos = 1 - distance.cdist(query_vector[:,a], m[:,a], 'cosine')[0]
-    cos[np.isnan(cos)] = 0
+    cos = sparse_cosines(query_vector, store.m[rows])
 
-    # Document ids with non-zero values (match at least one subword)
+    # Candidates with non-zero values (match at least one subword)
     idx = np.where(cos!=0)[0]
 
-    # Sort document ids with non-zero values and take top 50
-    idx = np.argsort(cos)[-len(idx):][::-1][:50]
+    # Sort candidates with non-zero values and take the best ones
+    idx = idx[np.argsort(cos[idx])[::-1][:app.config['RERANK_CANDIDATES']]]
+
+    # Re-rank them with their title, snippet and url, all at once
+    best_rows = rows[idx]
+    best_urls = [urls[r] for r in best_rows]
+    snippet_scores = batch_snippet_scores(query, [store.rank_texts[r] for r in best_rows], \
+            best_urls, [store.locs[r] for r in best_rows])
 
-    # Get urls
     document_scores = {}
-    best_urls = [urls[i] for i in idx]
-    best_cos = [cos[i] for i in idx]
-    us = Urls.query.filter(Urls.url.in_(best_urls)).all()
-
-    snippet_scores = {}
-    for u in us:
-        if u.snippet is None:
-            u.snippet = ''
-            snippet_score = 0.0
-        else:
-            snippet = ' '.join(u.snippet.split()[:snippet_length])
-            snippet_score = snippet_overlap(query, u.title+' '+snippet)
-        loc = urlparse(u.url).netloc.split('.')[0]
-
-        #Big boost in case the query word is the url
-        if query == loc:
-            snippet_score+=0.5
-        #Little boost in case the query words are in the url
-        for w in query.split():
-            if w in u.url:
-                snippet_score+=0.1
-        snippet_scores[u.url] = snippet_score
-
-    for i, u in enumerate(best_urls):
-        #print(f"url: {u}, snippet_score: {snippet_scores[u]}, cos: {best_cos[i]}")
-        document_scores[u] = best_cos[i] + snippet_scores[u]
+    for u, score in zip(best_urls, cos[idx] + snippet_scores):
+        document_scores[u] = score
 
     return document_scores
 
@@ -164,14 +203,15 @@ def return_best_urls(doc_scores):
     return best_urls, scores
 
 
-def output(best_urls, scores):
+def output(best_urls, scores, lang):
     snippet_length = app.config['SNIPPET_LENGTH']
     results = {}
-    urls = Urls.query.filter(Urls.url.in_(best_urls)).all()
-    urls = [next(u for u in urls if u.url == best_url) for best_url in best_urls]
-    for i, u in enumerate(urls):
-        url = u.url
-        results[url] = u.as_dict()
+    store = load_vec_matrix(lang)
+    for i, url in enumerate(best_urls):
+        u = store.meta[store.rows[url]]
+        if u['snippet'] is None:
+            u = dict(u, snippet='')
+        results[url] = meta_as_dict(u)
         results[url]['score'] = scores[i]
         if not url.startswith('pearslocal'):
             results[url]['snippet'] = ' '.join(results[url]['snippet'].split()[:snippet_length])
@@ -179,12 +219,49 @@ def output(best_urls, scores):
 
 
 
-def run_search(query, lang, extended=True):
+def rescore_phrases(phrase, document_scores, lang):
+    """ Boost candidates of the vector engine that contain the
+    phrase exactly, using the positional indices of their pods.
+    Documents are indexed with their stopwords, so the phrase
+    must keep them too. Pods are searched in the order of their
+    best candidate until PHRASE_TIME_BUDGET milliseconds have
+    been spent; the remaining candidates keep their score.
+    """
+    start = time()
+    budget = app.config['PHRASE_TIME_BUDGET'] / 1000
+    store = load_vec_matrix(lang)
+    q = tokenize_text(phrase, lang)
+    pods = {}
+    for url in sorted(document_scores, key=document_scores.get, reverse=True):
+        u = store.meta[store.rows[url]]
+        pods.setdefault(u['pod'], {})[u['id']] = url
+    for i, (pod, doc_urls) in enumerate(pods.items()):
+        if time() - start > budget:
+            logging.info(f">> SEARCH: rescore_phrases: time budget exceeded, skipping {len(pods)-i} pods")
+            break
+        theme, contributor = pod.split('.u.')
+        posindex = load_posix(contributor, lang, theme)
+        for doc_id in posix_proximity(q, posindex, lang, window=1, docs=list(doc_urls)):
+            document_scores[doc_urls[doc_id]] += 1.0
+    return document_scores
+
+
+def run_search(query, lang, extended=True, phrase=None):
     """Run search on query input by user
 
     Parameter: query, a query string.
+    phrase: the query as typed, with its stopwords, which hybrid
+    search matches as an exact phrase (defaults to query).
     Returns: a list of documents. Each document is a dictionary. 
+    Results are cached until the index of the language changes.
     """
+    if phrase is None or not app.config['HYBRID_SEARCH']:
+        phrase = query
+    generation = index_generation(lang)
+    cached = get_cached_results(query, lang, extended, generation, phrase)
+    if cached is not None:
+        return cached
+
     document_scores = {}
     extended_document_scores = {}
 
@@ -204,34 +281,35 @@ def run_search(query, lang, extended=True):
         else:
             merged_scores[k] = 0.5*extended_document_scores[k]
 
+    # Hybrid mode: boost exact-phrase matches
+    if app.config['HYBRID_SEARCH'] and len(phrase.split()) > 1:
+        merged_scores = rescore_phrases(phrase, merged_scores, lang)
+
     best_urls, scores = return_best_urls(merged_scores)
-    results = output(best_urls, scores)
+    results = output(best_urls, scores, lang)
+    cache_results(query, lang, extended, generation, (results, scores), phrase)
     return results, scores
 
 
 
 
 def intersect_best_posix_lists(query_tokenized, posindex, lang):
-    tmp_best_docs = []
-    posix_scores = {}
-    # Loop throught the token list corresponding to each word
-    for word_tokens in query_tokenized:
-        scores = posix(' '.join(word_tokens), posindex, lang)
-        logging.debug(f"POSIX SCORES: {scores}")
-        tmp_best_docs.append(list(scores.keys()))
-        for k,v in scores.items():
-            if k in posix_scores:
-                posix_scores[k].append(v)
-            else:
-                posix_scores[k] = [v]
-    q_best_docs = set.intersection(*map(set,tmp_best_docs))
-    if len(q_best_docs) == 0:
-        q_best_docs = set.union(*map(set,tmp_best_docs))
-    best_docs = {}
-    for d in q_best_docs:
-        docscore = np.mean(posix_scores[d])
-        best_docs[d] = docscore
-    logging.info(f"BEST DOCS FROM POS INDEX: {best_docs}")
+    """ Score documents on the positional index, word by word.
+    Documents matching every word of the query get the mean of
+    their word scores; if there are none, documents matching any
+    word do.
+    """
+    if len(query_tokenized) == 0:
+        return {}
+    # Score the documents matching each word
+    docs, scores = zip(*[posix_arrays(' '.join(word_tokens), posindex, lang) for word_tokens in query_tokenized])
+    docs, inverse, counts = np.unique(np.concatenate(docs), return_inverse=True, return_counts=True)
+    mean_scores = np.bincount(inverse, weights=np.concatenate(scores), minlength=len(docs)) / np.maximum(counts, 1)
+    best = counts == len(query_tokenized)
+    if not np.any(best):
+        best = counts > 0
+    best_docs = dict(zip(docs[best].tolist(), mean_scores[best].tolist()))
+    logging.info(f"BEST DOCS FROM POS INDEX: {len(best_docs)}")
     return best_docs
 
 
@@ -251,16 +329,15 @@ def score_pods(query_words, query_vectors, extended_q_vectors, lang):
     max_pods = app.config["MAX_PODS"] # How many pods to return
     pod_scores = {}
 
-    m, bins, podnames = load_vec_matrix(lang)
+    store = load_vec_matrix(lang)
+    m, bins, podnames = store.m, store.bins, store.podnames
 
     tmp_best_pods = []
     tmp_best_scores = []
     # For each word in the query, compute best pods
     for query_vector in query_vectors:
         # Only compute cosines over the dimensions of interest
-        a = np.where(query_vector!=0)[1]
-        cos = 1 - distance.cdist(query_vector[:,a], m[:,a], 'cosine')[0]
-        cos[np.isnan(cos)] = 0
+        cos = sparse_cosines(query_vector, m)
 
         # Document ids with non-zero values (match at least one subword)
         idx = np.where(cos!=0)[0]
@@ -0,0 +1,49 @@
+# SPDX-FileCopyrightText: 2025 PeARS Project, <community@pearsproject.org>,
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import numpy as np
+from scipy.sparse import csr_matrix, diags
+
+
+def normalise_rows(m):
+    """ L2-normalise the rows of a sparse matrix once,
+    so that it can be kept in CSR format for scoring.
+    All-zero rows are left untouched.
+    """
+    m = csr_matrix(m, dtype=np.float64)
+    norms = np.sqrt(np.asarray(m.multiply(m).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return csr_matrix(diags(1 / norms) @ m)
+
+
+def sparse_cosines(query_vector, m):
+    """ Compute the cosine between a query and every row
+    of a CSR matrix, without densifying the matrix.
+
+    As in the original dense implementation, the cosine is
+    only computed over the non-zero dimensions of the query:
+    we slice these columns out of the matrix and run a sparse
+    mat-vec over them. The restricted cosine is invariant to
+    the scaling of each row, so pre-normalised rows give the
+    same scores. Rows sharing no dimension with the query
+    get a score of 0.
+
+    Arguments:
+    query_vector: a (1, vocab size) numpy array
+    m: a CSR matrix with one row per document (or instance)
+
+    Returns: a numpy array of cosines, one per row of m.
+    """
+    query_vector = np.asarray(query_vector).ravel()
+    cos = np.zeros(m.shape[0])
+    a = np.nonzero(query_vector)[0]
+    if len(a) == 0 or m.shape[0] == 0:
+        return cos
+    q = query_vector[a]
+    m_a = m[:, a]
+    dots = m_a @ q
+    m_norms = np.sqrt(np.asarray(m_a.multiply(m_a).sum(axis=1)).ravel())
+    nz = m_norms != 0
+    cos[nz] = dots[nz] / (m_norms[nz] * np.linalg.norm(q))
+    return cos
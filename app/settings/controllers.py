@@ -12,9 +12,9 @@ from markupsafe import Markup
 from flask import Blueprint, flash, request, render_template, redirect, url_for, session
 from flask_login import current_user, logout_user
 from flask_babel import gettext
-import app as app_module
 from app import app, db
-from app.search.cross_instance_search import filter_instances_by_language
+from app.search import cross_instance_search
+from app.search.cross_instance_search import start_refresher
 from app.api.models import Urls, User
 from app.forms import EmailChangeForm, UsernameChangeForm
 from app.utils_db import delete_url_representations
@@ -63,19 +63,19 @@ def toggle_maintenance_mode():
 @settings.route("refresh_remotes")
 @check_permissions(login=True, confirmed=True, admin=True)
 def refresh_remote_instances():
-    try:
-        app_module.instances, app_module.M, skipped_instances = filter_instances_by_language()
-        skip_text = gettext('<li class="list-group-item list-group-item-secondary"><small><a href="{}">{}</a><br><span class="badge text-bg-warning"><code>{}</code></span></small></li>')
-        message = "The list of remote instances was successfully refreshed."
-        if skipped_instances:
-            message += '<br>Some instances were skipped: <ul class="list-group">'
-        for skipped in skipped_instances:
-            message += skip_text.format(skipped["instance"], skipped["instance"], skipped["reason"])
-        if skipped_instances:
-            message += "</ul>"
-        flash(Markup(message), "success")
-    except Exception as e:
-        flash(gettext(f"An error occurred while refreshing the list of remote instances: {e}"), "error")
+    if start_refresher():
+        message = "The list of remote instances is being refreshed in the background."
+    else:
+        message = "The list of remote instances is already being refreshed."
+    skipped_instances = cross_instance_search.skipped_remotes
+    skip_text = gettext('<li class="list-group-item list-group-item-secondary"><small><a href="{}">{}</a><br><span class="badge text-bg-warning"><code>{}</code></span></small></li>')
+    if skipped_instances:
+        message += '<br>Some instances were skipped at the last refresh: <ul class="list-group">'
+    for skipped in skipped_instances:
+        message += skip_text.format(skipped["instance"], skipped["instance"], skipped["reason"])
+    if skipped_instances:
+        message += "</ul>"
+    flash(Markup(message), "success")
     return redirect(url_for("search.index"))
 
 
@@ -4,16 +4,19 @@
 
 import logging
 from os import remove, rename, getenv
-from os.path import dirname, realpath, join, isfile
+from os.path import dirname, realpath, join, isfile, isdir
+from shutil import rmtree
 from pathlib import Path
 from string import punctuation
-import joblib
-from sqlalchemy import update
 import numpy as np
-from scipy.sparse import csr_matrix, load_npz, vstack, save_npz
-from app import db, models, VEC_SIZE
+from scipy.sparse import csr_matrix, save_npz
+from app import db, VEC_SIZE
 from app.api.models import Urls, Pods, Suggestions
-from app.indexer.posix import load_posix, dump_posix
+from app.indexer.posix import create_posix, rm_doc_from_posix, posix_columns
+from app.indexer.inverted_index import mk_invix, dump_invix
+from app.indexer.pod_segments import segments_dir, append_to_pod, rm_from_pod, load_pod_row
+from app.indexer.signature import signature_rm_pod, signature_mv_pod
+from app.search.matrix_store import rm_from_matrix
 
 dir_path = dirname(dirname(realpath(__file__)))
 pod_dir = getenv("PODS_DIR", join(dir_path, 'app', 'pods'))
@@ -38,18 +41,17 @@ def create_pod_npz_pos(contributor, theme, lang):
     user_dir = join(pod_dir,contributor, lang)
     Path(user_dir).mkdir(parents=True, exist_ok=True)
     pod_path = join(user_dir, theme+'.u.'+contributor )
-    vocab = models[lang]['vocab']
     if not isfile(pod_path+'.npz'):
         logging.debug(">> UTILS_DB: create_pod_npz_pos: Making 0 CSR matrix for new pod")
         pod = np.zeros((1,VEC_SIZE))
         pod = csr_matrix(pod)
         save_npz(pod_path+'.npz', pod)
+        dump_invix(mk_invix(pod), pod_path+'.npz')
         logging.debug(f">> UTILS_DB: create_pod_npz_pos: {pod.shape[0]}")
 
-    if not isfile(pod_path+'.pos'):
+    if not isdir(pod_path+'.pos'):
         logging.debug(">> UTILS_DB: create_pod_npz_pos: Making empty positional index for new pod")
-        posindex = [{} for _ in range(len(vocab))]
-        joblib.dump(posindex, pod_path+'.pos')
+        create_posix(contributor, lang, theme)
     return pod_path
 
 
@@ -74,10 +76,12 @@ def create_suggestion_in_db(url, pod, notes, contributor):
     db.session.add(s)
     db.session.commit()
 
-def create_or_replace_url_in_db(url, title, idv, snippet, frame_annotations, theme, lang, note, share, contributor, entry_type):
+def create_or_replace_url_in_db(url, title, idv, snippet, frame_annotations, theme, lang, note, share, contributor, entry_type, commit=True):
     """Add a new URL to the database or update it.
     Arguments: url, title, snippet, theme, language,
     note warning, username, type (url or doc).
+    Batch indexing sets commit to False and commits
+    once per batch.
     """
     cc = False
     entry = db.session.query(Urls).filter_by(url=url).first()
@@ -102,7 +106,8 @@ def create_or_replace_url_in_db(url, title, idv, snippet, frame_annotations, the
         else:
             u.notes = note
     db.session.add(u)
-    db.session.commit()
+    if commit:
+        db.session.commit()
     return u.id
 
 
@@ -117,12 +122,9 @@ def add_to_npz(v, pod_path):
     pod_path: the path to the target pod
 
     Returns:
-    vid: the new row number for the vector
+    vid: the id of the new row in the pod
     """
-    pod_m = load_npz(pod_path)
-    pod_m = vstack((pod_m,csr_matrix(v)))
-    save_npz(pod_path, pod_m)
-    vid = pod_m.shape[0]
+    vid = append_to_pod(pod_path, csr_matrix(v))
     return vid
 
 
@@ -145,14 +147,24 @@ def delete_pod_representations(pod_name):
             #This is going to be slow for many urls...
             db.session.delete(u)
             db.session.commit()
+            rm_from_matrix(lang, u.url)
     npz_path = join(pod_dir, contributor, lang, pod_name+'.npz')
     if isfile(npz_path):
         remove(npz_path)
     npz_idx_path = join(pod_dir, contributor, lang, pod_name+'.npz.idx')
     if isfile(npz_idx_path):
         remove(npz_idx_path)
+    inv_path = join(pod_dir, contributor, lang, pod_name+'.inv')
+    if isfile(inv_path):
+        remove(inv_path)
+    segs_path = segments_dir(npz_path)
+    if isdir(segs_path):
+        rmtree(segs_path)
+    signature_rm_pod(npz_path)
     pos_path = join(pod_dir, contributor, lang, pod_name+'.pos')
-    if isfile(pos_path):
+    if isdir(pos_path):
+        rmtree(pos_path)
+    elif isfile(pos_path):
         remove(pos_path)
     db.session.delete(pod)
     db.session.commit()
@@ -164,12 +176,12 @@ def delete_url_representations(url):
     u = db.session.query(Urls).filter_by(url=url).first()
     pod = u.pod
     username = pod.split('.u.')[1]
+    _, _, lang = parse_pod_name(pod)
     logging.debug(f">> UTILS_DB: delete_url_representations: POD {pod}, USER {username}")
 
     #Remove document row from .npz matrix
     try:
-        idv, _ = rm_from_npz(u.vector, pod)
-        update_db_idvs_after_npz_delete(idv, pod)
+        rm_from_npz(u.vector, pod)
     except:
         logging.debug(f">> UTILS_DB: delete_url_representations: could not remove vector from npz file.")
 
@@ -183,6 +195,9 @@ def delete_url_representations(url):
     db.session.delete(u)
     db.session.commit()
 
+    #Remove from search matrix
+    rm_from_matrix(lang, url)
+
     #If pod empty, delete
     if len(db.session.query(Urls).filter_by(pod=pod).all()) == 0:
         delete_pod_representations(pod)
@@ -190,63 +205,47 @@ def delete_url_representations(url):
     return "Deleted document with url "+url
 
 
+def get_npz_vector(vid, pod_name):
+    """ Return the vector with row id vid in a pod."""
+    contributor, _, lang = parse_pod_name(pod_name)
+    pod_path = join(pod_dir, contributor, lang, pod_name+'.npz')
+    return load_pod_row(pod_path, vid)
+
+
 def rm_from_npz(vid, pod_name):
-    """ Remove vector from npz file.
+    """ Remove vector from npz file. The row is only marked
+    as deleted, and row ids are stable, so the other rows of the
+    pod, and the database records pointing to them, are left
+    untouched.
     Arguments:
-    vid: the row number of the vector
-    pod_path: the path to the pod containing the vector
-
-    Returns: the deleted vector
+    vid: the id of the row holding the vector
+    pod_name: the name of the pod containing the vector
     """
     contributor, _, lang = parse_pod_name(pod_name)
     pod_path = join(pod_dir, contributor, lang, pod_name+'.npz')
-    pod_m = load_npz(pod_path)
-    logging.debug(f">> UTILS_DB: rm_from_npz: SHAPE OF NPZ MATRIX BEFORE RM: {pod_m.shape}")
-    v = pod_m[vid]
-    logging.debug(f">> UTILS_DB: rm_from_npz: CHECKING SHAPE OF DELETED VEC: {pod_m.shape}")
-    m1 = pod_m[:vid]
-    m2 = pod_m[vid+1:]
-    pod_m = vstack((m1,m2))
-    logging.debug(f">> UTILS_DB: rm_from_npz: SHAPE OF NPZ MATRIX AFTER RM: {pod_m.shape}")
-    save_npz(pod_path, pod_m)
-    return vid, v
-
-##############
-# CLEANING
-##############
-def update_db_idvs_after_npz_delete(idv, pod):
-    condition = (Urls.pod == pod) & (Urls.vector > idv)
-    update_stmt = update(Urls).where(condition).values(vector=Urls.vector-1)
-    db.session.execute(update_stmt)
+    rm_from_pod(pod_path, vid)
 
 
 def rm_doc_from_pos(vid, pod):
-    """ Remove wordpieces from pos file.
+    """ Remove a document from the positional index of a pod.
     Arguments:
-    vid: the ID of the vector recording the wordpieces
+    vid: the ID of the document (its id in the database)
     pod: the name of the pod
 
-    Returns: the content of the positional index for that vector.
+    Returns: the postings of the document, as posix columns.
     """
     contributor, theme, lang = parse_pod_name(pod)
-    vocab = models[lang]['vocab']
-    posindex = load_posix(contributor, lang, theme)
-    remaining_posindex = []
-    deleted_posindex = []
-    logging.debug(f">> UTILS_DB: rm_from_npz: DELETING DOC ID {vid}")
-    for token in vocab:
-        token_id = vocab[token]
-        tmp_remaining = {}
-        tmp_deleted = {}
-        for doc_id, posidx in posindex[token_id].items():
-            if doc_id != vid:
-                tmp_remaining[doc_id] = posidx
-            else:
-                tmp_deleted[doc_id] = posidx
-        remaining_posindex.append(tmp_remaining)
-        deleted_posindex.append(tmp_deleted)
-    dump_posix(remaining_posindex, contributor, lang, theme)
-    return deleted_posindex
+    logging.debug(f">> UTILS_DB: rm_doc_from_pos: DELETING DOC ID {vid}")
+    return rm_doc_from_posix(vid, contributor, lang, theme)
+
+
+def mv_doc_in_pos(vid, src_pod, target_pod):
+    """ Move a document from the positional index of a pod
+    to that of another pod.
+    """
+    columns = rm_doc_from_pos(vid, src_pod)
+    contributor, theme, lang = parse_pod_name(target_pod)
+    posix_columns(columns, contributor, lang, theme)
 
 ##########
 # Renaming
@@ -287,6 +286,21 @@ def mv_pod(src, target, contributor=None):
         src_path = join(pod_path,src+'.pos')
         target_path = join(pod_path,target+'.pos')
         rename(src_path, target_path)
+
+        #Rename inverted index
+        src_path = join(pod_path,src+'.inv')
+        target_path = join(pod_path,target+'.inv')
+        if isfile(src_path):
+            rename(src_path, target_path)
+
+        #Rename segments
+        src_path = join(pod_path,src+'.segs')
+        target_path = join(pod_path,target+'.segs')
+        if isdir(src_path):
+            rename(src_path, target_path)
+
+        #Rename pod sum
+        signature_mv_pod(join(pod_path,src+'.npz'), join(pod_path,target+'.npz'))
         
         #Rename in DB
         logging.debug(p.name)
@@ -0,0 +1,75 @@
+# SPDX-FileCopyrightText: 2025 PeARS Project, <community@pearsproject.org>
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from app import app
+
+session = None
+# Requests with a deadline of their own are never retried
+budget_session = None
+session_lock = threading.Lock()
+
+
+def mk_session(retry):
+    adapter = HTTPAdapter(pool_connections=app.config['HTTP_POOL_SIZE'],
+            pool_maxsize=app.config['HTTP_POOL_SIZE'], max_retries=retry)
+    s = requests.Session()
+    s.mount('http://', adapter)
+    s.mount('https://', adapter)
+    s.headers['User-Agent'] = app.config['USER-AGENT']
+    return s
+
+
+def get_session(retries=True):
+    """ Return the HTTP session shared by all outbound
+    requests of this process. It keeps connections alive
+    in a pool per host, retries failed connections, and GET
+    and HEAD requests answered with a transient error status,
+    with exponential backoff, and sets our user agent. Reads
+    that time out are not retried, so a stalled server costs
+    a single HTTP_TIMEOUT. If retries is False, the session
+    that never retries is returned instead.
+    """
+    global session, budget_session
+    with session_lock:
+        if not retries:
+            if budget_session is None:
+                budget_session = mk_session(0)
+            return budget_session
+        if session is None:
+            retry = Retry(total=app.config['HTTP_RETRIES'], read=0,
+                    backoff_factor=app.config['HTTP_BACKOFF'],
+                    status_forcelist=(429, 500, 502, 503, 504),
+                    allowed_methods=frozenset(['HEAD', 'GET']),
+                    raise_on_status=False)
+            session = mk_session(retry)
+    return session
+
+
+def request(method, url, retries=True, **kwargs):
+    """ Send a request through the shared session. The timeout
+    defaults to HTTP_TIMEOUT seconds. As in requests, it bounds
+    each socket operation (connecting, and each read), not the
+    whole request: a peer that keeps sending bytes slowly can
+    take longer. Searches on remote instances are bounded as a
+    whole by CROSS_INSTANCE_BUDGET instead (see
+    get_cross_instance_results), and are sent with retries
+    set to False, so that retries do not run past it."""
+    kwargs.setdefault('timeout', app.config['HTTP_TIMEOUT'])
+    return get_session(retries).request(method, url, **kwargs)
+
+
+def get(url, **kwargs):
+    return request('GET', url, **kwargs)
+
+
+def head(url, **kwargs):
+    return request('HEAD', url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request('POST', url, **kwargs)
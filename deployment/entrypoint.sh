@@ -23,4 +23,4 @@ done
 
 flask db migrate
 
-gunicorn -b 0.0.0.0:8000 -w 3 -t 120 app:app
\ No newline at end of file
+gunicorn -c /app/deployment/gunicorn.conf.py -b 0.0.0.0:8000 -w 3 -t 120 app:app
\ No newline at end of file
@@ -0,0 +1,11 @@
+# SPDX-FileCopyrightText: 2025 PeARS Project, <community@pearsproject.org>
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+# Gunicorn settings for the PeARS container.
+# Each worker loads its models and search matrices before
+# serving, so that the first searches are not slow.
+
+def post_worker_init(worker):
+    from app import warm_up
+    warm_up()
@@ -0,0 +1,23 @@
+# SPDX-FileCopyrightText: 2025 PeARS Project, <community@pearsproject.org>,
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+""" The tests run against a throwaway instance: its database
+and pods live in a temporary directory. Run them from the root
+of the repository, so that the language models are found.
+"""
+
+import os
+import tempfile
+from pathlib import Path
+
+instance_dir = tempfile.mkdtemp(prefix='pears-tests-')
+Path(instance_dir, 'PeARS-sociofillmore').mkdir()
+# The database is created at /home/<PA_USERNAME>/PeARS-sociofillmore/app.db
+os.environ['PA_USERNAME'] = os.path.relpath(instance_dir, '/home')
+os.environ['PODS_DIR'] = os.path.join(instance_dir, 'pods')
+os.environ.setdefault('SECRET_KEY', 'test')
+os.environ.setdefault('SNIPPET_LENGTH', '10')
+os.environ.setdefault('SITENAME', 'http://localhost:8080')
+os.environ.setdefault('PEARS_LANGS', 'en')
+os.environ.setdefault('TRANSLATION_DIR', os.path.join(os.getcwd(), 'translations'))
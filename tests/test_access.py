@@ -0,0 +1,52 @@
+# SPDX-FileCopyrightText: 2025 PeARS Project, <community@pearsproject.org>,
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+from collections import OrderedDict
+from types import SimpleNamespace
+import pytest
+from app.indexer import access
+from app.indexer.access import robotcheck
+
+robots = {'http://a.org/robots.txt': 'User-agent: *\nDisallow: /private\n\nUser-agent: bot\nDisallow: /',
+          'http://b.org/robots.txt': 'User-agent: *\nDisallow: /'}
+
+
+@pytest.fixture
+def fetches(monkeypatch):
+    fetches = []
+    def get(url):
+        fetches.append(url)
+        if url not in robots:
+            return SimpleNamespace(status_code=404, text='')
+        return SimpleNamespace(status_code=200, text=robots[url])
+    monkeypatch.setattr(access.utils_http, 'get', get)
+    monkeypatch.setattr(access, 'robots_cache', OrderedDict())
+    return fetches
+
+
+def test_rules_are_applied(fetches):
+    assert robotcheck('http://a.org/public/page')
+    assert not robotcheck('http://a.org/private/page')
+    assert not robotcheck('http://b.org/page')
+    # No robots.txt, no rules
+    assert robotcheck('http://c.org/page')
+
+
+def test_rules_are_cached_per_domain(fetches, monkeypatch):
+    now = [1000.]
+    monkeypatch.setattr(access, 'time', lambda: now[0])
+    robotcheck('http://a.org/1')
+    robotcheck('http://a.org/2')
+    assert fetches == ['http://a.org/robots.txt']
+    now[0] += access.ROBOTS_TTL
+    robotcheck('http://a.org/3')
+    assert fetches == ['http://a.org/robots.txt'] * 2
+
+
+def test_least_recently_used_domains_are_evicted(fetches, monkeypatch):
+    monkeypatch.setattr(access, 'ROBOTS_CACHE_SIZE', 2)
+    for url in ('http://a.org/', 'http://b.org/', 'http://a.org/', 'http://c.org/', 'http://a.org/', 'http://b.org/'):
+        robotcheck(url)
+    assert list(access.robots_cache) == ['http://a.org', 'http://b.org']
+    assert fetches == ['http://a.org/robots.txt', 'http://b.org/robots.txt', 'http://c.org/robots.txt', 'http://b.org/robots.txt']
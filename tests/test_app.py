@@ -0,0 +1,55 @@
+# SPDX-FileCopyrightText: 2025 PeARS Project, <community@pearsproject.org>,
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import os
+import sys
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import pytest
+from app import models
+
+
+def run_fresh(script):
+    """ Run a script in a fresh interpreter, so that the app is
+    imported from scratch, with an instance of its own.
+
+    Returns: the instance directory.
+    """
+    instance_dir = tempfile.mkdtemp(prefix='pears-tests-')
+    Path(instance_dir, 'PeARS-sociofillmore').mkdir()
+    env = dict(os.environ, PA_USERNAME=os.path.relpath(instance_dir, '/home'))
+    subprocess.run([sys.executable, '-c', script.format(instance_dir=instance_dir)], env=env, check=True)
+    return instance_dir
+
+
+def test_database_is_created_on_first_use():
+    instance_dir = run_fresh('\n'.join([
+        'from pathlib import Path',
+        'from app import app, db',
+        'from app.api.models import Pods',
+        'assert not Path({instance_dir!r}, "PeARS-sociofillmore", "app.db").exists()',
+        'with app.app_context():',
+        '    assert Pods.query.count() == 0',
+    ]))
+    assert Path(instance_dir, 'PeARS-sociofillmore', 'app.db').exists()
+
+
+def test_models_are_loaded_on_first_use():
+    run_fresh('\n'.join([
+        'from app import app, models',
+        'assert len(models) == 0',
+        'app.test_client().get("/")',
+        'assert len(models) == 0',
+        'assert "vocab" in models["en"] and list(models) == ["en"]',
+    ]))
+
+
+def test_models_are_loaded_once():
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        loaded = list(executor.map(lambda _: models['en'], range(8)))
+    assert all(m is loaded[0] for m in loaded)
+    with pytest.raises(KeyError):
+        models['xx']
@@ -0,0 +1,23 @@
+# SPDX-FileCopyrightText: 2025 PeARS Project, <community@pearsproject.org>,
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import requests
+from app import app
+from app.cli import controllers
+
+
+def robotcheck(link):
+    if 'down' in link:
+        raise requests.ConnectionError('robots.txt timed out')
+    return True
+
+
+def test_getlinks_skips_links_with_unreachable_robots(monkeypatch):
+    monkeypatch.setattr(controllers, 'request_url', lambda url: (True, None, []))
+    monkeypatch.setattr(controllers, 'extract_links', lambda url: ['http://up.org/a', 'http://down.org/b', 'http://up.org/c'])
+    monkeypatch.setattr(controllers, 'robotcheck', robotcheck)
+    result = app.test_cli_runner(mix_stderr=False).invoke(args=['pears', 'getlinks', 'http://up.org'])
+    assert result.exit_code == 0
+    assert result.stdout.split() == ['http://up.org/a', 'http://up.org/c']
+    assert 'http://down.org/b' in result.stderr
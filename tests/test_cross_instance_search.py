@@ -0,0 +1,64 @@
+# SPDX-FileCopyrightText: 2025 PeARS Project, <community@pearsproject.org>,
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+from time import sleep
+from types import SimpleNamespace
+from unittest import mock
+import numpy as np
+from scipy.sparse import csr_matrix
+from app import app
+from app.indexer.mk_page_vector import compute_query_vectors
+from app.search import cross_instance_search as cis
+
+instances = [{"url": "http://fast"}, {"url": "http://slow"}]
+
+
+def fake_get(url, timeout=None, retries=True):
+    assert retries is False
+    if 'slow' in url:
+        sleep(1)
+    return SimpleNamespace(status_code=200, json=lambda: {'json_list': \
+            {'u1': {'url': 'u1', 'title': 'cats', 'snippet': '', 'score': 1}}})
+
+
+def test_late_instances_are_recorded_once(monkeypatch):
+    monkeypatch.setitem(app.config, 'CROSS_INSTANCE_BUDGET', 0.3)
+    monkeypatch.setattr(cis, 'instance_stats', {})
+    q = np.sum(compute_query_vectors('cats', 'en')[2], axis=0)
+    M = csr_matrix(np.vstack([q, q]))
+    with mock.patch('app.utils_http.get', side_effect=fake_get):
+        results = cis.get_cross_instance_results('cats', instances, M)
+        assert list(results) == ['u1']
+        # The slow instance is late as soon as the deadline passes
+        assert cis.instance_stats['http://slow']['late'] == 1
+        assert cis.instance_stats['http://fast']['answered'] == 1
+        # and its answer, when it comes, is not counted again
+        sleep(1)
+    assert cis.instance_stats['http://slow']['requests'] == 1
+
+
+def test_unreliable_instances_weigh_less(monkeypatch):
+    monkeypatch.setitem(app.config, 'CROSS_INSTANCE_BUDGET', 1.0)
+    monkeypatch.setattr(cis, 'instance_stats', {})
+    assert cis.instance_weight('http://unknown') == 1.
+    cis.record_request('http://good', 0.1)
+    cis.record_request('http://late', 1.0, late=True)
+    cis.record_request('http://down', 0.1, failed=True)
+    assert cis.instance_weight('http://good') > cis.instance_weight('http://down') > cis.instance_weight('http://late')
+    assert cis.instance_stats['http://down']['failures'] == cis.instance_stats['http://down']['requests'] == 1
+
+
+def test_failed_instances_are_dropped(monkeypatch):
+    monkeypatch.setitem(app.config, 'CROSS_INSTANCE_BUDGET', 1.0)
+    monkeypatch.setattr(cis, 'instance_stats', {})
+    def get(url, timeout=None, retries=True):
+        if 'slow' in url:
+            raise ConnectionError('refused')
+        return fake_get(url, timeout, retries)
+    q = np.sum(compute_query_vectors('cats', 'en')[2], axis=0)
+    M = csr_matrix(np.vstack([q, q]))
+    with mock.patch('app.utils_http.get', side_effect=get):
+        assert list(cis.get_cross_instance_results('cats', instances, M)) == ['u1']
+    assert cis.instance_stats['http://slow']['failures'] == 1
+    assert cis.instance_stats['http://slow']['late'] == 0
@@ -0,0 +1,60 @@
+# SPDX-FileCopyrightText: 2025 PeARS Project, <community@pearsproject.org>,
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import threading
+from time import sleep, time
+from types import SimpleNamespace
+import numpy as np
+import requests
+from app import VEC_SIZE
+from app.search import cross_instance_search as cis
+
+languages = {'http://en.org': ['en'], 'http://fr.org': ['fr'], 'http://slow.org': ['en']}
+
+
+def response(data, status_code=200):
+    return SimpleNamespace(status_code=status_code, json=lambda: data, headers={})
+
+
+def get(url, params=None, headers=None):
+    instance = url.split('/api/')[0]
+    if instance == 'http://down.org':
+        raise requests.ConnectionError('refused')
+    sleep(0.2)
+    if url.endswith('/api/languages'):
+        return response({'json_list': languages[instance]})
+    if '/api/signature/' in url:
+        return response({'size': VEC_SIZE, 'indices': [1, 2], 'values': [3., 4.]})
+    return response({'sitename': 'https://'+instance[7:], 'site_topic': None, 'organization': None})
+
+
+def test_instances_are_discovered_concurrently(monkeypatch):
+    monkeypatch.setattr(cis.utils_http, 'get', get)
+    monkeypatch.setattr(cis, 'signature_cache', {})
+    monkeypatch.setattr(cis, 'get_known_instances', lambda: ['http://en.org', 'http://fr.org', 'http://down.org', 'http://slow.org'])
+    start = time()
+    instances, M, skipped = cis.filter_instances_by_language()
+    # Three requests per instance, but the instances are contacted at once
+    assert time() - start < 1.2
+    assert [i['url'] for i in instances] == ['http://en.org', 'http://slow.org']
+    assert instances[0]['sitename'] == 'en.org'
+    assert skipped == [{'instance': 'http://down.org', 'reason': 'connection error for /api/languages'}]
+    assert M.shape == (2, VEC_SIZE)
+    assert np.allclose(M[:, [1, 2]].toarray(), [[.6, .8], [.6, .8]])
+
+
+def test_one_refresh_at_a_time(monkeypatch):
+    release = threading.Event()
+    def filter_instances_by_language():
+        release.wait()
+        return [{'url': 'http://en.org'}], 'M', []
+    monkeypatch.setattr(cis, 'filter_instances_by_language', filter_instances_by_language)
+    monkeypatch.setattr(cis, 'remotes', ([], None))
+    assert cis.start_refresher()
+    assert not cis.start_refresher()
+    # Searches see the previous remotes until the refresh is done
+    assert cis.get_remote_instances() == ([], None)
+    release.set()
+    with cis.refresher_lock:
+        assert cis.get_remote_instances() == ([{'url': 'http://en.org'}], 'M')
@@ -0,0 +1,27 @@
+# SPDX-FileCopyrightText: 2025 PeARS Project, <community@pearsproject.org>,
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+from unittest import mock
+from app import app
+from app.indexer import controllers as indexer
+from app.search.controllers import get_local_search_results
+
+docs = {'pearslocalphrase1': 'She studied medicine at the university of edinburgh for five years.',
+        'pearslocalphrase2': 'The university moved to a new campus, far from edinburgh and its castle.'}
+
+
+def test_hybrid_search_boosts_phrases_with_stopwords(monkeypatch):
+    monkeypatch.setitem(app.config, 'QUERY_CACHE_SIZE', 0)
+    with app.app_context():
+        with mock.patch('app.indexer.mk_page_vector.get_frame_annotations', return_value=''):
+            for url, text in docs.items():
+                indexer.run_indexer_manual(url, 'Studies', text, 'Phrases', 'en', '', 'tester', 'http://localhost:8080/')
+        monkeypatch.setitem(app.config, 'HYBRID_SEARCH', False)
+        _, vector_results = get_local_search_results('university of edinburgh')
+        monkeypatch.setitem(app.config, 'HYBRID_SEARCH', True)
+        clean_query, results = get_local_search_results('university of edinburgh')
+    assert clean_query == 'university edinburgh'
+    for url in docs:
+        boost = results[url]['score'] - vector_results[url]['score']
+        assert round(boost, 6) == (1.0 if url == 'pearslocalphrase1' else 0.0)
@@ -0,0 +1,38 @@
+# SPDX-FileCopyrightText: 2025 PeARS Project, <community@pearsproject.org>,
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import numpy as np
+from app import app, db
+from app.api.models import Urls
+from app.indexer import controllers as indexer
+from app.indexer.mk_page_vector import tokenize_text, compute_vectors
+from app.indexer.pod_segments import load_pod_row, list_segments
+from app.utils_db import create_pod_npz_pos
+
+pages = {'http://batch.org/1': 'The castle stands on a rock above the old town.',
+         'http://batch.org/2': 'Trains leave the central station every ten minutes.',
+         'http://batch.org/3': 'Volcanoes erupt when pressure builds up under the crust.'}
+
+
+def fetch_url(url, contributor):
+    if url not in pages:
+        return None, ['ERROR: status code is 404']
+    return ('title', 'snippet', 'en', '', pages[url]), []
+
+
+def test_urls_are_indexed_in_batches(monkeypatch):
+    monkeypatch.setattr(indexer, 'fetch_url', fetch_url)
+    entries = [(url, 'Batches', 'tester') for url in pages]
+    entries += [('http://batch.org/1', 'Batches', 'tester'), ('http://batch.org/missing', 'Batches', 'tester')]
+    with app.app_context():
+        assert indexer.run_indexer_urls(entries, 'http://localhost:8080/', batch_size=2, workers=2) == 3
+        npz_path = create_pod_npz_pos('tester', 'Batches', 'en')+'.npz'
+        # One segment per batch that had pages for the pod
+        assert len(list_segments(npz_path)) == 2
+        for url, text in pages.items():
+            u = db.session.query(Urls).filter_by(url=url).one()
+            assert u.pod == 'Batches.u.tester'
+            expected = compute_vectors('en', [tokenize_text(text, 'en')])
+            assert np.allclose(load_pod_row(npz_path, u.vector).toarray(), expected.toarray())
+        assert db.session.query(Urls).filter_by(url='http://batch.org/missing').first() is None
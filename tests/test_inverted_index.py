@@ -0,0 +1,39 @@
+# SPDX-FileCopyrightText: 2025 PeARS Project, <community@pearsproject.org>,
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+from os.path import isfile
+import numpy as np
+from scipy.sparse import csr_matrix, save_npz, random as sparse_random
+from app.indexer.inverted_index import mk_invix, load_invix, invix_path, candidate_rows
+from app.search.sparse_scoring import sparse_cosines
+
+
+def test_candidates_hold_every_scored_row():
+    m = sparse_random(100, 300, density=0.02, format='csr', random_state=1)
+    invix = mk_invix(m)
+    dims = [5, 77, 140]
+    query_vector = np.zeros(300)
+    query_vector[dims] = 1.
+    rows = candidate_rows(invix, dims)
+    assert rows.tolist() == sorted(set(rows.tolist()))
+    assert rows.tolist() == np.nonzero(sparse_cosines(query_vector, m))[0].tolist()
+    assert candidate_rows(invix, []).tolist() == []
+
+
+def test_explicit_zeros_are_not_posted():
+    m = csr_matrix((np.array([1., 0.]), np.array([0, 1]), np.array([0, 2])), shape=(1, 2))
+    invix = mk_invix(m)
+    assert candidate_rows(invix, [1]).tolist() == []
+    assert candidate_rows(invix, [0]).tolist() == [0]
+
+
+def test_missing_index_is_built_on_load(tmp_path):
+    npz_path = str(tmp_path / 'Pod.u.tester.npz')
+    m = csr_matrix(np.array([[0., 1.], [1., 1.]]))
+    save_npz(npz_path, m)
+    assert not isfile(invix_path(npz_path))
+    invix = load_invix(npz_path)
+    assert isfile(invix_path(npz_path))
+    assert candidate_rows(invix, [0]).tolist() == [1]
+    assert (load_invix(npz_path) != invix).nnz == 0
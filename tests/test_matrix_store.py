@@ -0,0 +1,92 @@
+# SPDX-FileCopyrightText: 2025 PeARS Project, <community@pearsproject.org>,
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from app import VEC_SIZE
+from app.indexer.inverted_index import mk_invix
+from app.search import matrix_store
+from app.search.matrix_store import META_COLUMNS, MatrixStore, journal_write, journal_position, \
+        save_snapshot, load_snapshot
+
+
+def doc_meta(url, title='title'):
+    meta = {c: '' for c in META_COLUMNS}
+    meta.update(url=url, title=title, snippet='a snippet', pod='Store.u.tester')
+    return meta
+
+
+def mk_store(lang):
+    m = np.zeros((2, VEC_SIZE))
+    m[0, 1] = m[1, 2] = 1.
+    urls = ['http://a.org/0', 'http://a.org/1']
+    meta = {c: [doc_meta(url)[c] for url in urls] for c in META_COLUMNS}
+    return MatrixStore(lang, csr_matrix(m), [0, 2], ['Store.u.tester'], urls, meta, \
+            mk_invix(csr_matrix(m)), journal_position(lang))
+
+
+def test_journal_is_shared_between_workers():
+    worker1, worker2 = mk_store('j1'), mk_store('j1')
+    journal_write('j1', ('add', 'http://a.org/2', np.array([1, 3]), np.array([3., 4.]), doc_meta('http://a.org/2')))
+    journal_write('j1', ('rm', 'http://a.org/0'))
+    journal_write('j1', ('meta', 'http://a.org/1', doc_meta('http://a.org/1', 'new title')))
+    for store in (worker1, worker2):
+        assert store.sync()
+        assert store.n == 3 and store.urls[2] == 'http://a.org/2'
+        assert np.allclose(store.m[2, [1, 3]].toarray(), [[.6, .8]])
+        # The new row is not in the inverted index yet, the removed one is not alive
+        assert store.candidate_rows([1]).tolist() == [2]
+        assert store.meta[1]['title'] == 'new title'
+        assert store.rank_texts[1].startswith('new title')
+    # Nothing new to replay
+    offset = worker1.offset
+    assert worker1.sync() and worker1.offset == offset
+
+
+def test_rotated_journal_needs_a_rebuild(monkeypatch):
+    journal_write('j2', ('rm', 'http://a.org/0'))
+    store = mk_store('j2')
+    monkeypatch.setattr(matrix_store, 'JOURNAL_MAX_SIZE', 0)
+    # Workers only read the journal when its size has changed
+    journal_write('j2', ('rm', 'http://a.org/10'))
+    assert not store.sync()
+
+
+def test_appended_rows_are_indexed_when_too_many(monkeypatch):
+    monkeypatch.setattr(matrix_store, 'MAX_UNINDEXED_ROWS', 1)
+    store = mk_store('j3')
+    for i in range(2, 5):
+        store.append('http://a.org/%d' % i, np.array([1]), np.array([1.]), doc_meta('http://a.org/%d' % i))
+    assert store.candidate_rows([1]).tolist() == [0, 2, 3, 4]
+    assert store.invix.shape[0] == store.n
+
+
+def save(lang, fingerprint):
+    store = mk_store(lang)
+    save_snapshot(lang, store.m, store.bins, store.podnames, store.urls, store.meta.columns, \
+            store.invix, journal_position(lang), fingerprint)
+
+
+def test_snapshots_are_mapped_and_updated():
+    journal_write('s1', ('rm', 'http://a.org/0'))
+    save('s1', ['pods'])
+    store = load_snapshot('s1', ['pods'])
+    # The arrays are mapped read-only from the snapshot files
+    assert not store.m.data.flags.writeable and not store.m.indices.flags.writeable
+    assert store.urls == ['http://a.org/0', 'http://a.org/1']
+    assert store.meta[1]['url'] == 'http://a.org/1'
+    # Mapped buffers are copied, not written to, on append
+    store.append('http://a.org/2', np.array([1]), np.array([2.]), doc_meta('http://a.org/2'))
+    assert store.candidate_rows([1]).tolist() == [0, 2]
+    assert load_snapshot('s1', ['pods']).n == 2
+
+
+def test_stale_snapshots_are_not_loaded(monkeypatch):
+    journal_write('s2', ('rm', 'http://a.org/0'))
+    save('s2', ['pods'])
+    # The pods changed behind the journal's back
+    assert load_snapshot('s2', ['other pods']) is None
+    monkeypatch.setattr(matrix_store, 'JOURNAL_MAX_SIZE', 0)
+    journal_write('s2', ('rm', 'http://a.org/1'))
+    assert load_snapshot('s2', ['pods']) is None
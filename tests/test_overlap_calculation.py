@@ -0,0 +1,37 @@
+# SPDX-FileCopyrightText: 2025 PeARS Project, <community@pearsproject.org>,
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import numpy as np
+from app.search.overlap_calculation import snippet_overlap, batch_snippet_scores
+from app.search.matrix_store import rank_fields
+
+docs = [{'url': 'https://www.wikipedia.org/wiki/Paris', 'title': 'Paris', 'snippet': 'Paris is the capital of France.'},
+        {'url': 'https://paris.fr/', 'title': 'Ville de Paris', 'snippet': None},
+        {'url': 'https://example.org/france', 'title': None, 'snippet': 'Travel guides for France and Italy.'},
+        {'url': 'https://example.org/', 'title': '', 'snippet': ''}]
+
+
+def loop_scores(query, docs):
+    """ The per-document scoring that batch_snippet_scores replaces."""
+    scores = []
+    for u in docs:
+        if u['snippet'] is None:
+            score = 0.0
+        else:
+            score = snippet_overlap(query, ((u['title'] or '')+' '+u['snippet']).lower())
+        if query == rank_fields(u)[1]:
+            score += 0.5
+        for w in query.split():
+            if w in u['url']:
+                score += 0.1
+        scores.append(score)
+    return scores
+
+
+def test_batch_scores_match_loop():
+    texts, locs = zip(*[rank_fields(u) for u in docs])
+    for query in ('paris', 'paris france', 'france, italy!', 'example', 'wiki capital', 'nothing'):
+        scores = batch_snippet_scores(query, list(texts), [u['url'] for u in docs], list(locs))
+        assert np.allclose(scores, loop_scores(query, docs)), query
+    assert batch_snippet_scores('paris', [], [], []).tolist() == []
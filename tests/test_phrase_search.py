@@ -0,0 +1,59 @@
+# SPDX-FileCopyrightText: 2025 PeARS Project, <community@pearsproject.org>,
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import numpy as np
+from app.search.phrase_search import intersect_sorted, intersect_docs, match_sequence
+
+
+class Index:
+    """ A positional index over documents given as lists of token ids."""
+
+    def __init__(self, docs):
+        self.docs = docs
+
+    def postings(self, token_id):
+        doc_ids, lengths, positions = [], [], []
+        for doc_id in sorted(self.docs):
+            pos = [i for i, t in enumerate(self.docs[doc_id]) if t == token_id]
+            if pos:
+                doc_ids.append(doc_id)
+                lengths.append(len(pos))
+                positions += pos
+        return np.array(doc_ids, dtype=np.int64), np.append(0, np.cumsum(lengths, dtype=np.int64)), \
+                np.array(positions, dtype=np.int64)
+
+
+def brute_force(docs, token_ids, window):
+    """ Count the occurrences of the sequence that match_sequence
+    finds: ends of the sequence, each token at most window
+    positions after the closest preceding end of the sequence so far."""
+    counts = {}
+    for doc_id, tokens in docs.items():
+        ends = [i for i, t in enumerate(tokens) if t == token_ids[0]]
+        for token_id in token_ids[1:]:
+            ends = [i for i, t in enumerate(tokens) if t == token_id and \
+                    any(e < i for e in ends) and i - max(e for e in ends if e < i) <= window]
+        if ends:
+            counts[doc_id] = len(ends)
+    return counts
+
+
+def test_intersect_sorted():
+    a = np.array([1, 3, 5, 7, 9])
+    assert intersect_sorted(a, np.array([0, 3, 4, 9, 10])).tolist() == [3, 9]
+    assert intersect_sorted(a, np.array([], dtype=np.int64)).tolist() == []
+    assert intersect_sorted(np.array([10, 11]), a).tolist() == []
+    assert intersect_docs([[1, 2, 3, 4], [2, 4], [0, 2, 4, 6]]).tolist() == [2, 4]
+
+
+def test_match_sequence():
+    docs = {0: [1, 2, 3, 1, 2], 1: [1, 5, 2, 3], 2: [2, 1, 3, 2, 1], 5: [3, 2, 1]}
+    index = Index(docs)
+    for token_ids in ([1, 2], [1, 2, 3], [2, 1], [3]):
+        for window in (1, 2, 3):
+            candidates = intersect_docs([index.postings(t)[0] for t in token_ids])
+            matched, counts = match_sequence(index, token_ids, candidates, window)
+            assert dict(zip(matched.tolist(), counts.tolist())) == brute_force(docs, token_ids, window), (token_ids, window)
+    matched, counts = match_sequence(index, [1, 2], [])
+    assert matched.tolist() == [] and counts.tolist() == []
@@ -0,0 +1,57 @@
+# SPDX-FileCopyrightText: 2025 PeARS Project, <community@pearsproject.org>,
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from app import VEC_SIZE
+from app.utils_db import create_pod_npz_pos
+from app.indexer.pod_segments import append_to_pod, rm_from_pod, compact_pod, load_pod, \
+        load_pod_row, list_segments
+from app.indexer.signature import load_signature, podsum_path
+
+
+def mk_rows(n):
+    rows = np.zeros((n, VEC_SIZE))
+    for i in range(n):
+        rows[i, i] = 1.0
+    return csr_matrix(rows)
+
+
+def test_deleted_rows_leave_signature_straight_away():
+    npz_path = create_pod_npz_pos('tester', 'deletions', 'en')+'.npz'
+    first = append_to_pod(npz_path, mk_rows(3))
+    etag, _ = load_signature('en')
+
+    rm_from_pod(npz_path, first)
+    new_etag, _ = load_signature('en')
+    assert new_etag != etag
+    podsum = np.load(podsum_path(npz_path))
+    assert podsum[0] == 0 and podsum[1] == 1 and podsum[2] == 1
+
+    # Deleting twice, or compacting, leaves the signature alone
+    rm_from_pod(npz_path, first)
+    compact_pod(npz_path)
+    assert load_signature('en')[0] == new_etag
+    m, ids = load_pod(npz_path)
+    assert first not in ids
+    assert m.shape[0] == len(ids)
+
+
+def test_segments_are_appended_and_compacted():
+    npz_path = create_pod_npz_pos('tester', 'segments', 'en')+'.npz'
+    first = append_to_pod(npz_path, mk_rows(2))
+    second = append_to_pod(npz_path, mk_rows(3))
+    assert second == first + 2
+    assert len(list_segments(npz_path)) == 2
+    m, ids = load_pod(npz_path)
+    assert ids[-5:].tolist() == list(range(first, first + 5))
+    assert load_pod_row(npz_path, second + 2)[0, 2] == 1.0
+
+    compact_pod(npz_path)
+    assert list_segments(npz_path) == []
+    compacted, compacted_ids = load_pod(npz_path)
+    assert compacted_ids.tolist() == ids.tolist()
+    assert (compacted != m).nnz == 0
+    # Ids are not reused after compaction
+    assert append_to_pod(npz_path, mk_rows(1)) == first + 5
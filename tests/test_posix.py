@@ -0,0 +1,55 @@
+# SPDX-FileCopyrightText: 2025 PeARS Project, <community@pearsproject.org>,
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import joblib
+from app.indexer.posix import posix_path, load_posix, mk_columns, posix_columns, rm_doc_from_posix, compact_posix
+
+
+def test_legacy_conversion_is_done_once(tmp_path):
+    path = posix_path('tester', 'en', 'Legacy')
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    legacy = [{} for _ in range(10)]
+    legacy[3] = {1: '0|4', 2: '7'}
+    legacy[5] = {1: '1'}
+    joblib.dump(legacy, path)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        indices = list(executor.map(lambda _: load_posix('tester', 'en', 'Legacy'), range(8)))
+    for posindex in indices:
+        assert posindex.doc_ids().tolist() == [1, 2]
+        assert posindex.docs(3).tolist() == [1, 2]
+        assert posindex.positions(3, 1).tolist() == [0, 4]
+
+
+def add(docs, theme):
+    """ Index documents given as {doc id: token ids}."""
+    token_ids, doc_ids, positions = [], [], []
+    for doc_id, tokens in docs.items():
+        token_ids += tokens
+        doc_ids += [doc_id] * len(tokens)
+        positions += list(range(len(tokens)))
+    posix_columns(mk_columns(token_ids, doc_ids, positions), 'tester', 'en', theme)
+
+
+def check(posindex):
+    assert posindex.doc_ids().tolist() == [1, 3]
+    assert posindex.docs(7).tolist() == [1, 3]
+    docs, ptr, positions = posindex.postings(7)
+    assert docs.tolist() == [1, 3]
+    assert positions[ptr[0]:ptr[1]].tolist() == [0, 2] and positions[ptr[1]:ptr[2]].tolist() == [1]
+    assert posindex.positions(9, 3).tolist() == [0]
+    assert posindex.docs(8).tolist() == [1]
+
+
+def test_columnar_postings_across_segments():
+    add({1: [7, 8, 7], 2: [8, 7]}, 'Columns')
+    add({3: [9, 7]}, 'Columns')
+    rm_doc_from_posix(2, 'tester', 'en', 'Columns')
+    check(load_posix('tester', 'en', 'Columns'))
+    compact_posix(posix_path('tester', 'en', 'Columns'))
+    check(load_posix('tester', 'en', 'Columns'))
+    # A deleted document can come back
+    add({2: [9]}, 'Columns')
+    assert load_posix('tester', 'en', 'Columns').docs(9).tolist() == [2, 3]
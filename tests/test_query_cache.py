@@ -0,0 +1,36 @@
+# SPDX-FileCopyrightText: 2025 PeARS Project, <community@pearsproject.org>,
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+from app import app
+from app.utils_db import create_pod_npz_pos
+from app.indexer.pod_segments import load_live_rows, write_pod
+from app.search.matrix_store import index_generation, journal_position
+from app.search.query_cache import get_cached_results, cache_results
+
+
+def test_cached_results_depend_on_settings(monkeypatch):
+    monkeypatch.setitem(app.config, 'HYBRID_SEARCH', False)
+    cache_results('Paris  France', 'en', False, 'g1', (['a'], [1.0]))
+    assert get_cached_results('paris france', 'en', False, 'g1') == (['a'], [1.0])
+    assert get_cached_results('paris france', 'en', False, 'g2') is None
+    monkeypatch.setitem(app.config, 'HYBRID_SEARCH', True)
+    assert get_cached_results('paris france', 'en', False, 'g1') is None
+    monkeypatch.setitem(app.config, 'HYBRID_SEARCH', False)
+    monkeypatch.setitem(app.config, 'RERANK_CANDIDATES', app.config['RERANK_CANDIDATES'] + 1)
+    assert get_cached_results('paris france', 'en', False, 'g1') is None
+
+
+def test_pod_rewrites_change_generation():
+    npz_path = create_pod_npz_pos('tester', 'generations', 'en')+'.npz'
+    generation = index_generation('en')
+    cache_results('rewritten pod', 'en', False, generation, (['a'], [1.0]))
+    assert get_cached_results('rewritten pod', 'en', False, index_generation('en')) == (['a'], [1.0])
+
+    # Rewrite the pod behind the journal's back, as rebuilding from a backup does
+    position = journal_position('en')
+    m, ids, next_id = load_live_rows(npz_path)
+    write_pod(npz_path, m, ids, next_id + 1)
+    assert journal_position('en') == position
+    assert index_generation('en') != generation
+    assert get_cached_results('rewritten pod', 'en', False, index_generation('en')) is None
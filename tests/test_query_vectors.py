@@ -0,0 +1,26 @@
+# SPDX-FileCopyrightText: 2025 PeARS Project, <community@pearsproject.org>,
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from app.indexer.mk_page_vector import get_sp, compute_word_vectors, compute_query_vectors
+
+
+def test_one_processor_per_language():
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        processors = list(executor.map(lambda _: get_sp('en'), range(8)))
+    assert all(p is processors[0] for p in processors)
+
+
+def test_query_words_are_cached():
+    compute_word_vectors.cache_clear()
+    tokens, expanded, v, v_expanded = compute_query_vectors('volcano eruption', 'en', expansion_length=10)
+    assert compute_word_vectors.cache_info().misses == 2
+    # Callers get their own arrays, which they may modify
+    v[0][:] = 0
+    tokens2, expanded2, v2, v_expanded2 = compute_query_vectors('eruption of the volcano', 'en', expansion_length=10)
+    assert compute_word_vectors.cache_info().hits == 2
+    assert tokens2[3] == tokens[0] and expanded2[3] == expanded[0]
+    assert np.linalg.norm(v2[3]) > 0
+    assert np.allclose(v_expanded2[0], v_expanded[1])
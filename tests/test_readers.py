@@ -0,0 +1,51 @@
+# SPDX-FileCopyrightText: 2025 PeARS Project, <community@pearsproject.org>,
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import os
+import numpy as np
+from app import readers
+from app.readers import compile_cosines, load_cosines, cosines_paths
+
+vocab = {'▁river': 0, '▁bank': 1, '▁stream': 2, '▁water': 3}
+
+
+def mk_files(tmp_path):
+    cosine_file = str(tmp_path / 'test.cos')
+    vocab_file = str(tmp_path / 'test.vocab')
+    with open(cosine_file, 'w') as f:
+        f.write('▁river 0.5 ▁Stream ▁WATER ▁bank ▁unknown\n')
+    with open(vocab_file, 'w') as f:
+        f.write(''.join(w+' -1.0\n' for w in vocab))
+    return cosine_file, vocab_file
+
+
+def test_compile_cosines_lowercases_neighbours(tmp_path):
+    cosine_file, vocab_file = mk_files(tmp_path)
+    compile_cosines(cosine_file, vocab, vocab_file)
+    ids, lens = load_cosines(cosine_file, vocab, vocab_file)
+    assert lens[0] == 4
+    assert ids[0, :4].tolist() == [2, 3, 1, -1]
+    assert lens[1] == 0
+
+
+def test_load_cosines_recompiles_stale_arrays(tmp_path, monkeypatch):
+    cosine_file, vocab_file = mk_files(tmp_path)
+    ids_path = cosines_paths(cosine_file)[0]
+    load_cosines(cosine_file, vocab, vocab_file)
+    compiled = os.stat(ids_path).st_mtime_ns
+    load_cosines(cosine_file, vocab, vocab_file)
+    assert os.stat(ids_path).st_mtime_ns == compiled
+
+    # A newer vocabulary file
+    st = os.stat(vocab_file)
+    os.utime(vocab_file, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    other_vocab = {'▁bank': 0, '▁river': 1, '▁stream': 2, '▁water': 3}
+    ids, _ = load_cosines(cosine_file, other_vocab, vocab_file)
+    assert ids[1, :3].tolist() == [2, 3, 0]
+
+    # Arrays of another format
+    monkeypatch.setattr(readers, 'COSINES_FORMAT', readers.COSINES_FORMAT + 1)
+    np.save(ids_path, np.zeros((4, 4), dtype=np.int32))
+    ids, _ = load_cosines(cosine_file, other_vocab, vocab_file)
+    assert ids[1, :3].tolist() == [2, 3, 0]
@@ -0,0 +1,60 @@
+# SPDX-FileCopyrightText: 2025 PeARS Project, <community@pearsproject.org>,
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import shutil
+from os.path import join
+import numpy as np
+from scipy.sparse import csr_matrix
+from app import app, db, VEC_SIZE
+from app.api.models import Urls, Pods
+from app.utils_db import create_pod_in_db, create_pod_npz_pos, create_or_replace_url_in_db, pod_dir
+from app.indexer.pod_segments import append_to_pod, rm_from_pod, compact_pod, load_pod, id_rows
+from app.cli.rebuild import rebuild_pods_and_urls
+from conftest import instance_dir
+
+
+def mk_rows(n, offset):
+    rows = np.zeros((n, VEC_SIZE))
+    for i in range(n):
+        rows[i, offset+i] = 1.0
+    return csr_matrix(rows)
+
+
+def test_rebuild_keeps_stable_ids(tmp_path):
+    with app.app_context():
+        create_pod_in_db('rebuilder', 'Backup', 'en')
+        npz_path = create_pod_npz_pos('rebuilder', 'Backup', 'en')+'.npz'
+        first = append_to_pod(npz_path, mk_rows(3, 0))
+        compact_pod(npz_path)
+        second = append_to_pod(npz_path, mk_rows(2, 3))
+        vids = [first, first+1, first+2, second, second+1]
+        for i, vid in enumerate(vids):
+            create_or_replace_url_in_db('http://doc%d' % i, 'doc', vid, '', '', 'Backup', 'en', '', '', 'rebuilder', 'url')
+        # A tombstoned row, whose url was not deleted, is not restored
+        rm_from_pod(npz_path, first+1)
+        m, ids = load_pod(npz_path)
+        rows, _ = id_rows(ids, vids)
+        before = m[rows].toarray()
+
+        # Back up the instance, then empty it
+        basedir = tmp_path / 'backup'
+        shutil.copytree(pod_dir, basedir / 'pods')
+        shutil.copy(join(instance_dir, 'PeARS-sociofillmore', 'app.db'), basedir / 'app.db')
+        Urls.query.filter_by(pod='Backup.u.rebuilder').delete()
+        Pods.query.filter_by(name='Backup.u.rebuilder').delete()
+        db.session.commit()
+        shutil.rmtree(join(pod_dir, 'rebuilder'))
+
+        rebuild_pods_and_urls(pod_dir, str(basedir))
+        restored = {u.url: u.vector for u in Urls.query.filter_by(pod='Backup.u.rebuilder').all()}
+        assert restored == {'http://doc%d' % i: vid for i, vid in enumerate(vids) if vid != first+1}
+        m, ids = load_pod(npz_path)
+        assert ids.tolist() == [vid for vid in vids if vid != first+1]
+        rows, found = id_rows(ids, vids)
+        for i, vid in enumerate(vids):
+            if vid != first+1:
+                assert found[i]
+                assert np.array_equal(m[rows[i]].toarray(), before[i:i+1])
+        # New rows do not reuse the ids of the backup
+        assert append_to_pod(npz_path, mk_rows(1, 5)) > max(vids)
@@ -0,0 +1,67 @@
+# SPDX-FileCopyrightText: 2025 PeARS Project, <community@pearsproject.org>,
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+from unittest import mock
+import numpy as np
+from scipy.sparse import csr_matrix
+from sqlalchemy import event
+from app import app, db, VEC_SIZE
+from app.api.models import Urls
+from app.indexer.controllers import run_indexer_manual
+from app.utils_db import create_pod_in_db, create_pod_npz_pos, create_or_replace_url_in_db
+from app.indexer.pod_segments import append_to_pod
+from app.search.matrix_store import META_COLUMNS, DocMeta
+from app.search.score_pages import mk_vec_matrix, load_vec_matrix, output
+
+
+def test_mk_vec_matrix_loads_one_language():
+    with app.app_context():
+        for lang, theme in (('en', 'Vectors'), ('fr', 'Vecteurs')):
+            create_pod_in_db('matrix', theme, lang)
+            npz_path = create_pod_npz_pos('matrix', theme, lang)+'.npz'
+            rows = np.zeros((2, VEC_SIZE))
+            rows[0, 1] = rows[1, 2] = 2.0
+            vid = append_to_pod(npz_path, csr_matrix(rows))
+            for i in range(2):
+                create_or_replace_url_in_db('http://%s/%d' % (lang, i), 'doc', vid+i, 'snippet', '', theme, lang, '', '', 'matrix', 'url')
+        m, bins, podnames, urls, meta, invix = mk_vec_matrix('en')
+    assert all(not url.startswith('http://fr/') for url in urls)
+    assert set(meta) == set(META_COLUMNS)
+    rows = [i for i, url in enumerate(urls) if url.startswith('http://en/')]
+    assert [urls[i] for i in rows] == ['http://en/0', 'http://en/1']
+    assert [meta['pod'][i] for i in rows] == ['Vectors.u.matrix'] * 2
+    assert m[rows[0], 1] == 1.0 and m[rows[1], 2] == 1.0
+    assert m.shape[0] == len(urls) == bins[-1] == invix.shape[0]
+
+
+def test_doc_meta_rows():
+    meta = DocMeta({c: [c+'0'] for c in META_COLUMNS})
+    meta.append({c: c+'1' for c in META_COLUMNS})
+    meta[0] = dict(meta[0], title='new')
+    assert len(meta) == 2
+    assert meta[0]['title'] == 'new' and meta[1]['url'] == 'url1'
+    assert [u['id'] for u in meta] == ['id0', 'id1']
+
+
+def test_results_are_served_from_the_store():
+    with app.app_context():
+        with mock.patch('app.indexer.mk_page_vector.get_frame_annotations', return_value=''):
+            run_indexer_manual('pearslocalmeta', 'Meta', 'One two three four five six seven eight nine ten eleven twelve', \
+                    'Metadata', 'en', 'a note', 'tester', 'http://localhost:8080/')
+        load_vec_matrix('en')
+        # Metadata changes reach the store through the journal
+        u = db.session.query(Urls).filter_by(url='pearslocalmeta').one()
+        u.title = 'New title'
+        db.session.commit()
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            results = output(['pearslocalmeta'], [1.5], 'en')
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+    assert statements == []
+    result = results['pearslocalmeta']
+    assert set(result) == set(META_COLUMNS) | {'score'}
+    assert result['title'] == 'New title' and result['notes'] == '@tester >> a note' and result['score'] == 1.5
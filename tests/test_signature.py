@@ -0,0 +1,55 @@
+# SPDX-FileCopyrightText: 2025 PeARS Project, <community@pearsproject.org>,
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import json
+from types import SimpleNamespace
+import numpy as np
+from scipy.sparse import csr_matrix
+from app import app, VEC_SIZE
+from app.utils_db import create_pod_npz_pos
+from app.indexer.pod_segments import append_to_pod
+from app.search import cross_instance_search as cis
+
+url = '/api/signature/en/'
+
+
+def add_doc(theme, dim):
+    row = np.zeros((1, VEC_SIZE))
+    row[0, dim] = 1.
+    append_to_pod(create_pod_npz_pos('tester', theme, 'en')+'.npz', csr_matrix(row))
+
+
+def test_signature_is_served_with_an_etag():
+    client = app.test_client()
+    add_doc('Signatures', 5)
+    resp = client.get(url, query_string={'format': 'sparse'})
+    etag = resp.headers['ETag']
+    dense = np.array(json.loads(client.get(url).data))
+    data = resp.get_json()
+    assert data['size'] == VEC_SIZE == len(dense)
+    assert np.allclose(dense[data['indices']], data['values'])
+    assert np.count_nonzero(dense) == len(data['indices'])
+
+    assert client.get(url, query_string={'format': 'sparse'}, headers={'If-None-Match': etag}).status_code == 304
+    add_doc('Signatures', 6)
+    resp = client.get(url, query_string={'format': 'sparse'}, headers={'If-None-Match': etag})
+    assert resp.status_code == 200 and resp.headers['ETag'] != etag
+
+
+def test_peers_download_changed_signatures_only(monkeypatch):
+    client = app.test_client()
+    sent = []
+    def get(url, params=None, headers=None):
+        resp = client.get(url, query_string=params, headers=headers)
+        sent.append(resp.status_code)
+        return SimpleNamespace(status_code=resp.status_code, headers=resp.headers, json=resp.get_json)
+    monkeypatch.setattr(cis.utils_http, 'get', get)
+    monkeypatch.setattr(cis, 'signature_cache', {})
+    add_doc('Peers', 5)
+    signature = cis.get_signature(url)
+    assert np.allclose(signature, json.loads(client.get(url).data))
+    assert np.allclose(cis.get_signature(url), signature)
+    add_doc('Peers', 6)
+    assert not np.allclose(cis.get_signature(url), signature)
+    assert sent == [200, 304, 200]
@@ -0,0 +1,42 @@
+# SPDX-FileCopyrightText: 2025 PeARS Project, <community@pearsproject.org>,
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import numpy as np
+from scipy.sparse import csr_matrix, random as sparse_random
+from app.search.sparse_scoring import normalise_rows, sparse_cosines
+
+
+def dense_cosines(query_vector, m):
+    """ The dense implementation that sparse_cosines replaces."""
+    a = np.nonzero(query_vector)[0]
+    m_a = m[:, a]
+    q = query_vector[a]
+    norms = np.linalg.norm(m_a, axis=1)
+    cos = np.zeros(m.shape[0])
+    nz = norms != 0
+    cos[nz] = m_a[nz] @ q / (norms[nz] * np.linalg.norm(q))
+    return cos
+
+
+def test_sparse_cosines_match_dense():
+    m = sparse_random(50, 200, density=0.05, format='csr', random_state=0)
+    query_vector = np.zeros(200)
+    query_vector[[3, 17, 42, 99]] = [1., 2., .5, 3.]
+    expected = dense_cosines(query_vector, m.toarray())
+    assert np.allclose(sparse_cosines(query_vector.reshape(1, -1), m), expected)
+    # Row scaling does not change the restricted cosine
+    assert np.allclose(sparse_cosines(query_vector, normalise_rows(m)), expected)
+
+
+def test_sparse_cosines_edge_cases():
+    m = csr_matrix(np.array([[0., 1., 0.], [1., 0., 0.]]))
+    assert sparse_cosines(np.array([0., 2., 0.]), m).tolist() == [1., 0.]
+    assert sparse_cosines(np.zeros(3), m).tolist() == [0., 0.]
+    assert sparse_cosines(np.ones(3), csr_matrix((0, 3))).tolist() == []
+
+
+def test_normalise_rows():
+    m = normalise_rows(csr_matrix(np.array([[3., 4.], [0., 0.]])))
+    assert m.format == 'csr'
+    assert np.allclose(m.toarray(), [[.6, .8], [0., 0.]])
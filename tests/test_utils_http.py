@@ -0,0 +1,55 @@
+# SPDX-FileCopyrightText: 2025 PeARS Project, <community@pearsproject.org>,
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import threading
+from time import sleep
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+import requests
+from app import app, utils_http
+
+hits = {}
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        hits[self.path] = hits.get(self.path, 0) + 1
+        if self.path == '/slow':
+            sleep(0.5)
+        self.send_response(503 if self.path == '/unavailable' else 200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'ok')
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setitem(app.config, 'HTTP_RETRIES', 2)
+    monkeypatch.setitem(app.config, 'HTTP_BACKOFF', 0)
+    monkeypatch.setattr(utils_http, 'session', None)
+    hits.clear()
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield 'http://127.0.0.1:%d' % httpd.server_address[1]
+    httpd.shutdown()
+
+
+def test_read_timeouts_are_not_retried(server):
+    with pytest.raises(requests.RequestException):
+        utils_http.get(server+'/slow', timeout=0.1)
+    assert hits['/slow'] == 1
+
+
+def test_transient_errors_are_retried(server):
+    assert utils_http.get(server+'/unavailable').status_code == 503
+    assert hits['/unavailable'] == 3
+
+
+def test_budgeted_requests_are_not_retried(server, monkeypatch):
+    monkeypatch.setattr(utils_http, 'budget_session', None)
+    assert utils_http.get(server+'/unavailable', retries=False).status_code == 503
+    assert hits['/unavailable'] == 1
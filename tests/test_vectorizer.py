@@ -0,0 +1,26 @@
+# SPDX-FileCopyrightText: 2025 PeARS Project, <community@pearsproject.org>,
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import numpy as np
+from sklearn.feature_extraction.text import CountVectorizer
+from app.indexer.vectorizer import encode_docs_batch
+
+vocab = {'▁the': 0, '▁of': 1, '▁river': 2, '▁bank': 3}
+# Stopword-like subwords get no weight
+weights = np.array([0.0, 0.0, 2.0, 3.0])
+vectorizer = CountVectorizer(vocabulary=vocab, lowercase=True, token_pattern='[^ ]+')
+
+
+def test_encode_docs_batch_normalises_rows():
+    X = encode_docs_batch(['▁the ▁river ▁bank', '▁bank'], vectorizer, weights, 10)
+    norms = np.sqrt(np.asarray(X.multiply(X).sum(axis=1)).ravel())
+    assert np.allclose(norms, 1)
+
+
+def test_encode_docs_batch_empty_documents():
+    X = encode_docs_batch(['', '▁the ▁of ▁the', '▁river'], vectorizer, weights, 10)
+    assert np.isfinite(X.data).all()
+    assert X[0].nnz == 0
+    assert X[1].nnz == 0
+    assert np.allclose(X[2].toarray(), [[0, 0, 1, 0]])